@@ -29,7 +29,12 @@
 // NOTE: These are the available options for the rh_cp_server.
 var DEFAULTS = { UserPort : 8888, 
                  Log_STDOUT : false,
-                 Log_STDERR : false  };
+                 Log_STDERR : false,
+                 SharedGateway : false,
+                 LazyTree : false,
+                 LogLevel : 'INFO',
+                 StandbyGateways : 0,
+                 ResumeGraceSec : 30 };
 
 module.exports = function (app, options) {
 
@@ -50,6 +55,12 @@ module.exports = function (app, options) {
         }
     }
     
+    rh_session.configure({ sharedGateway : settings.SharedGateway,
+                           lazyTree : settings.LazyTree,
+                           logLevel : settings.LogLevel,
+                           standbyGateways : settings.StandbyGateways,
+                           resumeGraceSec : settings.ResumeGraceSec });
+    
     // Merge user site and the base.
     app.use(express.static(__dirname + "/site"));
     
@@ -75,10 +86,14 @@ module.exports = function (app, options) {
     // When the browser's JS reaches out, the real work starts.
     // See "Server" @ https://github.com/LearnBoost/socket.io/wiki/Exposed-events
     // The "sockets" member only has one named event: connection.
-    // FIXME: What to do when client is reconnecting/refreshing?  Seems to cause ZeroRPC
-    //        and child process artifacts in rh_session occasionally (i.e., rh_gateway.py
-    //        instances sleeping in the background for all TIME ... Time... time...)
+    // A client reconnecting with its session's token (within ResumeGraceSec) 
+    // resumes that session; a refreshed page starts a new one.
     sio.sockets.on('connection', function(socket) {
+        var session = rh_session.resumeSessionForSocket(socket);
+        if (null != session) {
+            console.info('Resumed client session ' + session.sessionID() + ' on: ' + socket.id);
+            return;
+        }
         console.info('Establishing client session: ' + socket.id);      
         session = rh_session.getSessionForSocket(socket);
         if (settings.Log_STDERR) {
@@ -75,6 +75,12 @@
 var socket = io.connect();
 jQuery.noConflict();
 (function($) {    
+    // The session's resume token and the last version of its changes 
+    // processed.  Socket.io reconnects with them in the handshake query so
+    // the server resumes the session (see util/rh_session.js).
+    var sessionToken = null;
+    var sessionVersion = 0;
+    
     // Setup Socket.io when the document is ready.
     $( document ).ready( function() {
         socket.on('connect', function () {
@@ -84,14 +90,50 @@ jQuery.noConflict();
             alert('Failed to connect to gateway.');
             socket.disconnect();
         });
+        socket.on('session', function(session) {
+            if (!session.resumed) {
+                if (null != sessionToken) {
+                    // Not resumed; the new session sends the whole tree again.
+                    $('.hawkeye_widget').remove();
+                }
+                sessionVersion = 0;
+            }
+            sessionToken = session.token;
+            setResumeQuery();
+        });
+        socket.on('version', function(version) {
+            sessionVersion = version;
+            setResumeQuery();
+            socket.emit('ack', version);
+        });
         socket.on('message', processMessages);
     });
     
+    function setResumeQuery() {
+        socket.socket.options.query = 'token=' + encodeURIComponent(sessionToken) + 
+                                      '&version=' + sessionVersion;
+    };
+    
     
     function processMessages(messages) {
         messages = JSON.parse(messages);
+        var credits = {};
         messages.forEach( function(message) {
+            // Return the credit of every frame received, whether or not it renders 
+            // (or still has a widget), so none is used up for good.  The gateway 
+            // ignores credits for streams that are not flow controlled.  They are
+            // keyed by domain too since an rhid is only unique within it.
+            if (message && ('stream' == message.change) && message.more) {
+                var key = (message.more.domainID || '') + '/' + message.rhid;
+                if (!(key in credits)) {
+                    credits[key] = stripMessage(message);
+                    credits[key].change = 'credit';
+                    credits[key].more.credits = 0;
+                }
+                credits[key].more.credits++;
+            }
             try {
+                decodeSamples(message);
                 switch (message.change) {
                     case 'add':
                         // Attempt a query.  
@@ -102,7 +144,7 @@ jQuery.noConflict();
                             $awidget = getNewWidgetForMessage(message);
                             if (null != $awidget) {
                                 var $parent = getParentFromMessage(message);
-                                $awidget.appendTo($parent);
+                                $awidget.addClass('hawkeye_widget').appendTo($parent);
                                 
                                 // Set hide/show relative to siblings if they exist.  If none exists,
                                 // hide the new widget, initially.
@@ -131,9 +173,10 @@ jQuery.noConflict();
                     case 'update':
                     case 'stream':
                         var $theWidget = $("#" + cleanRHID(message.rhid));
-                        if ($theWidget.length)
-                            $theWidget.data("hawkeye-" + message.rhtype + "_container")
-                                      .configureMessage(message);
+                        if ($theWidget.length) {
+                            var widget = $theWidget.data("hawkeye-" + message.rhtype + "_container");
+                            widget.configureMessage(message);
+                        }
                         break;
                     default:
                         console.error("Unknown change type: " + message.change);
@@ -146,6 +189,14 @@ jQuery.noConflict();
                 return false;
             }
         });
+        
+        var returned = [];
+        for (var key in credits) {
+            returned.push(credits[key]);
+        }
+        if (returned.length) {
+            requestAll(returned);
+        }
         return true;
     };
     
@@ -333,6 +384,10 @@ jQuery.noConflict();
      * Events: Raises 'configured' when configureMessage successfully sets
      * the message.  Function sig is: function (event, data){} where data is the
      * RH_Message that was configured.
+     * 
+     * If the gateway is lazy, messages carry `expandable` and `expanded` in `more`
+     * and clicking the label requests the children ('expand') when showing them
+     * or frees them ('collapse') when hiding them.
      */
     $.widget("hawkeye.default_msg_container", $.hawkeye.default_container, {
         options: {
@@ -341,9 +396,19 @@ jQuery.noConflict();
             configured: $.noop
         },
         _create: function () {
+            this.expandable = false;
+            this.expanded = false;
             this._super(); // calls update.
+            this.$label.click($.proxy(this._toggleExpanded, this));
             this.configureMessage(this.options.message);
         },
+        _toggleExpanded: function () {
+            if (this.expandable) {
+                var msg = stripMessage(this.options.message);
+                msg.change = (this.expanded) ? 'collapse' : 'expand';
+                request(msg);
+            }
+        },
         _setOption: function (key, value) {
             if ('message' == key) {
                 this.configureMessage(value);
@@ -352,6 +417,10 @@ jQuery.noConflict();
         // Children should extend this call.
         configureMessage: function (newMessage) {
             if (null != newMessage) {
+                if ('expandable' in newMessage.more) {
+                    this.expandable = newMessage.more.expandable;
+                    this.expanded = newMessage.more.expanded;
+                }
                 this.options.message = newMessage;
                 this.options.type = this.options.message.rhtype;
                 this.options.labelText = this.options.message.rhname;
@@ -493,8 +562,16 @@ jQuery.noConflict();
     
     /*
      * Port container adds stats table and start/stop button behavior.
+     * The `streamFormat` option is sent with `start` (BULKIO ports 
+     * support 'json' and 'binary').  If `streamCredits` is set, the
+     * stream is flow controlled: the gateway sends at most that many
+     * frames ahead of those rendered (0 disables flow control).
      */
     $.widget("hawkeye.port_container", $.hawkeye.default_msg_container, {
+        options: {
+            streamFormat: 'binary',
+            streamCredits: 8
+        },
         _create: function () {
             this.$table = $('<table>').data_table({num_columns: 2, num_rows: 2})
                                       .addClass('port_statistics')
@@ -524,7 +601,8 @@ jQuery.noConflict();
                 if ('Start' != this.$startstop.attr('value')) {
                     this.$startstop
                         .attr('value', 'Start')
-                        .attr('onclick', getActionString(newMessage, 'start', true));
+                        .attr('onclick', getActionString(newMessage, 'start', true, 
+                                                         this._streamOptions()));
                 }   
             }
             else if ('stream' == newMessage.change) {
@@ -543,6 +621,14 @@ jQuery.noConflict();
                 }
             }
             this._super(newMessage);
+        },
+        // Options sent in `more` when starting the stream.
+        _streamOptions: function () {
+            var more = {format: this.options.streamFormat};
+            if (this.options.streamCredits) {
+                more.credits = this.options.streamCredits;
+            }
+            return more;
         }
     });
     
@@ -735,6 +821,14 @@ function request(data) {
     socket.send(data);
 }
 
+/*
+ * Same as request() for an array of RH_Message sent together.
+ * @param data Array of RH_Message.
+ */
+function requestAll(data) {
+    socket.send(JSON.stringify(data));
+}
+
 /* Creates a request() string which is the one callback defined in
  * the index_template.html file that a client should use to issue
  * messages and commands back to the gateway.
@@ -742,16 +836,22 @@ function request(data) {
  * @param msg The reference RH_Message to copy (except for change)
  * @param change The change type to request (update, add, etc.)
  * @param trimMore (optional) If True, more is trimmed to parentID.
+ * @param more (optional) Associative array of keys to set in more.
  * 
  * @return String capable of being used as DOM Element's event action
  *         (onclick, etc.) pointed at the request() method.
  * 
  */
-function getActionString(msg, change, trimMore) {
+function getActionString(msg, change, trimMore, more) {
     var action = msg;
     if (trimMore) {
         action = stripMessage(msg);
     }
     action.change = change;
+    if (typeof more !== "undefined") {
+        for (var key in more) {
+            action.more[key] = more[key];
+        }
+    }
     return "request(" + JSON.stringify(action) + ")";
 }
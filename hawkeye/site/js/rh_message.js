@@ -67,7 +67,8 @@ function keyifyRHID(rhid) {
 }
     
 /*
- * Strips an RH Message's `more` field to only the ParentID.
+ * Strips an RH Message's `more` field to only the ParentID (and DomainID, 
+ * if present, which the gateway uses to route messages to the right domain).
  * @param message The message to reference
  * @param copy Whether or not to copy the message first.
  */
@@ -75,5 +76,45 @@ function stripMessage(message) {
     var temp = new RH_Message(message.change, message.rhtype, message.rhid, 
             message.rhname);
     temp.more.parentID = message.more.parentID;
+    if (typeof message.more.domainID !== "undefined") {
+        temp.more.domainID = message.more.domainID;
+    }
     return temp;
 }
+
+/*
+ * Typed array constructors for the `dtype` of binary stream messages.
+ */
+var RH_DTYPES = {
+    '|i1': Int8Array,   '|u1': Uint8Array,
+    '<i2': Int16Array,  '<u2': Uint16Array,
+    '<i4': Int32Array,  '<u4': Uint32Array,
+    '<f4': Float32Array, '<f8': Float64Array
+};
+
+/*
+ * Decodes a binary `stream` message in place so that `more.data` is, like
+ * the json format, an array of rows (typed arrays) per `more.shape`.
+ * Messages in any other format are returned untouched.
+ * @param message The RH_Message to decode.
+ * @return message
+ */
+function decodeSamples(message) {
+    if ((typeof message.more === "undefined") || ('binary' != message.more.format) ||
+        (typeof message.more.data !== "string")) {
+        return message;
+    }
+    var raw = atob(message.more.data);
+    var bytes = new Uint8Array(raw.length);
+    for (var i = 0; i < raw.length; i++) {
+        bytes[i] = raw.charCodeAt(i);
+    }
+    var values = new RH_DTYPES[message.more.dtype](bytes.buffer);
+    var columns = message.more.shape[message.more.shape.length - 1];
+    var rows = [];
+    for (var r = 0; r * columns < values.length; r++) {
+        rows.push(values.subarray(r * columns, (r + 1) * columns));
+    }
+    message.more.data = rows;
+    return message;
+}
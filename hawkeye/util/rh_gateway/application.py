@@ -29,8 +29,10 @@ from ossie.utils import redhawk
 # Message includes 'running' state (True if started, False otherwise).
 class Application(Proxy_Base):    
     def _finish_init_(self):
-        for c in self._obj.comps:
-            self._children.append(Component(c, self, self._outbox))
+        pass
+    
+    def _createChildren(self):
+        self._children += self._createEach(Component, self._call(getattr, self._obj, 'comps'))
     
     def getMessage(self, change='update'):
         message =  RH_Message(change, 
@@ -39,25 +41,25 @@ class Application(Proxy_Base):
                           self.getName,
                           {'parentID': self._parent.getID})
         if ('remove' != change):
-            message['more'].update({'running' : self._obj._get_started()})
+            message['more'].update({'running' : self._call(self._obj._get_started)})
         return message;
     
     def _processThisMessage(self, message):
         # TODO: What other kinds of messages does this entity require?
         if ('update' == message['change']):
-            if (0 == len(self._children)):
-                # Should have children.  Reattempt _finish_init_()
-                self._finish_init_()
+            if (0 == len(self._children)) and self._expanded:
+                # Should have children.  Reattempt _createChildren()
+                self._createChildren()
             return self.getUpdateFromHere('update')
-        elif ('start' == message['change']) and not self._obj._get_started():
-            self._obj.start();
+        elif ('start' == message['change']) and not self._call(self._obj._get_started):
+            self._call(self._obj.start);
             return [self.getMessage()]
         elif ('stop' == message['change']):
-            if (self._obj._get_started()):
-                self._obj.stop();
+            if (self._call(self._obj._get_started)):
+                self._call(self._obj.stop);
                 return [self.getMessage()]
             else:
-                self._obj.releaseObject();
+                self._call(self._obj.releaseObject);
                 
         # default response
         return []
@@ -0,0 +1,491 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Control-plane microbenchmarks for the proxy tree and message routing.
+
+Builds a synthetic domain of stand-in REDHAWK objects (no running domain is
+needed, though the REDHAWK Python packages must be importable) and times the
+gateway's control plane against it:
+   `message`   ==> RH_Message construction
+   `build`     ==> Creating the whole proxy tree (discovery)
+   `route`     ==> RH_Gateway.passMessages of an 'update' to one component
+   `process`   ==> Domain.processMessage of the same
+   `refresh`   ==> getUpdateFromHere('update') of the domain, uncached
+   `cached`    ==> The same served from the proxies' cached messages
+   `ids`       ==> updateDescendentIDs of the domain
+   `odm`       ==> Applying ODM events removing and re-adding device managers
+   `split`     ==> splitDictLists of two device lists differing by a few
+Each reports the min and median seconds per call over --repeat runs and the
+peak bytes and net blocks allocated by a call: with tracemalloc (Python 3) 
+those are traced allocations; otherwise they are the growth of the process'
+max RSS and the net objects tracked by the garbage collector.  Calls on the
+stand-ins are made inline (Inline_Pool) rather than on the CORBA threads.
+
+With --startup, new gateway processes are timed instead:
+   `import`    ==> Importing rh_gateway in a new interpreter
+   `startup`   ==> From the start of rh_gateway.py's __main__ (a --standby
+                   gateway) to its "RH Gateway started successfully."
+and the heavy modules (HEAVY_MODULES) the import left for later are listed.
+
+Usage:
+   python benchmark.py --devices 16 --save baseline.json
+   python benchmark.py --devices 16 --compare baseline.json
+   python benchmark.py --startup --save startup.json
+With --compare, a benchmark whose min (the least noisy) is more than 
+--tolerance slower than the baseline's is reported and the exit status is 1.
+"""
+
+from core import RH_Message, Proxy_Index
+from domain import Domain
+from comp_dev import CompDev_Base
+from session import Session
+from utilities import splitDictLists
+from rh_gateway import RH_Gateway
+from corba_pool import CORBA_Pool
+from log import configureLogging
+
+import sys, os, gc, time, json, argparse, shutil, subprocess, tempfile
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+"""
+Stand-in REDHAWK objects with only what the proxies use.  Every call returns
+immediately so the benchmarks measure the gateway rather than CORBA.
+"""
+class Stand_In(object):
+    def __init__(self, identifier, name):
+        self._identifier = identifier
+        self.name = name
+        self.ref = self
+
+    def _get_identifier(self):
+        return self._identifier
+
+    def _non_existent(self):
+        return False
+
+class Stand_In_Interface(object):
+    nameSpace = 'CF'
+    name = 'Resource'
+    filename = ''
+
+class Stand_In_Port(object):
+    def __init__(self, name):
+        self._name = name
+        self._direction = 'Provides'
+        self._interface = Stand_In_Interface()
+
+class Stand_In_Property(object):
+    type = 'double'
+    mode = 'readwrite'
+
+    def __init__(self, identifier, value):
+        self.id = identifier
+        self.clean_name = identifier
+        self._value = value
+
+    def queryValue(self):
+        return self._value
+
+    def fromAny(self, value):
+        return value
+
+class Stand_In_Resource(Stand_In):
+    usageState = 'IDLE'
+
+    def __init__(self, identifier, name, ports, properties):
+        Stand_In.__init__(self, identifier, name)
+        self.ports = [Stand_In_Port('port_{0}'.format(i)) for i in range(ports)]
+        self._propertySet = [Stand_In_Property('prop_{0}'.format(i), float(i))
+                             for i in range(properties)]
+
+    def _get_started(self):
+        return True
+
+    def query(self, props):
+        return []
+
+class Stand_In_Device_Manager(Stand_In):
+    def __init__(self, identifier, devices, ports, properties):
+        Stand_In.__init__(self, identifier, identifier)
+        self.devs = [Stand_In_Resource('{0}:dev_{1}'.format(identifier, i), 'dev_{0}'.format(i),
+                                       ports, properties) for i in range(devices)]
+        self.services = []
+
+class Stand_In_Application(Stand_In):
+    def __init__(self, identifier, components, ports, properties):
+        Stand_In.__init__(self, identifier, identifier)
+        self.comps = [Stand_In_Resource('{0}:comp_{1}'.format(identifier, i), 'comp_{0}'.format(i),
+                                        ports, properties) for i in range(components)]
+
+    def _get_started(self):
+        return True
+
+class Stand_In_Domain(Stand_In):
+    def __init__(self, devMgrs, devices, apps, components, ports, properties):
+        Stand_In.__init__(self, 'BENCH_DOMAIN_ID', 'BENCH_DOMAIN')
+        self.devMgrs = [Stand_In_Device_Manager('devmgr_{0}'.format(i), devices, ports, properties)
+                        for i in range(devMgrs)]
+        self.apps = [Stand_In_Application('app_{0}'.format(i), components, ports, properties)
+                     for i in range(apps)]
+
+class Stand_In_Event(object):
+    def __init__(self, sourceId, sourceCategory):
+        self.sourceId = sourceId
+        self.sourceCategory = sourceCategory
+
+
+"""
+CORBA_Pool making every call inline, as it does off the hub.  The stand-ins
+return immediately so handing their calls to threads would only measure the
+handoff.
+"""
+class Inline_Pool(CORBA_Pool):
+    def call(self, fn, *args, **kwargs):
+        self.calls += 1
+        return fn(*args, **kwargs)
+
+    def map(self, fn, items):
+        results = []
+        for item in items:
+            try:
+                results.append(fn(item))
+            except Exception as e:
+                self._report(e)
+        return results
+
+
+# Domain proxy that does not connect to the (stand-in's) event channels.
+class Bench_Domain(Domain):
+    def __connect_channels__(self):
+        pass
+
+
+"""
+Times fn() `number` times per run for `repeat` runs.
+@return Dictionary of the `min` and `median` seconds per call, and the
+    `peakBytes` and `blocks` (net) allocated by one call (see _allocations).
+"""
+def measure(fn, number=10, repeat=5):
+    fn() # Warm-up
+    times = []
+    for r in range(repeat):
+        gc.collect()
+        start = time.time()
+        for i in range(number):
+            fn()
+        times.append((time.time() - start) / number)
+    times.sort()
+    result = {'min': times[0], 'median': times[len(times) // 2]}
+    result['peakBytes'], result['blocks'] = _allocations(fn)
+    return result
+
+# @return (peakBytes, blocks) of one call of fn.  Traced allocations with 
+#    tracemalloc; otherwise the growth of the max RSS (None without the 
+#    resource module) and the net objects tracked by the garbage collector.
+def _allocations(fn):
+    gc.collect()
+    if (None != tracemalloc):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        current = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        fn()
+        peakBytes = tracemalloc.get_traced_memory()[1] - current
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        return peakBytes, sum([s.count_diff for s in after.compare_to(before, 'filename')])
+
+    # ru_maxrss is in KB on Linux (bytes on macOS).
+    scale = 1 if (sys.platform == 'darwin') else 1024
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if (None != resource) else None
+    objects = len(gc.get_objects())
+    fn()
+    gc.collect()
+    blocks = len(gc.get_objects()) - objects
+    if (None == maxRSS):
+        return None, blocks
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - maxRSS) * scale, blocks
+
+
+"""
+Synthetic domain (stand-ins and proxy tree) with a gateway routing to it.
+One session is attached, without a worker, and its outbox is drained after
+every call so that fan-out is included but nothing accumulates.
+"""
+class Bench_Tree(object):
+    def __init__(self, devMgrs=4, devices=8, apps=4, components=8, ports=4, properties=16):
+        self.obj = Stand_In_Domain(devMgrs, devices, apps, components, ports, properties)
+        self.gateway = RH_Gateway()
+        self.gateway.domainTask.cancel()
+        self.gateway._pool.close()
+        self.gateway._pool = Inline_Pool()
+        self.outbox = self.gateway.outbox
+        self.session = self.outbox.addSession(Session('bench', ''))
+        self.domain = self.build()
+        self.gateway._domains[self.obj.name] = self.domain
+        self.drain()
+
+        # The last component (or device) created, whose subtree every route updates.
+        self.proxies = len(self.gateway._index)
+        self.target = self.domain
+        for p in self.gateway._index._byKey.values():
+            if isinstance(p, CompDev_Base):
+                self.target = p
+
+    # @param index The Proxy_Index for the tree, defaults to the gateway's.
+    def build(self, index=None):
+        index = index if (None != index) else self.gateway._index
+        return Bench_Domain(self.obj, '', self.outbox, index,
+                            self.gateway._scheduler, False, self.gateway._staleSec,
+                            self.gateway._pool)
+
+    def drain(self):
+        outbox = self.session.outbox
+        while not outbox.empty():
+            outbox.get_nowait()
+
+    def close(self):
+        self.gateway.closeSession('bench')
+        self.gateway.__del__()
+
+
+# Modules importing rh_gateway should not need (until a session uses them).
+HEAVY_MODULES = ('numpy', 'bulkio.bulkioInterfaces', 'ossie.properties')
+
+# Run in a new interpreter: times importing rh_gateway and reports which
+# of the modules (argv) were loaded by it.
+IMPORT_PROBE = '''
+import sys, time, json
+start = time.time()
+import rh_gateway
+seconds = time.time() - start
+print(json.dumps({'seconds': seconds, 
+                  'loaded': [m for m in sys.argv[1:] if m in sys.modules]}))
+'''
+
+# Run in a new interpreter: notes the time then runs rh_gateway.py as
+# __main__ with the arguments (argv).
+STARTUP_PROBE = '''
+import sys, time, runpy
+print('BENCH_MAIN_START {0!r}'.format(time.time()))
+sys.stdout.flush()
+sys.argv = ['rh_gateway.py'] + sys.argv[1:]
+runpy.run_path('rh_gateway.py', run_name='__main__')
+'''
+
+STARTED_LINE = "RH Gateway started successfully."
+
+def _timeImport(directory, modules):
+    out = subprocess.check_output([sys.executable, '-c', IMPORT_PROBE] + list(modules),
+                                  cwd=directory).decode('utf-8')
+    return json.loads(out.strip().splitlines()[-1])
+
+def _timeStartup(directory, address):
+    child = subprocess.Popen([sys.executable, '-c', STARTUP_PROBE, '--standby', address],
+                             cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        start = None
+        output = []
+        while True:
+            line = child.stdout.readline().decode('utf-8', 'replace')
+            if ('' == line):
+                raise RuntimeError("The gateway exited before starting:\n" + ''.join(output))
+            output.append(line)
+            if line.startswith('BENCH_MAIN_START '):
+                start = float(line.split()[1])
+            elif (STARTED_LINE in line) and (None != start):
+                return time.time() - start
+    finally:
+        if (None == child.poll()):
+            child.kill()
+        child.wait()
+
+"""
+Times importing and starting the gateway in `repeat` new processes each.
+@return Dictionary of benchmark name to a measure()-like result (without
+    allocations) and the list of HEAVY_MODULES loaded by the import.
+"""
+def runStartupBenchmarks(repeat=5):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    sockets = tempfile.mkdtemp(prefix='hawkeye_bench_')
+    try:
+        imports = [_timeImport(directory, HEAVY_MODULES) for r in range(repeat)]
+        startups = [_timeStartup(directory, 'ipc://' + os.path.join(sockets, 'gateway_{0}'.format(r)))
+                    for r in range(repeat)]
+    finally:
+        shutil.rmtree(sockets, True)
+
+    results = {}
+    for name, times in (('import', [i['seconds'] for i in imports]), ('startup', startups)):
+        times.sort()
+        results[name] = {'min': times[0], 'median': times[len(times) // 2],
+                         'peakBytes': None, 'blocks': None}
+    return results, imports[-1]['loaded']
+
+
+# @return Dictionary of benchmark name to its measure() result.
+def runBenchmarks(tree, number=10, repeat=5):
+    target = tree.target
+    update = lambda: RH_Message('update', 'component', target.getID, '',
+                                {'domainID': tree.domain.getDomainID})
+    domain = tree.domain
+    odm = domain._Domain__queueEvent
+    applyEvents = domain._Domain__applyEvents
+    devMgrIDs = [d._get_identifier() for d in tree.obj.devMgrs[:2]]
+
+    def build():
+        d = tree.build(Proxy_Index())
+        d.cleanUp()
+        tree.drain()
+
+    def route():
+        tree.gateway.passMessages([update()], 'bench')
+        tree.drain()
+
+    def process():
+        domain.processMessage(update())
+        tree.drain()
+
+    def refresh():
+        for p in tree.gateway._index._byKey.values():
+            p.invalidate()
+        domain.getUpdateFromHere('update')
+
+    def cached():
+        domain.getUpdateFromHere('update')
+
+    def odmEvents():
+        for i in devMgrIDs:
+            odm(Stand_In_Event(i, 'DEVICE_MANAGER'), False)
+        applyEvents()
+        for i in devMgrIDs:
+            odm(Stand_In_Event(i, 'DEVICE_MANAGER'), True)
+        applyEvents()
+        tree.drain()
+
+    devices = [{'id': 'dev_{0}'.format(i), 'name': 'device {0}'.format(i)}
+               for i in range(tree.proxies)]
+    changed = devices[2:] + [{'id': 'new_0', 'name': 'new device'}]
+
+    benchmarks = [('message', lambda: RH_Message('update', 'property', 'id', 'name', {'value': 1.0})),
+                  ('build', build),
+                  ('route', route),
+                  ('process', process),
+                  ('refresh', refresh),
+                  ('cached', cached),
+                  ('ids', domain.updateDescendentIDs),
+                  ('odm', odmEvents),
+                  ('split', lambda: splitDictLists(changed, devices, ['id', 'name']))]
+    results = {}
+    for name, fn in benchmarks:
+        results[name] = measure(fn, number, repeat)
+    return results
+
+
+# @return List of (name, ratio) of the benchmarks slower than the baseline by more than tolerance.
+def compareResults(results, baseline, tolerance=0.2):
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name, None)
+        if (None != base) and (0 < base['min']):
+            ratio = result['min'] / base['min']
+            if (1.0 + tolerance < ratio):
+                regressions.append((name, ratio))
+    return regressions
+
+
+def printResults(results, baseline=None):
+    print("{0:<10}{1:>14}{2:>14}{3:>12}{4:>10}{5:>10}".format(
+        'benchmark', 'min (us)', 'median (us)', 'peak (KB)', 'blocks', 'vs base'))
+    for name, r in sorted(results.items()):
+        peak = '-' if (None == r['peakBytes']) else '{0:.1f}'.format(r['peakBytes'] / 1024.0)
+        blocks = '-' if (None == r['blocks']) else str(r['blocks'])
+        versus = '-'
+        if (None != baseline) and (name in baseline) and (0 < baseline[name]['min']):
+            versus = '{0:.2f}x'.format(r['min'] / baseline[name]['min'])
+        print("{0:<10}{1:>14.1f}{2:>14.1f}{3:>12}{4:>10}{5:>10}".format(
+            name, r['min'] * 1e6, r['median'] * 1e6, peak, blocks, versus))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HAWKEYE RH Gateway control-plane benchmarks')
+    parser.add_argument('--dev-managers', type=int, default=4, help="Device managers in the domain")
+    parser.add_argument('--devices', type=int, default=8, help="Devices per device manager")
+    parser.add_argument('--apps', type=int, default=4, help="Applications in the domain")
+    parser.add_argument('--components', type=int, default=8, help="Components per application")
+    parser.add_argument('--ports', type=int, default=4, help="Ports per device or component")
+    parser.add_argument('--properties', type=int, default=16, help="Properties per device or component")
+    parser.add_argument('--number', type=int, default=10, help="Calls per timed run")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument('--save', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Compare the results to this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Fraction slower than the baseline counted as a regression")
+    parser.add_argument('--startup', action='store_true',
+                        help="Time importing and starting the gateway (in new processes) instead")
+    args = parser.parse_args()
+
+    # Keep the report readable; only problems are logged.
+    configureLogging('WARNING')
+    if args.startup:
+        print("Benchmarking gateway startup..."); sys.stdout.flush()
+        results, loaded = runStartupBenchmarks(args.repeat)
+        deferred = [m for m in HEAVY_MODULES if m not in loaded]
+        print("Deferred by the import: {0}".format(', '.join(deferred) or 'none'))
+        print("Loaded by the import: {0}".format(', '.join(loaded) or 'none'))
+    else:
+        tree = Bench_Tree(args.dev_managers, args.devices, args.apps,
+                          args.components, args.ports, args.properties)
+        print("Benchmarking {0} proxies...".format(tree.proxies)); sys.stdout.flush()
+        results = runBenchmarks(tree, args.number, args.repeat)
+        tree.close()
+
+    parameters = dict([(k, v) for k, v in vars(args).items()
+                       if k not in ('save', 'compare', 'tolerance')])
+    baseline = None
+    if (None != args.compare):
+        with open(args.compare, 'r') as f:
+            saved = json.load(f)
+        baseline = saved['results']
+        if (saved.get('parameters', {}) != parameters):
+            print("WARNING: The baseline was run with other parameters: {0}".format(
+                saved.get('parameters', {})))
+    printResults(results, baseline)
+
+    if (None != args.save):
+        with open(args.save, 'w') as f:
+            json.dump({'parameters': parameters, 'results': results}, f, indent=2, sort_keys=True)
+
+    if (None != baseline):
+        regressions = compareResults(results, baseline, args.tolerance)
+        for name, ratio in regressions:
+            print("REGRESSION: {0} is {1:.2f}x the baseline".format(name, ratio))
+        sys.stdout.flush()
+        sys.exit(1 if (0 < len(regressions)) else 0)
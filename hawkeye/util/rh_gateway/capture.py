@@ -0,0 +1,439 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Recording of BULKIO samples to memory-mapped capture files.
+
+A capture is a sequence of segments, each a pair of files in the style of
+SigMF (https://github.com/gnuradio/SigMF):
+   `<name>.sigmf-data` ==> The raw little-endian samples (interleaved real,
+                           imaginary pairs if complex)
+   `<name>.sigmf-meta` ==> JSON with the `global` datatype, sample rate, SRI
+                           and stream ID, a `captures` entry per stream or
+                           SRI change (with the BULKIO timestamp), and an
+                           `annotations` entry for each EOS.  The global
+                           `hawkeye:complete` is true once the segment is
+                           closed (and the data file truncated).
+"""
+
+import os, re, json, copy, time, datetime, threading
+from collections import deque
+from utilities import Lazy_Module
+from log import getLogger
+
+# Imported by the first capture rather than with the gateway.
+np = Lazy_Module('numpy')
+
+# Directory for new captures (see setCaptureDirectory).
+CAPTURE_DIR = 'captures'
+
+# Defaults for rolling: samples per segment file, max seconds per segment,
+# and the number of segments kept (oldest are deleted).
+CAPTURE_SEGMENT_SAMPLES = 16 * 1024 * 1024
+CAPTURE_SEGMENT_SEC = 60.0
+CAPTURE_SEGMENTS = 5
+
+# Limits on the client's rolling options (the segments are preallocated).
+CAPTURE_MAX_SEGMENT_SAMPLES = 128 * 1024 * 1024
+CAPTURE_MAX_SEGMENTS = 100
+
+DATA_EXT = '.sigmf-data'
+META_EXT = '.sigmf-meta'
+
+log = getLogger('capture')
+
+# SigMF datatype (less the r/c prefix) of each NumPy type
+_SIGMF_TYPES = {'int8': 'i8', 'uint8': 'u8',
+                'int16': 'i16_le', 'uint16': 'u16_le',
+                'int32': 'i32_le', 'uint32': 'u32_le',
+                'float32': 'f32_le', 'float64': 'f64_le'}
+
+
+def setCaptureDirectory(directory):
+    global CAPTURE_DIR
+    CAPTURE_DIR = directory
+
+# @return int(value) limited to [low, high], with a warning if it was outside.
+def _clamp(name, value, low, high):
+    clamped = min(high, max(low, int(value)))
+    if (clamped != int(value)):
+        log.warning("Capture %s %s is out of range; using %d", name, value, clamped)
+    return clamped
+
+# @return The SigMF datatype string, e.g., 'rf32_le', for samples of dtype.
+def sigmfDatatype(dtype, isComplex=False):
+    return ('c' if isComplex else 'r') + _SIGMF_TYPES[np.dtype(dtype).name]
+
+# @return The NumPy dtype and complex flag of a SigMF datatype string.
+def sigmfToDtype(datatype):
+    for name, suffix in _SIGMF_TYPES.items():
+        if (datatype[1:] == suffix):
+            return np.dtype(name).newbyteorder('<'), ('c' == datatype[0])
+    raise ValueError("Unsupported SigMF datatype: " + datatype)
+
+# @return ISO 8601 (UTC) string for a BULKIO PrecisionUTCTime, or None.
+def timestampToISO(t_stamp):
+    try:
+        seconds = t_stamp.twsec + t_stamp.tfsec
+    except AttributeError:
+        return None
+    return datetime.datetime.utcfromtimestamp(seconds).isoformat() + 'Z'
+
+# @return Dictionary of the interesting fields of a BULKIO SRI.
+def sriToDict(sri):
+    fields = ['streamID', 'xstart', 'xdelta', 'xunits', 'subsize',
+              'ystart', 'ydelta', 'yunits', 'mode', 'blocking']
+    return dict([(f, getattr(sri, f)) for f in fields if hasattr(sri, f)])
+
+
+"""
+Writes a BULKIO stream to rolling segments of preallocated, memory-mapped
+files.  write() is called from the REDHAWK (omniORB) thread with each packet
+and only copies the samples into the map, so it keeps up with the port.  A
+segment is closed when it is full or `segmentSec` old, its data file is
+truncated to what was written, and only the newest `segments` are kept.
+
+The file work (creating the next segment ahead of time, flushing and 
+truncating a closed one, the metadata sidecars and removing old segments) is 
+queued to a daemon native thread per writer, so neither the push thread nor 
+the gevent hub waits on the disk.  write() only waits if the next segment is 
+still being created when the current one fills.
+
+A lock guards the current segment since close() comes from the gevent side.
+
+    segmentSamples is the capacity of each segment file, in samples (at most
+        CAPTURE_MAX_SEGMENT_SAMPLES)
+    segments is the number kept (at most CAPTURE_MAX_SEGMENTS)
+    samples is the total written across all segments
+    files is the list of segment data files still on disk (oldest first)
+"""
+class Capture_Writer(object):
+    def __init__(self, name, dtype, directory=None, segmentSamples=CAPTURE_SEGMENT_SAMPLES,
+                 segmentSec=CAPTURE_SEGMENT_SEC, segments=CAPTURE_SEGMENTS):
+        self.directory = directory if (None != directory) else CAPTURE_DIR
+        self.name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        # Even, so complex pairs are never split across segments.
+        self.segmentSamples = _clamp('segmentSamples', segmentSamples, 2, CAPTURE_MAX_SEGMENT_SAMPLES)
+        self.segmentSamples -= self.segmentSamples % 2
+        self.segmentSec = float(segmentSec) if (None != segmentSec) else None
+        if (None != self.segmentSec) and (0 >= self.segmentSec):
+            log.warning("Capture segmentSec %s is not positive; segments roll on size only", segmentSec)
+            self.segmentSec = None
+        self.segments = _clamp('segments', segments, 1, CAPTURE_MAX_SEGMENTS)
+        self.samples = 0
+        self.files = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stopping = False
+        self._sri = {}
+        self._streamID = ''
+        self._map = None
+        self._meta = None
+        self._path = None
+        self._written = 0
+        self._opened = 0.0
+        self._index = 0
+        self._stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        # The next segment (path, map), made ahead by the writer thread.
+        self._spare = None
+        self._ready = threading.Event()
+        self._jobs = deque()
+        self._wake = threading.Event()
+        self._writer = threading.Thread(target=self._run, name='rh_gateway capture writer')
+        self._writer.daemon = True
+        self._writer.start()
+        self._queue(self._prepareSegment)
+
+    @property
+    def recording(self):
+        return not self._closed
+
+    # Status for the port's messages.
+    @property
+    def status(self):
+        return {'directory': self.directory,
+                'files': [os.path.basename(f) for f in self.files],
+                'samples': self.samples}
+
+    # Any thread.  The SRI applies from the next sample written.
+    def setSRI(self, sri):
+        with self._lock:
+            self._sri = sriToDict(sri)
+            if (None != self._meta):
+                self._addCapture(None)
+
+    # REDHAWK-environment thread.
+    def write(self, samples, t_stamp=None, streamID=''):
+        samples = np.asarray(samples)
+        with self._lock:
+            if self._closed:
+                return
+            newStream = (streamID != self._streamID)
+            self._streamID = streamID
+            while (0 < samples.size):
+                if self._full():
+                    self._closeSegment()
+                if (self._map is None):
+                    if not self._openSegment(t_stamp):
+                        return
+                elif newStream:
+                    self._addCapture(t_stamp)
+                newStream = False
+
+                n = min(samples.size, self.segmentSamples - self._written)
+                self._map[self._written:self._written + n] = samples[:n]
+                self._written += n
+                self.samples += n
+                samples = samples[n:]
+                # Later pieces of this packet start without a timestamp.
+                t_stamp = None
+
+    # REDHAWK-environment thread.  Notes the end of stream at the current sample.
+    def markEOS(self):
+        with self._lock:
+            if (None != self._meta):
+                self._meta['annotations'].append({'core:sample_start': self._sampleIndex(),
+                                                  'core:sample_count': 0,
+                                                  'core:comment': 'EOS',
+                                                  'hawkeye:stream_id': self._streamID})
+
+    # Closes the current segment.  No more samples are written afterwards; the
+    # files are complete once the writer thread finishes (see join).
+    def close(self):
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._closed = True
+            if (self._map is not None):
+                self._closeSegment()
+        self._queue(self._discardSpare)
+        self._queue(None)
+
+    # Waits for the writer thread to finish the queued file work after close().
+    # @return True if it finished within timeoutSec
+    def join(self, timeoutSec=None):
+        self._writer.join(timeoutSec)
+        return not self._writer.is_alive()
+
+    def _full(self):
+        if (self._map is None):
+            return False
+        return ((self.segmentSamples <= self._written) or
+                ((None != self.segmentSec) and (self.segmentSec <= time.time() - self._opened)))
+
+    # Switches to the segment the writer thread made ahead.
+    # @return False (and closes the writer) if it could not be created.
+    def _openSegment(self, t_stamp):
+        self._ready.wait()
+        self._ready.clear()
+        spare, self._spare = self._spare, None
+        if (None == spare):
+            self._closed = True
+            return False
+        self._path, self._map = spare
+        self._queue(self._prepareSegment)
+        self._written = 0
+        self._opened = time.time()
+        self._meta = {'global': {'core:version': '0.0.2',
+                                 'core:recorder': 'HAWKEYE RH Gateway',
+                                 'hawkeye:port': self.name,
+                                 'hawkeye:complete': False},
+                      'captures': [],
+                      'annotations': []}
+        self._addCapture(t_stamp)
+        self.files.append(self._path)
+        self._queue(self._writeMeta, self._path, copy.deepcopy(self._meta))
+        while (self.segments < len(self.files)):
+            self._queue(self._removeSegment, self.files.pop(0))
+        return True
+
+    # Hands the current segment to the writer thread to finish.
+    def _closeSegment(self):
+        self._meta['global']['hawkeye:complete'] = True
+        self._queue(self._finishSegment, self._map, self._path, self._written, self._meta)
+        self._map = None
+        self._meta = None
+
+    # Starts a new `captures` entry (stream, SRI or time discontinuity) at the current sample.
+    def _addCapture(self, t_stamp):
+        capture = {'core:sample_start': self._sampleIndex(),
+                   'hawkeye:stream_id': self._streamID,
+                   'hawkeye:sri': dict(self._sri)}
+        iso = timestampToISO(t_stamp)
+        if (None != iso):
+            capture['core:datetime'] = iso
+        self._meta['captures'].append(capture)
+
+        isComplex = (1 == self._sri.get('mode', 0))
+        xdelta = self._sri.get('xdelta', 0)
+        self._meta['global'].update({'core:datatype': sigmfDatatype(self.dtype, isComplex),
+                                     'hawkeye:stream_id': self._streamID,
+                                     'hawkeye:sri': dict(self._sri)})
+        if (0 < xdelta):
+            self._meta['global']['core:sample_rate'] = 1.0 / xdelta
+
+    # SigMF index of the next sample (complex samples count once per pair).
+    def _sampleIndex(self):
+        return self._written // (2 if (1 == self._sri.get('mode', 0)) else 1)
+
+    # Any thread.  A fn of None stops the writer thread once the queue is drained.
+    def _queue(self, fn, *args):
+        self._jobs.append((fn, args))
+        self._wake.set()
+
+    # Writer thread.
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while (0 < len(self._jobs)):
+                fn, args = self._jobs.popleft()
+                if (None == fn):
+                    return
+                try:
+                    fn(*args)
+                except Exception as e:
+                    log.error("Capture %s file work failed: %s", self.name, e)
+
+    # Writer thread.
+    def _prepareSegment(self):
+        base = os.path.join(self.directory, "{0}_{1}_{2:04d}".format(self.name, self._stamp, self._index))
+        self._index += 1
+        path = base + DATA_EXT
+        try:
+            self._spare = (path, np.memmap(path, dtype=self.dtype, mode='w+', shape=(self.segmentSamples,)))
+        except (IOError, OSError, ValueError) as e:
+            log.error("Capture failed to create %s: %s", path, e)
+        self._ready.set()
+
+    # Writer thread.  Removes the segment made ahead but never used.
+    def _discardSpare(self):
+        spare, self._spare = self._spare, None
+        if (None != spare):
+            self._removeSegment(spare[0])
+
+    # Writer thread.
+    def _finishSegment(self, segment, path, written, meta):
+        segment.flush()
+        del segment
+        with open(path, 'r+b') as f:
+            f.truncate(written * self.dtype.itemsize)
+        self._writeMeta(path, meta)
+
+    # Writer thread.
+    def _writeMeta(self, path, meta):
+        metaPath = path[:-len(DATA_EXT)] + META_EXT
+        try:
+            with open(metaPath, 'w') as f:
+                json.dump(meta, f, indent=2, sort_keys=True)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            log.error("Capture failed to write %s: %s", metaPath, e)
+
+    def _removeSegment(self, path):
+        for p in (path, path[:-len(DATA_EXT)] + META_EXT):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+
+# @return Sorted list of the metadata files of the complete segments in directory.
+def listCaptures(directory=None):
+    directory = directory if (None != directory) else CAPTURE_DIR
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return []
+    paths = []
+    for name in names:
+        if name.endswith(META_EXT):
+            path = os.path.join(directory, name)
+            try:
+                with open(path, 'r') as f:
+                    if json.load(f)['global'].get('hawkeye:complete', True):
+                        paths.append(path)
+            except (IOError, OSError, KeyError, ValueError):
+                pass
+    return paths
+
+
+"""
+Stand-in for a BULKIO SRI built from the dictionary saved by sriToDict.
+"""
+class Capture_SRI(object):
+    def __init__(self, fields):
+        self.streamID = ''
+        self.xstart = 0.0
+        self.xdelta = 1.0
+        self.mode = 0
+        self.__dict__.update(fields)
+
+
+"""
+Reads a capture segment (see Capture_Writer) through a read-only memory map
+so that read() returns views of the file without copying it.
+
+    dtype is the NumPy type of the samples
+    sri is the Capture_SRI of the segment
+    streamID is the BULKIO stream ID it was recorded from
+    sampleRate is the rate of the samples in the file, per second (both of 
+        each complex pair count)
+"""
+class Capture_Reader(object):
+    def __init__(self, metaPath):
+        with open(metaPath, 'r') as f:
+            self.meta = json.load(f)
+        info = self.meta['global']
+        self.name = os.path.basename(metaPath)[:-len(META_EXT)]
+        self.path = metaPath[:-len(META_EXT)] + DATA_EXT
+        self.dtype, self.isComplex = sigmfToDtype(info['core:datatype'])
+        self.streamID = info.get('hawkeye:stream_id', self.name)
+        sri = dict(info.get('hawkeye:sri', {}))
+        if (0 >= sri.get('xdelta', 0)) and (0 < info.get('core:sample_rate', 0)):
+            sri['xdelta'] = 1.0 / info['core:sample_rate']
+        self.sri = Capture_SRI(sri)
+        if (0 >= self.sri.xdelta):
+            self.sri.xdelta = 1.0
+        self.sampleRate = (2.0 if self.isComplex else 1.0) / self.sri.xdelta
+        self._data = None
+
+    # Samples in the file.
+    def __len__(self):
+        try:
+            return os.path.getsize(self.path) // self.dtype.itemsize
+        except OSError:
+            return 0
+
+    def open(self):
+        if (self._data is None):
+            if (0 < len(self)):
+                self._data = np.memmap(self.path, dtype=self.dtype, mode='r')
+            else:
+                self._data = np.zeros(0, dtype=self.dtype)
+
+    # @return View of up to count samples from start.
+    def read(self, start, count):
+        self.open()
+        return self._data[start:start + count]
+
+    def close(self):
+        self._data = None
@@ -22,28 +22,38 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from core import RH_Message, Proxy_Base
 from port import Port
+from utilities import valueChanged
+from log import getLogger
 
 import ossie.properties as ossie_prop
-from ossie.utils import redhawk
+from ossie.cf import CF
+from omniORB import any as omni_any
 
-import string, sys
+import string, time
+
+# Marks a Property as having no polled value waiting for getMessage.
+_NOT_POLLED = object()
+
+log = getLogger('comp_dev')
 
 """
 Base class from which Component and Device derive since they're very similar.
 NOTE: getMessage appends `more` with:
       `usageState` ==> IDLE/ACTIVE/BUSY
       `started`    ==> true/false
+
+The Component or Device owns the polling of its streaming Property children:
+one periodic task fetches all of their values with a single query() and then
+hands each its value.  An 'update' does the same for every Property before
+building the messages.
 """
 class CompDev_Base(Proxy_Base):
     def _finish_init_(self):
-        for p in self._obj.ports:
-            self._children.append(Port.getPort(p, self, self._outbox))
-        for prop in self._obj._propertySet:
-            try:
-                pp = Property(prop, self, self._outbox)
-                self._children.append(pp)
-            except:
-                pass
+        self._polled = []
+    
+    def _createChildren(self):
+        self._children += self._createEach(Port.getPort, self._call(getattr, self._obj, 'ports'))
+        self._children += self._createEach(Property, self._call(getattr, self._obj, '_propertySet'))
     
     def getMessage(self, change='update'):
         msg = RH_Message(change, 
@@ -56,15 +66,68 @@ class CompDev_Base(Proxy_Base):
     def _processThisMessage(self, message):
         # TODO: What other kinds of messages does this entity require?  Start/Stop?
         if ('update' == message['change']):
-            if (0 == len(self._children)):
-                # Should have children.  Reattempt _finish_init_()
-                self._finish_init_()
+            if (0 == len(self._children)) and self._expanded:
+                # Should have children.  Reattempt _createChildren()
+                self._createChildren()
+            # Only query the properties whose cached messages need rebuilding.
+            props = [c for c in self._children if isinstance(c, Property) and c.isStale]
+            values = self._queryProperties(props)
+            for prop in props:
+                prop._setPolledValue(values.get(prop._obj.id, _NOT_POLLED))
             return self.getUpdateFromHere('update')
         # default response
         return []
+    
+    # One polling cycle for all streaming properties: configure any pending
+    # values, then query them all at once and distribute the results.
+    def _doPeriodicTask(self):
+        props = list(self._polled)
+        configured = dict([(prop, prop._applyNextValue()) for prop in props])
+        values = self._queryProperties(props)
+        for prop in props:
+            prop._pollTick(values.get(prop._obj.id, _NOT_POLLED), configured[prop])
+    
+    # Called by a Property to join (or leave) the polling cycle.  The cycle
+    # runs at the fastest period of its properties.
+    def _subscribeProperty(self, prop):
+        if (prop not in self._polled):
+            self._polled.append(prop)
+        periodSec = min([p._periodSec for p in self._polled])
+        if (None == self._periodicTask) or (periodSec != self._periodSec):
+            self._periodSec = periodSec
+            self.doPeriodicTask()
+    
+    def _unsubscribeProperty(self, prop):
+        if (prop in self._polled):
+            self._polled.remove(prop)
+        if (0 == len(self._polled)):
+            self.stopPeriodicTask()
+    
+    # Fetches the values of props in one query().
+    # @return Dictionary of property ID to value (empty if the query failed).
+    def _queryProperties(self, props):
+        if (0 == len(props)):
+            return {}
+        try:
+            results = self._call(self._obj.ref.query, 
+                                 [CF.DataType(id=str(p._obj.id), value=omni_any.to_any(None)) 
+                                  for p in props])
+        except Exception as e:
+            log.warning("Failed to query properties of %s: %s", self.getName, e)
+            return {}
+        
+        byID = dict([(p._obj.id, p) for p in props])
+        values = {}
+        for r in results:
+            if (r.id in byID):
+                try:
+                    values[r.id] = byID[r.id]._obj.fromAny(r.value)
+                except Exception:
+                    pass
+        return values
         
     def _cleanUp(self):
-        pass
+        self._polled = []
     
 
 """
@@ -81,8 +144,8 @@ class Device(CompDev_Base):
     def getMessage(self, change='update'):
         msg = CompDev_Base.getMessage(self, change)
         if ('remove' != change):
-            msg['more'].update({'usageState': "{0}".format(self._obj.usageState), 
-                                'started': "{0}".format(self._obj._get_started())})
+            msg['more'].update({'usageState': "{0}".format(self._call(getattr, self._obj, 'usageState')), 
+                                'started': "{0}".format(self._call(self._obj._get_started))})
         return msg
     
 
@@ -94,10 +157,29 @@ NOTE: 1) Object obtained from dev/comp._propertySet[index].
             `access` ==> readwrite, readonly, writeonly
       3) Property ID's are only unique within the parent (not the whole domain)
          so the getID will prefix the Parent's ID with its own.
+      4) While streaming, a `stream` message is only sent when the value 
+         changes (beyond the `deadband` given with `start`, for numbers) or
+         when `heartbeat` seconds pass without sending one.  Each adds 
+         `sent` and `suppressed` counts to `more`.
+      5) The values are normally polled by the parent (see CompDev_Base), 
+         in which case getMessage uses the polled value rather than issuing
+         its own queryValue().
 """
 class Property(Proxy_Base):
+    _expandable = False
+    # getMessage('add') precedes _finish_init_.
+    _polledValue = _NOT_POLLED
+    
     def _finish_init_(self):
+        self._isStreaming = False
+        self._polledValue = _NOT_POLLED
         self._nextValue = None
+        self._deadband = 0.0
+        self._heartbeatSec = None
+        self._lastValue = None
+        self._lastSentTime = None
+        self._sentCount = 0
+        self._suppressedCount = 0
     
     @property
     def _getID(self):
@@ -113,30 +195,63 @@ class Property(Proxy_Base):
                          self.getName, 
                          {'parentID': self._parent.getID})
         if ('remove' != change):
-            msg['more'].update({'value': self._obj.queryValue(),
+            value, self._polledValue = self._polledValue, _NOT_POLLED
+            if (value is _NOT_POLLED):
+                value = self._call(self._obj.queryValue)
+            msg['more'].update({'value': value,
                                 'access': self._obj.mode})
         return msg
     
     # Periodic task has 2 tasks: If a next value exists, configure it.  In any case, send an update.
     # the update either confirms the value was accepted or proves it was rejected (via the UI).
     def _doPeriodicTask(self):
+        configured = self._applyNextValue()
+        # Kick out an update to the client.
+        if self._streaming:
+            self._sendIfChanged(self.getMessage('stream'), configured)
+        else:
+            self.sendMessages([self.getMessage('update')])
+    
+    # Configures the next value if one exists.  @return True if configured.
+    def _applyNextValue(self):
         try:
             if None != self._nextValue:
-                print("Setting property value..."); sys.stdout.flush()
-                self._obj.configureValue(self._nextValue)
+                log.debug("Setting property %s...", self.getID)
+                self._call(self._obj.configureValue, self._nextValue)
                 self._nextValue = None
-                print("Successfully set value."); sys.stdout.flush()
-            
+                self.invalidate()
+                log.debug("Successfully set %s.", self.getID)
+                return True
         except Exception as e:
-            print("Failed to set property type: " + self._obj.type); sys.stdout.flush()
-            print(e); sys.stdout.flush();
-            
-        finally:
-            # Kick out an update to the client.
-            if self._streaming:
-                self.sendMessages([self.getMessage('stream')])
-            else:
-                self.sendMessages([self.getMessage('update')])
+            log.error("Failed to set property %s (type %s): %s", self.getID, self._obj.type, e)
+        return False
+    
+    # Value to use for the next getMessage (or _NOT_POLLED to query it).
+    def _setPolledValue(self, value):
+        self._polledValue = value
+    
+    # Called by the parent's polling cycle with this property's value.
+    def _pollTick(self, value, configured=False):
+        self._setPolledValue(value)
+        self._sendIfChanged(self.getMessage('stream'), configured)
+    
+    # Sends the stream message if the value changed (or is due a heartbeat).
+    def _sendIfChanged(self, msg, force=False):
+        value = msg['more']['value']
+        now = time.time()
+        if (force or (None == self._lastSentTime) or
+            ((None != self._heartbeatSec) and (self._heartbeatSec <= now - self._lastSentTime)) or
+            valueChanged(self._lastValue, value, self._deadband)):
+            if (value != self._lastValue):
+                self.invalidate()
+            self._lastValue = value
+            self._lastSentTime = now
+            self._sentCount += 1
+            msg['more'].update({'sent': self._sentCount, 
+                                'suppressed': self._suppressedCount})
+            self.sendMessages([msg])
+        else:
+            self._suppressedCount += 1
     
     def _processThisMessage(self, message):
         if ('update' == message['change']):
@@ -146,8 +261,11 @@ class Property(Proxy_Base):
             if not self._streaming:
                 self.doPeriodicTaskOnceAfter(1.0)
         elif ('start' == message['change']) and not self._streaming:
+            self._configureStream(message['more'])
+            msg = self.getMessage('stream')
+            self._lastValue = msg['more']['value']
             self._start()
-            return [self.getMessage('stream')]
+            return [msg]
         elif ('stop' == message['change']) and self._streaming:
             self._stop()
             return [self.getMessage('update')]
@@ -165,15 +283,37 @@ class Property(Proxy_Base):
         else:
             return ossie_prop.to_pyvalue(newValue, self._obj.type)
     
+    # Change detection options from `start`: `deadband` and `heartbeat` (sec).
+    def _configureStream(self, options):
+        try:
+            self._deadband = max(0.0, float(options.get('deadband', 0.0)))
+        except (TypeError, ValueError):
+            self._deadband = 0.0
+        try:
+            heartbeat = options.get('heartbeat', None)
+            self._heartbeatSec = None if (None == heartbeat) else max(0.0, float(heartbeat))
+        except (TypeError, ValueError):
+            self._heartbeatSec = None
+        # The 'start' acknowledgement carries the current value.
+        self._lastSentTime = time.time()
+        self._sentCount = 0
+        self._suppressedCount = 0
+    
     @property    
     def _streaming(self):
-        return (None != self._greenlet)
+        return self._isStreaming
+    
+    @property
+    def _busy(self):
+        return self._streaming
     
     def _start(self):
-        self.doPeriodicTask()
+        self._isStreaming = True
+        self._parent._subscribeProperty(self)
     
     def _stop(self):
-        self.stopPeriodicTask()
+        self._isStreaming = False
+        self._parent._unsubscribeProperty(self)
 
     def _cleanUp(self):
         if (self._streaming):
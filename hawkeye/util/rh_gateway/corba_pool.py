@@ -0,0 +1,145 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Bounded native thread pool for the proxies' blocking CORBA calls.
+"""
+
+import time, threading, weakref
+import gevent
+from gevent.threadpool import ThreadPool
+from metrics import Histogram
+from log import getLogger
+
+# Defaults for the number of concurrent calls and how long each may take.
+POOL_SIZE = 8
+CALL_TIMEOUT_SEC = 5.0
+
+log = getLogger('corba_pool')
+
+
+class CORBA_Timeout(Exception):
+    pass
+
+
+"""
+Runs blocking (CORBA) calls on native threads so that the gevent hub, and
+with it every other stream and client request, keeps running while a slow
+device answers.  The calling greenlet waits for the result.
+
+At most `size` calls run at once; further callers wait for a free thread.
+A call still running after `timeoutSec` raises CORBA_Timeout in the caller
+(the thread itself cannot be interrupted and finishes on its own).
+
+Calls made from any thread but the hub's (e.g., an omniORB callback) are
+run directly since the pool can only be used from the hub.
+
+    calls is the number of calls made through the pool
+    timeouts is the number of those that raised CORBA_Timeout
+    latency is, per function name, the Histogram of the seconds each call
+        took (waiting for a thread included)
+"""
+class CORBA_Pool(object):
+    def __init__(self, size=POOL_SIZE, timeoutSec=CALL_TIMEOUT_SEC):
+        self.size = max(1, int(size))
+        self.timeoutSec = timeoutSec
+        self.calls = 0
+        self.timeouts = 0
+        self.latency = {}
+        self._pool = ThreadPool(self.size)
+        self._hubThread = threading.current_thread().ident
+
+    # @return fn(*args, **kwargs), run on the pool.
+    def call(self, fn, *args, **kwargs):
+        if (threading.current_thread().ident != self._hubThread):
+            return fn(*args, **kwargs)
+
+        self.calls += 1
+        name = getattr(fn, '__name__', str(fn))
+        start = time.time()
+        result = self._pool.spawn(fn, *args, **kwargs)
+        try:
+            return result.get(timeout=self.timeoutSec)
+        except gevent.Timeout:
+            self.timeouts += 1
+            raise CORBA_Timeout("{0} did not return within {1} sec".format(name, self.timeoutSec))
+        finally:
+            latency = self.latency.get(name, None)
+            if (None == latency):
+                latency = self.latency[name] = Histogram()
+            latency.observe(time.time() - start)
+
+    """
+    Runs fn(item) for each item in its own greenlet so the CORBA calls each
+    makes can run in parallel on the pool.
+    @return List, in order, of the results of the calls that did not raise.
+    """
+    def map(self, fn, items):
+        items = list(items)
+        if (threading.current_thread().ident != self._hubThread):
+            results = []
+            for item in items:
+                try:
+                    results.append(fn(item))
+                except Exception as e:
+                    self._report(e)
+            return results
+
+        greenlets = [gevent.spawn(fn, item) for item in items]
+        gevent.joinall(greenlets)
+        for g in greenlets:
+            if not g.successful():
+                self._report(g.exception)
+        return [g.value for g in greenlets if g.successful()]
+
+    def _report(self, e):
+        log.warning("CORBA_Pool call failed: %s", e)
+
+    def close(self):
+        self._pool.kill()
+
+
+"""
+Identifiers (_get_identifier()) of REDHAWK model objects, remembered (weakly)
+by object so that only objects new to the model are asked for theirs.  The
+calls are made in parallel on a CORBA_Pool; an object whose call fails is
+left out and asked again next time.
+"""
+class Identifier_Cache(object):
+    def __init__(self, pool):
+        self._pool = pool
+        self._identifiers = weakref.WeakKeyDictionary()
+
+    # @return Dictionary of identifier to obj for the objs with an identifier in wanted.
+    def find(self, objs, wanted):
+        objs = list(objs)
+        unknown = [obj for obj in objs if (obj not in self._identifiers)]
+        # Pairs, since map() leaves out the calls that failed.
+        pairs = self._pool.map(lambda obj: (obj, self._pool.call(obj._get_identifier)), unknown)
+        byID = {}
+        for obj, identifier in pairs:
+            if (identifier in wanted):
+                byID[identifier] = obj
+            try:
+                self._identifiers[obj] = identifier
+            except TypeError:
+                # Not weakly referenceable; it is asked again next time.
+                pass
+        for obj in objs:
+            if (obj in self._identifiers) and (self._identifiers[obj] in wanted):
+                byID[self._identifiers[obj]] = obj
+        return byID
@@ -44,7 +44,69 @@ def RH_Message(change='', rhtype='', rhid='', rhname='', more={}):
     return msg
 
 
-import sys, gevent
+import sys, time, gevent
+from scheduler import Scheduler
+from corba_pool import CORBA_Pool
+
+# Default max age, in seconds, of a proxy's cached message (see getUpdateFromHere).
+SNAPSHOT_STALE_SEC = 2.0
+
+
+# @return Copy of the dictionaries and lists in value (the rest, immutable in a 
+#    message, are shared).  Much faster than deepcopy.
+def _copyValue(value):
+    if isinstance(value, dict):
+        return dict([(k, _copyValue(v)) for k, v in value.items()])
+    elif isinstance(value, list):
+        return [_copyValue(v) for v in value]
+    return value
+
+
+"""
+Gateway-wide index of every live proxy so that incoming messages can be 
+routed with a dictionary lookup rather than walking the tree.  Proxies
+register themselves at the end of Proxy_Base.__init__ and are removed in 
+Proxy_Base.cleanUp.  Entries are keyed by (domain ID, rhid) since the IDs
+are only guaranteed unique within a domain.
+"""
+class Proxy_Index(object):
+    def __init__(self):
+        self._byKey = {}
+        self._byID = {}
+    
+    def __len__(self):
+        return len(self._byKey)
+    
+    def add(self, proxy):
+        key = (proxy.getDomainID, proxy.getID)
+        proxy._indexKey = key
+        self._byKey[key] = proxy
+        self._byID.setdefault(key[1], {})[key[0]] = proxy
+    
+    def remove(self, proxy):
+        key = proxy._indexKey
+        if (self._byKey.get(key, None) is proxy):
+            del self._byKey[key]
+            domains = self._byID[key[1]]
+            del domains[key[0]]
+            if (0 == len(domains)):
+                del self._byID[key[1]]
+    
+    # @return The proxy for the (domain ID, rhid) key or None.
+    def get(self, key):
+        return self._byKey.get(key, None)
+    
+    # @return List of proxies with rhid, only in domainID if it is given.
+    def lookup(self, rhid, domainID=None):
+        domains = self._byID.get(rhid, None)
+        if (None == domains):
+            return []
+        elif (None == domainID) or ('' == domainID):
+            return list(domains.values())
+        elif (domainID in domains):
+            return [domains[domainID]]
+        return []
+
 
 # Abstract base class for proxies
 class Proxy_Base(object):    
@@ -59,15 +121,37 @@ class Proxy_Base(object):
         _id is the REDHAWK-unique ID of this object.
         _name is the REHAWK instance's "name" (e.g., Device.name, Port._name, etc.)
         _domain_id is the ID of the REDHAWK Domain to which this entity belongs.
-        _greenlet is a handler to a gevent thread, if running, for periodic tasks
-        _greenletPeriodSec is the period, in seconds, of that task.
+        _index is the gateway's Proxy_Index (shared with the parent).
+        _indexKey is the (domain ID, rhid) this proxy is registered with.
+        _scheduler is the gateway's Scheduler (shared with the parent).
+        _periodicTask is the Timer_Task, if running, of the periodic task
+        _periodSec is the period, in seconds, of that task.
+        _lazy is True if children are only created when expand()ed (shared with the parent).
+        _expanded is True once the children have been created.
+        _expandable is False (class attribute) for proxies that never have children.
+        _blockingTask is False (class attribute) for proxies whose _doPeriodicTask 
+            never blocks, so the Scheduler runs it in its own greenlet.
+        _staleSec is the max age of the cached message (shared with the parent).
+        _snapshot is the cached 'update' message (or None) of getUpdateFromHere
+        _snapshotTime is when _snapshot was built (None once it is invalidated).
+        _version is incremented each time a rebuilt message differs from the last one.
+        _pool is the CORBA_Pool for blocking calls (shared with the parent), see _call().
     
     @param rh_obj The REDHAWK Object for this object.
     @param rh_parent The Proxy_Base subclass that is the parent (container) 
                      of this object in REDHAWK.
     @param outbox The Queue to use for any async updates (if necessary)
-    """
-    def __init__(self, rh_obj=None, rh_parent=None, outbox=None):
+    @param index The Proxy_Index to register with, defaults to the parent's.
+    @param scheduler The Scheduler to run tasks on, defaults to the parent's.
+    @param lazy If True, defer creating children until expand(), defaults to the parent's.
+    @param staleSec Max age of cached messages, defaults to the parent's (0 disables).
+    @param pool The CORBA_Pool to make blocking calls on, defaults to the parent's.
+    """
+    _expandable = True
+    _blockingTask = True
+    
+    def __init__(self, rh_obj=None, rh_parent=None, outbox=None, index=None, scheduler=None, lazy=None,
+                 staleSec=None, pool=None):
         if (None == rh_obj):
             raise Proxy_Base("Unable to create object without a redhawk reference object.")
         elif (None == rh_parent):
@@ -82,34 +166,86 @@ class Proxy_Base(object):
         self._id = ''
         self._name = ''
         self._domain_id = ''
-        self._greenlet = None
-        self._oneshotGreenlet = None
-        self._greenletPeriodSec = 1.0
+        self._periodicTask = None
+        self._oneshotTask = None
+        self._periodSec = 1.0
+        self._indexKey = ('', '')
+        self._expanded = False
+        self._snapshot = None
+        self._snapshotTime = None
+        self._snapshotNested = []
+        self._version = 0
+        
+        self._index = index
+        if (None == self._index):
+            if isinstance(rh_parent, Proxy_Base):
+                self._index = rh_parent._index
+            else:
+                self._index = Proxy_Index()
+        
+        self._scheduler = scheduler
+        if (None == self._scheduler):
+            if isinstance(rh_parent, Proxy_Base):
+                self._scheduler = rh_parent._scheduler
+            else:
+                self._scheduler = Scheduler()
+        
+        self._lazy = lazy
+        if (None == self._lazy):
+            self._lazy = isinstance(rh_parent, Proxy_Base) and rh_parent._lazy
+        
+        self._staleSec = staleSec
+        if (None == self._staleSec):
+            if isinstance(rh_parent, Proxy_Base):
+                self._staleSec = rh_parent._staleSec
+            else:
+                self._staleSec = SNAPSHOT_STALE_SEC
+        
+        self._pool = pool
+        if (None == self._pool):
+            if isinstance(rh_parent, Proxy_Base):
+                self._pool = rh_parent._pool
+            else:
+                self._pool = CORBA_Pool()
         
-        # Announce creation and then finish init.
-        self.sendMessages([self.getMessage('add')])
+        # Announce creation, finish init, become routable, and then (unless 
+        # lazy) create the children.
+        self.sendMessages([self._getNodeMessage('add')])
         # FIXME: self._outbox.put([self.getMessage('add')])
         self._finish_init_()
+        self._index.add(self)
+        if not self._lazy:
+            self.expand()
     
     """
-    Fetch the domain ID, from the parent if necessary.
+    Fetch the domain ID, from the parent if necessary.  The root of the
+    hierarchy (the Domain) is its own domain.
     """
     @property
     def getDomainID(self):
-        if ('' == self._domain_id):
+        if ('' != self._domain_id):
+            return self._domain_id
+        elif isinstance(self._parent, Proxy_Base):
             return self._parent.getDomainID
         else:
-            return self._domain_id
-        
+            return self.getID
+    
+    """
+    Do not override.  The (domain ID, rhid) key this proxy was indexed with.
+    """
+    @property
+    def getKey(self):
+        return self._indexKey
     
     """
     Do not override.  External objects will call this to locate this proxy and it should always 
     have a valid value.  Override _getID() to get the identifier from the unique RH instance.
+    The identifier never changes so it is only fetched until it is known.
     """
     @property
     def getID(self):
         try:
-            if (None != self._getID):
+            if ('' == self._id) and (None != self._getID):
                 self._id = self._getID;
         finally:
             return self._id
@@ -130,30 +266,52 @@ class Proxy_Base(object):
     """
     Do not override.  Method is a frontend for routing incoming message processing to lower
     levels of hierarchy.  Implement _processThisMessage() to handle incoming messages per this class.
+    Messages to descendents are located through the Proxy_Index within this domain.
+    Anything but an 'update' may change this object so its cached message is dropped.
     @param message The RH_Message to process.
     @return array of RH Message (either empty array or populated with objects).
     """
     def processMessage(self, message):
         msgs = []
         # Message is to this object.
-        if (message['rhid'] == self.getID):
-            msgs += self._processThisMessage(message)
+        if (message['rhid'] == self._indexKey[1]):
+            if ('update' != message['change']):
+                self.invalidate()
+            msgs += self.qualify(self._processThisMessage(message))
             
         # Message is to a descendent, perhaps.
         else:
-            c = [c for c in self._children if c.getID == message['rhid']]
-            if (1 == len(c)):
-                msgs += c[0].processMessage(message)
-                
-            elif (message['more']['parentID'] in self.allDescendentIDs):
-                for c in self._children:
-                    msgs += c.processMessage(message)
+            for p in self._index.lookup(message['rhid'], self.getDomainID):
+                if p.isDescendentOf(self):
+                    msgs += p.processMessage(message)
         return msgs
     
+    """
+    Do not override.  True if this proxy is contained (at any depth) by ancestor.
+    """
+    def isDescendentOf(self, ancestor):
+        p = self._parent
+        while isinstance(p, Proxy_Base):
+            if (p is ancestor):
+                return True
+            p = p._parent
+        return False
+    
+    """
+    Do not override.  Adds this proxy's domain ID to the `more` of each message
+    (if not already present) so the client can echo it back for routing.
+    @return msgarray
+    """
+    def qualify(self, msgarray):
+        domainID = self.getDomainID
+        for msg in msgarray:
+            if ('domainID' not in msg['more']):
+                msg['more']['domainID'] = domainID
+        return msgarray
+    
     """
     Do not override...And don't use if you can avoid it.
-    It's not efficient, but is an effective means of helping the processMessage() routing system.  
-    Per message received at the Domain level, a refresh will be requested throughout the system.
+    It's not efficient and is no longer needed for routing (see Proxy_Index).
     """
     def updateDescendentIDs(self):
         ids = []
@@ -166,40 +324,173 @@ class Proxy_Base(object):
     
     """
     Do not override.  Method does an "update from here" message starting at this point in the 
-    REDHAWK Hierarchy and out towards descendents.
+    REDHAWK Hierarchy and out towards descendents.  Each proxy's message comes from its 
+    cache (see getSnapshot) so repeated updates do not re-query REDHAWK.
     """
     def getUpdateFromHere(self, change):
-        msgs = [self.getMessage(change)]
+        msgs = [self.getSnapshot(change)]
+        for c in self._children:
+            msgs += c.getUpdateFromHere(change)
+        return msgs
+    
+    """
+    Do not override.  getUpdateFromHere() of the descendents only, e.g., for one
+    session expanding or collapsing a proxy that others keep expanded.
+    """
+    def getDescendentUpdate(self, change):
+        msgs = []
         for c in self._children:
             msgs += c.getUpdateFromHere(change)
         return msgs
     
     """
-    Do not override.  Call this method to kick-off a periodic task (_greenlet) timed to 
-    the update rate specified by _greenletPeriodSec.  This method calls _doPeriodicTask()
-    and re-schedules the event.
+    Do not override.  This proxy's message, rebuilt only if the cached one was invalidated
+    or is older than _staleSec.  `more` includes the `version` of the cached message, 
+    which changes only when a rebuild changes the rest of `more`.
+    @return A copy of the message using change.
+    """
+    def getSnapshot(self, change='update'):
+        if ('remove' == change):
+            return self._getNodeMessage(change)
+        
+        if self.isStale:
+            last = self._snapshot
+            self._snapshot = self._getNodeMessage('update')
+            if (None != last):
+                lastMore = dict(last['more'])
+                del lastMore['version']
+                if (lastMore != self._snapshot['more']):
+                    self._version += 1
+            self._snapshot['more']['version'] = self._version
+            self._snapshotTime = time.time()
+            self._snapshotNested = [k for k, v in self._snapshot['more'].items() 
+                                    if isinstance(v, (dict, list))]
+        msg = dict(self._snapshot)
+        msg['more'] = dict(self._snapshot['more'])
+        # Nested values are copied too, so callers may change any of the message.
+        for k in self._snapshotNested:
+            msg['more'][k] = _copyValue(msg['more'][k])
+        msg['change'] = change
+        return msg
+    
+    """
+    Do not override.  True if the cached message must be rebuilt before being used.
+    """
+    @property
+    def isStale(self):
+        return ((None == self._snapshotTime) or 
+                (self._staleSec <= time.time() - self._snapshotTime))
+    
+    """
+    Do not override.  Marks the cached message stale (e.g., after an ODM event or a value change).
+    """
+    def invalidate(self):
+        self._snapshotTime = None
+    
+    """
+    Do not override.  Creates this proxy's children (each sends its own 'add') if
+    that was deferred by a lazy tree.
+    @return array of RH_Message acknowledging the (now) expanded state.
+    """
+    def expand(self):
+        if not self._expanded:
+            self._expanded = True
+            self.invalidate()
+            if self._expandable:
+                self._createChildren()
+        return [self._getNodeMessage('update')]
+    
+    """
+    Do not override.  In a lazy tree, frees this proxy's children (each sends its 
+    'remove') unless any of them is busy (e.g., streaming).
+    @return array of RH_Message acknowledging the resulting state.
+    """
+    def collapse(self):
+        if self._lazy and self._expanded and self._expandable and not self.isBusy:
+            for c in self._children:
+                c.cleanUp()
+            self._children = []
+            self._expanded = False
+            self.invalidate()
+        return [self._getNodeMessage('update')]
+    
+    """
+    Do not override.  True once the children have been created (see expand).
+    """
+    @property
+    def isExpanded(self):
+        return self._expanded
+    
+    """
+    Do not override.  True if this proxy or any descendent is busy (see _busy).
+    """
+    @property
+    def isBusy(self):
+        if self._busy:
+            return True
+        for c in self._children:
+            if c.isBusy:
+                return True
+        return False
+    
+    """
+    Do not override.  getMessage() plus, in a lazy tree, whether the proxy can be
+    and has been expanded (`expandable` and `expanded` in `more`).
+    """
+    def _getNodeMessage(self, change):
+        msg = self.getMessage(change)
+        if self._lazy and ('remove' != change):
+            msg['more']['expandable'] = self._expandable
+            msg['more']['expanded'] = self._expanded
+        return msg
+    
+    """
+    Do not override.  Makes a blocking (CORBA) call, fn(*args), on the CORBA_Pool so
+    the gevent hub keeps running meanwhile.  Raises CORBA_Timeout if it takes too long.
+    """
+    def _call(self, fn, *args):
+        return self._pool.call(fn, *args)
+    
+    """
+    Do not override.  Creates a child proxy, factory(obj, self, self._outbox), for each 
+    of objs concurrently so their CORBA calls overlap on the pool.  Children that fail 
+    to be created are skipped.
+    @return List of the new children, in the order of objs.
+    """
+    def _createEach(self, factory, objs):
+        return self._pool.map(lambda obj: factory(obj, self, self._outbox), objs)
+    
+    """
+    Do not override.  Call this method to kick-off a periodic task (_periodicTask) timed to 
+    the update rate specified by _periodSec.  This method calls _doPeriodicTask() now
+    and then has the Scheduler call it at a fixed rate.  Calling it again restarts the
+    task at the current _periodSec.
     """
     def doPeriodicTask(self):
+        self.stopPeriodicTask()
+        self._periodicTask = self._scheduler.schedulePeriodic(self._doPeriodicTask, 
+                                                              self._periodSec, self.getID,
+                                                              self._blockingTask)
         self._doPeriodicTask()
-        self._greenlet = gevent.spawn_later(self._greenletPeriodSec, self.doPeriodicTask)
     
     """
     Do not override.  Call this method to fire _doPeriodicTask() once after some number
     of seconds (which can be a fraction)
     """
     def doPeriodicTaskOnceAfter(self, sec):
-        if (None != self._oneshotGreenlet):
-            self._oneshotGreenlet.kill()
+        if (None != self._oneshotTask):
+            self._oneshotTask.cancel()
             
-        self._oneshotGreenlet = gevent.spawn_later(sec, self._doPeriodicTask)
+        self._oneshotTask = self._scheduler.scheduleOnce(self._doPeriodicTask, sec, self.getID,
+                                                         self._blockingTask)
     
     """
-    Do not override.  Simply stops (kills) the greenlet running the periodic task.
+    Do not override.  Simply stops (cancels) the periodic task.
     """
     def stopPeriodicTask(self):
-        if (None != self._greenlet):
-            self._greenlet.kill(block=False)
-            self._greenlet = None
+        if (None != self._periodicTask):
+            self._periodicTask.cancel()
+            self._periodicTask = None
     
     """
     Do not override.  Ensures the following:
@@ -209,10 +500,12 @@ class Proxy_Base(object):
       4) Sends a 'remove' message for this entity to the client.
     """
     def cleanUp(self):
+        self._index.remove(self)
         self._cleanUp()
         self.stopPeriodicTask()
-        if (None != self._oneshotGreenlet):
-            self._oneshotGreenlet.kill(block=False)
+        if (None != self._oneshotTask):
+            self._oneshotTask.cancel()
+            self._oneshotTask = None
         for c in self._children:
             c.cleanUp()
         self._children = []
@@ -227,7 +520,7 @@ class Proxy_Base(object):
     """
     def sendMessages(self, msgarray):
         if (0 < len(msgarray)):
-            self._outbox.put(msgarray)
+            self._outbox.put(self.qualify(msgarray))
         gevent.sleep(0)
     
     """
@@ -243,19 +536,33 @@ class Proxy_Base(object):
         raise Proxy_Base("Class did not implement _getMessage")
     
     """
-    Method only called once at __init__.  Should finish init of the object and populate 
-    _children with any Proxy_Base objects created in the process.
+    Method only called once at __init__.  Should finish init of the object itself;
+    children are created in _createChildren().
     """
     def _finish_init_(self):
         raise Proxy_Base("Class did not implement _finish_init_")
     
+    """
+    Populate _children with the Proxy_Base objects contained in this one.  Called 
+    once after _finish_init_(), or upon expand() if the tree is lazy.
+    """
+    def _createChildren(self):
+        pass
+    
+    """
+    @return True if the proxy must not be collapsed away (e.g., it is streaming).
+    """
+    @property
+    def _busy(self):
+        return False
+    
     
     """
     @return the unique ID of this REDHAWK object (_get_identifier(), etc.)
     """
     @property
     def _getID(self):
-        return self._obj._get_identifier()
+        return self._call(self._obj._get_identifier)
 
     """
     @return the name of this REDHAWK object (name, etc.)
@@ -28,10 +28,11 @@ from ossie.utils import redhawk
 
 class Device_Manager(Proxy_Base):    
     def _finish_init_(self):
-        for d in self._obj.devs:
-            self._children.append(Device(d, self, self._outbox))
-        for s in self._obj.services:
-            self._children.append(Service(s, self, self._outbox))
+        pass
+    
+    def _createChildren(self):
+        self._children += self._createEach(Device, self._call(getattr, self._obj, 'devs'))
+        self._children += self._createEach(Service, self._call(getattr, self._obj, 'services'))
     
     def getMessage(self, change='add'):
         return RH_Message(change, 
@@ -43,9 +44,9 @@ class Device_Manager(Proxy_Base):
     def _processThisMessage(self, message):
         # TODO: What other kinds of messages does this entity require?
         if ('update' == message['change']):
-            if (0 == len(self._children)):
-                # Should have children.  Reattempt _finish_init_()
-                self._finish_init_()
+            if (0 == len(self._children)) and self._expanded:
+                # Should have children.  Reattempt _createChildren()
+                self._createChildren()
             return self.getUpdateFromHere('update')
         # default response
         return []
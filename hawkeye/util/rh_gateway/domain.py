@@ -23,13 +23,28 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from core import RH_Message, Proxy_Base
 from device_manager import Device_Manager
+from comp_dev import Device
+from service import Service
 from application import Application
+from scheduler import Async_Signal
+from corba_pool import Identifier_Cache
+from log import getLogger
 
 from ossie.utils import redhawk
 from ossie.utils.redhawk.channels import ODMListener
 from ossie.utils.weakmethod import WeakBoundMethod
 
-import gevent, string, sys
+from collections import deque, OrderedDict
+import gevent, string, time
+
+# Window, in seconds, over which ODM events are collected before being applied.
+ODM_DEBOUNCE_SEC = 0.25
+# First delay, in seconds, before retrying an 'added' entity missing from the model
+# (doubled each attempt) and the number of attempts before giving up on it.
+ODM_RETRY_SEC = 0.25
+ODM_RETRY_LIMIT = 6
+
+log = getLogger('domain')
 
 
 # REDHAWK Domain object.
@@ -40,13 +55,20 @@ class Domain(Proxy_Base):
     def _finish_init_(self):
         # Connect ODM callbacks, create device managers and waveforms
         self._odm = ODMListener()
+        self._activitySignal = None
+        self._events = deque()
+        self._retries = {}
+        # Identifier of each model object already asked for it.
+        self._identifiers = Identifier_Cache(self._pool)
+        self._eventTask = None
+        self._eventSignal = Async_Signal(self.__eventsQueued)
         self._domain_id = self.getID
-        for node in self._obj.devMgrs:
-            self._children.append(Device_Manager(node, self, self._outbox))       
-        for wave in self._obj.apps:
-            self._children.append(Application(wave, self, self._outbox))
         self.__connect_channels__()
     
+    def _createChildren(self):
+        self._children += self._createEach(Device_Manager, self._call(getattr, self._obj, 'devMgrs'))
+        self._children += self._createEach(Application, self._call(getattr, self._obj, 'apps'))
+    
     def getMessage(self, change='change'):
         return RH_Message(change, 'domain', self.getID, self.getName)
     
@@ -58,6 +80,9 @@ class Domain(Proxy_Base):
         return []
     
     def _cleanUp(self):
+        self._eventSignal.stop()
+        if (None != self._eventTask):
+            self._eventTask.cancel()
         try:
             self._odm.disconnect()
         except:
@@ -67,6 +92,17 @@ class Domain(Proxy_Base):
      * ADDONS
     """
     
+    """
+    The gateway's Async_Signal to send() on every ODM event (from the ODM
+    thread) so that it rescans for domains right away.
+    """
+    def setActivitySignal(self, signal):
+        self._activitySignal = signal
+    
+    def __signalActivity(self):
+        if (None != self._activitySignal):
+            self._activitySignal.send()
+    
     def __connect_channels__(self):
         try:            
             # Connect to events on ODM channel
@@ -88,43 +124,113 @@ class Domain(Proxy_Base):
      *  ODM Event Callbacks
      *  ODM Event: producerId, sourceId, sourceName, sourceCategory
      *     Notes: 1) Ignoring sourceIOR stringified object.
-     *            2) These are async callbacks to the parent and therefore
-     *               invoke passMessages via ZeroRPC.
-     *  The 2 second delay is to let the Domain's model catch up with the 
-     *  faster incoming ODM events.
+     *            2) These are called on the ODM (omniORB) thread so they only
+     *               queue the event and signal the hub; see __applyEvents.
      *
      *  Possible evt.sourceCategories are: device_manager, device, 
-     *  application_factory, application, and service.  The Domain
-     *  only needs to listen for the top-level Device Manager and 
-     *  Application events since each entity will handle their children,
-     *  respectively.
+     *  application_factory, application, and service.
     """        
     def __ODM_Added(self, evt):
-        gevent.sleep(2)
-        rhtype = string.lower("{0}".format(evt.sourceCategory))
-        if ('device_manager' == rhtype):
-            for dm in self._obj.devMgrs:
-                if (dm._get_identifier() == evt.sourceId):
-                    self._children.append(Device_Manager(dm, self, self._outbox))
-        elif ('application' == rhtype):
-            for wave in self._obj.apps:
-                if (wave._get_identifier() == evt.sourceId):
-                    self._children.append(Application(wave, self, self._outbox))
+        self.__queueEvent(evt, True)
         
+    def __ODM_Removed(self, evt):
+        self.__queueEvent(evt, False)
+    
+    def __queueEvent(self, evt, added):
+        self._events.append((added, string.lower("{0}".format(evt.sourceCategory)), evt.sourceId))
+        self._eventSignal.send()
+        self.__signalActivity()
+    
+    # (Hub) Opens the window over which queued events are collected.
+    def __eventsQueued(self):
+        self.__scheduleEvents(ODM_DEBOUNCE_SEC)
+    
+    # Applies the events in delaySec, or sooner if that was already scheduled
+    # (e.g., new events arriving while waiting on a retry).
+    def __scheduleEvents(self, delaySec):
+        if (None != self._eventTask) and self._eventTask.active:
+            if (self._eventTask.deadline <= time.time() + delaySec):
+                return
+            self._eventTask.cancel()
+        self._eventTask = self._scheduler.scheduleOnce(self.__applyEvents, delaySec, 
+                                                       self.getID + '.odm')
+    
     """
-     *  ODM "Removed" listener.  Only responds to device_manager and application
-     *  event categories since the Domain prunes the top-level entity.
+     *  Applies the events collected over the window (and any retries that are due).
+     *  Only the last event per source is kept so, e.g., a device manager that is
+     *  added and removed again within the window is never created.  Removals
+     *  prune the source's proxy (found through the Proxy_Index) from its parent.
+     *  The Domain creates top-level Device Managers and Applications that were
+     *  added, and Devices and Services under whichever (expanded) Device Manager
+     *  has them; those not in the model yet are retried, backing off, up to
+     *  ODM_RETRY_LIMIT times.
     """
-    def __ODM_Removed(self, evt):
-        rhtype = string.lower("{0}".format(evt.sourceCategory))
-        if ('device_manager' != rhtype) and ('application' != rhtype):
-            return
+    def __applyEvents(self):
+        self._eventTask = None
+        now = time.time()
+        pending = OrderedDict()
+        for sourceId, (added, rhtype, attempts, due) in list(self._retries.items()):
+            if (due <= now):
+                del self._retries[sourceId]
+                pending[sourceId] = (added, rhtype, attempts)
+        while (0 < len(self._events)):
+            added, rhtype, sourceId = self._events.popleft()
+            self._retries.pop(sourceId, None)
+            pending.pop(sourceId, None)
+            pending[sourceId] = (added, rhtype, 0)
+        
+        if (0 < len(pending)):
+            self.invalidate()
+        adds = {'device_manager': [], 'application': [], 'device': [], 'service': []}
+        for sourceId, (added, rhtype, attempts) in pending.items():
+            for p in self._index.lookup(sourceId, self.getDomainID):
+                p.invalidate()
+            if not added:
+                self.__removeProxy(sourceId)
+            elif (rhtype in adds) and (None == self._index.get((self.getDomainID, sourceId))):
+                adds[rhtype].append((sourceId, attempts))
         
-        idx = -1
-        for i, c in enumerate(self._children):
-            if (evt.sourceId == c.getID):
-                idx = i
-                c.cleanUp()
+        # Until expanded, added entities are created with the rest upon expand().
+        if self._expanded:
+            self.__addProxies(adds['device_manager'], 'device_manager', [self], Device_Manager, 'devMgrs')
+            self.__addProxies(adds['application'], 'application', [self], Application, 'apps')
+            devMgrs = [c for c in self._children if isinstance(c, Device_Manager) and c.isExpanded]
+            self.__addProxies(adds['device'], 'device', devMgrs, Device, 'devs')
+            self.__addProxies(adds['service'], 'service', devMgrs, Service, 'services')
+        
+        if (0 < len(self._retries)):
+            due = min([r[3] for r in self._retries.values()])
+            self.__scheduleEvents(max(0.0, due - time.time()))
+    
+    def __removeProxy(self, sourceId):
+        p = self._index.get((self.getDomainID, sourceId))
+        if (None != p) and isinstance(p._parent, Proxy_Base) and (p in p._parent._children):
+            p._parent._children.remove(p)
+            p.cleanUp()
+    
+    # Creates a child, factory(obj, parent, outbox), for each (sourceId, attempts) 
+    # found in the list attr of the first of parents' models that has it (each
+    # list read once for all of them).  The rest are queued to be retried as 
+    # rhtype events.
+    def __addProxies(self, added, rhtype, parents, factory, attr):
+        if (0 == len(added)) or (0 == len(parents)):
+            # Without an expanded parent they are created upon its expand().
+            return
+        missing = OrderedDict(added)
+        for parent in parents:
+            if (0 == len(missing)):
                 break
-        if (-1 != idx):
-            del self._children[idx]
+            try:
+                byID = self._identifiers.find(self._call(getattr, parent._obj, attr), missing)
+            except Exception as e:
+                log.warning("Domain failed to read the %s of %s: %s", attr, parent.getID, e)
+                continue
+            found = [sourceId for sourceId in missing if sourceId in byID]
+            parent._children += parent._createEach(factory, [byID[sourceId] for sourceId in found])
+            for sourceId in found:
+                del missing[sourceId]
+        
+        for sourceId, attempts in missing.items():
+            if (attempts < ODM_RETRY_LIMIT):
+                self._retries[sourceId] = (True, rhtype, attempts + 1, 
+                                           time.time() + ODM_RETRY_SEC * (2 ** attempts))
@@ -0,0 +1,205 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Leveled, rate-limited and asynchronous logging for the gateway.
+
+Every module logs through getLogger(name) (a child of the 'rh_gateway'
+logger) rather than print().  The gateway's stdout is piped to Node.js, so
+configureLogging() installs an Async_Handler: callers, whether the gevent hub
+or the omniORB thread, only queue the record and a native writer thread
+formats it and writes it out.  A Rate_Limit_Filter keeps a repeated warning
+(same logger and message template) to one line per interval, with the count
+of the ones suppressed meanwhile.
+"""
+
+import logging, sys, time, threading
+from collections import deque
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Records held for the writer thread; beyond that the oldest are dropped.
+LOG_QUEUE_SIZE = 10000
+
+# Seconds between repeats of the same warning (or error).
+RATE_LIMIT_SEC = 1.0
+
+# Seconds between checks for suppressed records to report (see Rate_Limit_Filter).
+EXPIRE_SEC = 1.0
+
+
+# @return The gateway's logger for name (e.g., the module's).
+def getLogger(name):
+    return logging.getLogger('rh_gateway.' + name)
+
+
+"""
+Passes a record at or above `level` only if the same one has not passed in 
+the last intervalSec.  Records are the same if they come from the same logger
+with the same message template and either the same `source` (if logged with
+extra={'source': ...}, e.g., for arguments such as counts that change every
+time) or else the same arguments.  The next one to pass reports how many were
+suppressed, e.g.,
+    "Port X lost 512 samples to ring overruns (37 more in the last 1.0 sec)"
+If none does, expire() (called periodically by Async_Handler) returns the 
+last one suppressed, reporting the rest, once the interval is over.
+Records below `level` always pass.
+"""
+class Rate_Limit_Filter(logging.Filter):
+    def __init__(self, intervalSec=RATE_LIMIT_SEC, level=logging.WARNING):
+        logging.Filter.__init__(self)
+        self.intervalSec = intervalSec
+        self.level = level
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if (record.levelno < self.level) or (0 >= self.intervalSec):
+            return True
+        key = self._key(record)
+        with self._lock:
+            last, suppressed, _ = self._last.get(key, (None, 0, None))
+            if (None != last) and (record.created - last < self.intervalSec):
+                self._last[key] = (last, suppressed + 1, record)
+                return False
+            self._last[key] = (record.created, 0, None)
+        self._report(record, suppressed)
+        return True
+
+    # @return Records to log now: the last suppressed of each record whose 
+    #    interval is over (or, if force, every one) without another passing.
+    def expire(self, now=None, force=False):
+        now = time.time() if (None == now) else now
+        records = []
+        with self._lock:
+            for key, (last, suppressed, record) in list(self._last.items()):
+                if (now - last < self.intervalSec) and not (force and (0 < suppressed)):
+                    continue
+                if (0 < suppressed):
+                    self._last[key] = (now, 0, None)
+                    records.append(self._report(record, suppressed - 1))
+                else:
+                    # Idle; the next one passes anyway.
+                    del self._last[key]
+        return records
+
+    def _key(self, record):
+        source = getattr(record, 'source', None)
+        if (None != source):
+            return (record.name, record.msg, source)
+        try:
+            hash(record.args)
+            return (record.name, record.msg, record.args)
+        except TypeError:
+            return (record.name, record.msg, repr(record.args))
+
+    def _report(self, record, suppressed):
+        if (0 < suppressed):
+            record.msg = "{0} ({1} more in the last {2} sec)".format(
+                record.getMessage(), suppressed, self.intervalSec)
+            record.args = None
+        return record
+
+
+"""
+Handler that only queues records; a daemon native thread formats them and
+writes them to `stream` (flushing once per batch), so logging never waits on
+the pipe.  If the writer falls LOG_QUEUE_SIZE records behind, the oldest are
+dropped and the count is written with the next batch.  Every expireSec it
+also writes what its filters' expire() return (see Rate_Limit_Filter).
+
+Records are formatted in the writer thread, so arguments should not be
+changed after being logged.
+"""
+class Async_Handler(logging.Handler):
+    def __init__(self, stream=None, size=LOG_QUEUE_SIZE, expireSec=EXPIRE_SEC):
+        logging.Handler.__init__(self)
+        self.stream = stream if (None != stream) else sys.stdout
+        self.expireSec = expireSec
+        self.dropped = 0
+        self._records = deque(maxlen=max(1, int(size)))
+        self._drainLock = threading.Lock()
+        self._wake = threading.Event()
+        self._writer = threading.Thread(target=self._write, name='rh_gateway log writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def emit(self, record):
+        if (len(self._records) == self._records.maxlen):
+            self.dropped += 1
+        self._records.append(record)
+        self._wake.set()
+
+    # Writes everything queued (and suppressed) before returning (e.g., on exit).
+    def flush(self):
+        self._drain(True)
+
+    def _write(self):
+        while True:
+            self._wake.wait(self.expireSec)
+            self._wake.clear()
+            self._drain()
+
+    def _drain(self, force=False):
+        with self._drainLock:
+            records = []
+            for f in self.filters:
+                if hasattr(f, 'expire'):
+                    records += f.expire(force=force)
+            while True:
+                try:
+                    records.append(self._records.popleft())
+                except IndexError:
+                    break
+            if (0 < self.dropped):
+                records.append(logging.makeLogRecord({
+                    'name': 'rh_gateway.log', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': "Dropped {0} log records".format(self.dropped)}))
+                self.dropped = 0
+
+            lines = []
+            for record in records:
+                try:
+                    lines.append(self.format(record))
+                except Exception:
+                    self.handleError(record)
+            if (0 < len(lines)):
+                try:
+                    self.stream.write('\n'.join(lines) + '\n')
+                    self.stream.flush()
+                except Exception:
+                    pass
+
+
+"""
+Sets the level of the gateway's loggers and sends them through an
+Async_Handler (with a Rate_Limit_Filter) to stream (default stdout).
+Calling it again replaces the handler.
+@return The handler
+"""
+def configureLogging(level='INFO', stream=None, rateLimitSec=RATE_LIMIT_SEC):
+    root = logging.getLogger('rh_gateway')
+    for h in list(root.handlers):
+        h.flush()
+        root.removeHandler(h)
+    handler = Async_Handler(stream)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(Rate_Limit_Filter(rateLimitSec))
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+    return handler
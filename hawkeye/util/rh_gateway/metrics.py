@@ -0,0 +1,190 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Counters, gauges and histograms of the gateway's activity.
+"""
+
+import bisect
+from collections import OrderedDict
+from log import getLogger
+
+# Default histogram bucket upper bounds, in seconds.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_TYPES = ('counter', 'gauge', 'histogram')
+
+log = getLogger('metrics')
+
+
+"""
+Distribution of observed values over fixed buckets.  observe() is cheap
+enough for any thread (e.g., omniORB's); concurrent observations may, rarely,
+lose a count, which is acceptable for monitoring.
+
+    buckets is the (sorted) upper bound of each bucket
+    counts is the number of observations per bucket, plus one for the rest
+    sum and count are the total and number of all observations
+"""
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # @return Dictionary of the cumulative `buckets` ([upper bound, count]
+    #    pairs, the last bound being '+Inf'), `sum` and `count`.
+    def snapshot(self):
+        total = 0
+        buckets = []
+        for le, n in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += n
+            buckets.append([le, total])
+        return {'buckets': buckets, 'sum': self.sum, 'count': self.count}
+
+
+"""
+Named metrics, each a counter, gauge or histogram with a value per set of
+labels (keyword arguments, e.g., port='...').  Values that are cheaper to
+read on demand than to maintain (queue depths, ring statistics...) are set
+by collectors, functions called with the registry by collect().
+
+A metric is described (type and help) by the first call naming it, or by
+describe() beforehand.
+"""
+class Metrics_Registry(object):
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._collectors = []
+
+    def describe(self, name, kind, help=''):
+        if (kind not in METRIC_TYPES):
+            raise ValueError("Unknown metric type: " + str(kind))
+        if (name not in self._metrics):
+            self._metrics[name] = {'type': kind, 'help': help, 'values': {}}
+        return self._metrics[name]
+
+    # Adds amount to the counter.
+    def inc(self, name, amount=1, **labels):
+        values = self.describe(name, 'counter')['values']
+        key = self._key(labels)
+        values[key] = values.get(key, 0) + amount
+
+    # Sets the counter or gauge (e.g., a running count kept elsewhere).
+    def set(self, name, value, kind='gauge', **labels):
+        self.describe(name, kind)['values'][self._key(labels)] = value
+
+    # Observes value in the histogram (created with buckets).
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        self.histogram(name, buckets, **labels).observe(value)
+
+    # @return The Histogram of name for labels.
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels):
+        values = self.describe(name, 'histogram')['values']
+        key = self._key(labels)
+        if (key not in values):
+            values[key] = Histogram(buckets)
+        return values[key]
+
+    # Uses a Histogram kept elsewhere (e.g., by the CORBA_Pool) as name for labels.
+    def setHistogram(self, name, histogram, **labels):
+        self.describe(name, 'histogram')['values'][self._key(labels)] = histogram
+
+    # Drops every value of name (e.g., before a collector sets the current ones).
+    def clear(self, name):
+        if (name in self._metrics):
+            self._metrics[name]['values'] = {}
+
+    # fn(registry) is called by each collect().
+    def addCollector(self, fn):
+        self._collectors.append(fn)
+
+    """
+    Runs the collectors and returns every metric:
+        {name: {'type': ..., 'help': ...,
+                'values': [{'labels': {...}, 'value': number or Histogram.snapshot()}]}}
+    """
+    def collect(self):
+        for fn in self._collectors:
+            try:
+                fn(self)
+            except Exception as e:
+                log.error("Metrics collector failed: %s", e)
+
+        metrics = {}
+        for name, metric in self._metrics.items():
+            values = []
+            for key, value in list(metric['values'].items()):
+                if isinstance(value, Histogram):
+                    value = value.snapshot()
+                values.append({'labels': dict(key), 'value': value})
+            metrics[name] = {'type': metric['type'], 'help': metric['help'], 'values': values}
+        return metrics
+
+    # @return The collected metrics in the Prometheus text exposition format.
+    def prometheusText(self, prefix='hawkeye_'):
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            full = prefix + name
+            if metric['help']:
+                lines.append('# HELP {0} {1}'.format(full, metric['help']))
+            lines.append('# TYPE {0} {1}'.format(full, metric['type']))
+            for v in metric['values']:
+                if ('histogram' == metric['type']):
+                    h = v['value']
+                    for le, n in h['buckets']:
+                        labels = dict(v['labels'], le=le)
+                        lines.append('{0}_bucket{1} {2}'.format(full, _labels(labels), n))
+                    lines.append('{0}_sum{1} {2}'.format(full, _labels(v['labels']), repr(float(h['sum']))))
+                    lines.append('{0}_count{1} {2}'.format(full, _labels(v['labels']), h['count']))
+                else:
+                    lines.append('{0}{1} {2}'.format(full, _labels(v['labels']), repr(float(v['value']))))
+        return '\n'.join(lines) + '\n'
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+
+# Prometheus label set, e.g., {port="a",session="b"} (empty if no labels).
+def _labels(labels):
+    if (0 == len(labels)):
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(['{0}="{1}"'.format(k, escape(v)) for k, v in sorted(labels.items())]) + '}'
+
+
+"""
+WSGI application serving registry.prometheusText() at /metrics (for the
+gateway's --metrics-port, run with gevent's pywsgi server).
+"""
+def prometheusApp(registry):
+    def app(environ, start_response):
+        if ('/metrics' != environ.get('PATH_INFO', '')):
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found\n']
+        body = registry.prometheusText().encode('utf-8')
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+    return app
@@ -0,0 +1,201 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Playback of recorded captures as virtual BULKIO ports.
+"""
+
+from core import RH_Message, Proxy_Base
+from port import Port_BULKIO, StreamHelper
+from capture import Capture_Reader, listCaptures, META_EXT
+
+import os, time
+
+# Seconds between scans of the capture directory for new or deleted captures.
+LIBRARY_SCAN_SEC = 5.0
+
+# Limits of the playback `speed` (multiple of the recorded sample rate).
+PLAYBACK_MIN_SPEED = 0.01
+PLAYBACK_MAX_SPEED = 1000.0
+
+
+"""
+Root of a tree of the captures (see capture.py) in a directory, in place of
+a REDHAWK domain.  It is sent to the client as a 'domain' so that it is shown
+alongside the real ones; each complete capture segment is a Port_Playback
+child.  The directory is rescanned every LIBRARY_SCAN_SEC (and on 'update')
+so that captures recorded, or deleted, meanwhile are added and removed.
+
+@param rh_obj The capture directory.
+"""
+class Capture_Library(Proxy_Base):
+    def _finish_init_(self):
+        self._domain_id = self.getID
+        self._periodSec = LIBRARY_SCAN_SEC
+        self.doPeriodicTask()
+
+    def _createChildren(self):
+        self._children += self._createEach(Port_Playback, listCaptures(self._obj))
+
+    @property
+    def _getID(self):
+        return 'captures:' + os.path.abspath(self._obj)
+
+    @property
+    def _getName(self):
+        return 'Captures (' + self._obj + ')'
+
+    def getMessage(self, change='update'):
+        return RH_Message(change, 'domain', self.getID, self.getName, {'playback': True})
+
+    def _processThisMessage(self, message):
+        if ('update' == message['change']):
+            self._rescan()
+            return self.getUpdateFromHere('update')
+        return []
+
+    def _doPeriodicTask(self):
+        self._rescan()
+
+    # Adds a child for each new capture and removes those whose files are
+    # gone (unless being played).
+    def _rescan(self):
+        if not self._expanded:
+            return
+        paths = listCaptures(self._obj)
+        current = dict([(c._obj, c) for c in self._children])
+        for path, child in current.items():
+            if (path not in paths) and not child.isBusy:
+                self._children.remove(child)
+                child.cleanUp()
+        added = [path for path in paths if (path not in current)]
+        if (0 < len(added)):
+            self._children += self._createEach(Port_Playback, added)
+            self.invalidate()
+
+
+"""
+Virtual BULKIO port streaming a capture segment from its file.  It is
+started, stopped, configured and recorded exactly like a Port_BULKIO (the
+same StreamHelper formats and decimates its samples) but, rather than
+connecting to a REDHAWK port, each period it feeds the helper the samples
+due since the last one.  Samples are read through the Capture_Reader's
+memory map so only the copy into the helper's ring is made.
+
+The 'start' message also takes, in `more`:
+   `speed` ==> Multiple of the recorded rate (1 / SRI xdelta) to play at
+               (default 1.0)
+   `loop`  ==> If true, start over at the end of the file (default false)
+The end of the file (each time, if looping) is sent as an EOS.  `more` of
+its messages carries `playback` with the `file`, `samples`, `position`,
+`speed` and `loop`.
+
+@param rh_obj The metadata file of the capture segment.
+"""
+class Port_Playback(Port_BULKIO):
+    _reader = None
+
+    def _finish_init_(self):
+        self._isStreaming = False
+        self._isConnected = False
+        self._recorder = None
+        self._periodSec = 0.25
+        self._reader = Capture_Reader(self._obj)
+        self._helper = StreamHelper(self)
+        self._helper.DTYPE = self._reader.dtype
+        self._speed = 1.0
+        self._loop = False
+        self._position = 0
+        self._credit = 0.0
+        self._lastFeed = 0.0
+
+    @property
+    def _getName(self):
+        return os.path.basename(self._obj)[:-len(META_EXT)]
+
+    def getMessage(self, change='update'):
+        msg = Port_BULKIO.getMessage(self, change)
+        if ('remove' != change) and (None != self._reader):
+            msg['more'].update({'direction': 'Uses',
+                                'nameSpace': 'BULKIO',
+                                'data': [],
+                                'playback': {'file': self._reader.path,
+                                             'samples': len(self._reader),
+                                             'position': self._position,
+                                             'speed': self._speed,
+                                             'loop': self._loop}})
+        return msg
+
+    def _processThisMessage(self, message):
+        if ('start' == message['change']) and not self._streaming:
+            try:
+                speed = float(message['more'].get('speed', 1.0))
+                self._speed = min(PLAYBACK_MAX_SPEED, max(PLAYBACK_MIN_SPEED, speed))
+            except (TypeError, ValueError):
+                self._speed = 1.0
+            self._loop = bool(message['more'].get('loop', False))
+        return Port_BULKIO._processThisMessage(self, message)
+
+    # The file is opened (mapped) while streaming or recording, in place of
+    # the connection to a REDHAWK port.
+    def _connect(self):
+        if not self._isConnected:
+            self._reader.open()
+            self._helper.pushSRI(self._reader.sri)
+            self._position = 0
+            self._credit = 0.0
+            self._lastFeed = time.time()
+            self._isConnected = True
+
+    def _disconnect(self):
+        if self._isConnected and not self._isStreaming and (None == self._recorder):
+            self._isConnected = False
+            self._reader.close()
+
+    def _doPeriodicTask(self):
+        if self._streaming:
+            self._feed()
+        Port_BULKIO._doPeriodicTask(self)
+
+    # Pushes the samples due, at the playback speed, since the last feed.
+    # Fractions of a sample (or of a complex pair) carry over to the next one.
+    # At most a ring's worth is pushed per feed; beyond that playback falls
+    # behind the requested speed rather than overrunning the ring.
+    def _feed(self):
+        now = time.time()
+        due = self._credit + (now - self._lastFeed) * self._reader.sampleRate * self._speed
+        self._lastFeed = now
+        count = int(due)
+        if (None != self._helper._ring) and (self._helper._ring.capacity < count):
+            count = self._helper._ring.capacity
+            due = count
+        if self._reader.isComplex:
+            count -= count % 2
+        self._credit = due - count
+
+        total = len(self._reader)
+        while (0 < count) and (0 < total):
+            if (total <= self._position):
+                if not self._loop:
+                    self._credit = 0.0
+                    return
+                self._position = 0
+            samples = self._reader.read(self._position, count)
+            self._position += samples.size
+            count -= samples.size
+            eos = (total <= self._position)
+            self._helper.pushPacket(samples, None, eos, self._reader.streamID)
@@ -21,20 +21,25 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from core import RH_Message, Proxy_Base
+from stream import STREAM_FORMATS, STREAM_MODES, RING_CAPACITY, toSamples, frameRows, timestampToSeconds
+from stream import encodeSamples, minMaxEnvelope, Spectrum_Averager, Ring_Buffer, RING_MAX_CAPACITY
+from capture import Capture_Writer, CAPTURE_SEGMENT_SAMPLES, CAPTURE_SEGMENT_SEC, CAPTURE_SEGMENTS
+from utilities import Lazy_Module
+from log import getLogger
 
-from ossie.utils import redhawk
-from ossie.cf import CF
-from bulkio.bulkioInterfaces import BULKIO__POA
-from omniORB import CORBA
+import string, gevent, json, time
 
-import string, gevent, sys, json
-from Queue import Queue
-from threading import Lock
+# For reshaping data streams.  NumPy and the BULKIO servant bases are only
+# imported when the first BULKIO port is created (see streamHelperClass).
+np = Lazy_Module('numpy')
+BULKIO__POA = Lazy_Module('bulkio.bulkioInterfaces.BULKIO__POA')
+CORBA = Lazy_Module('omniORB.CORBA')
 
-# For reshaping data streams
-import numpy as np
+log = getLogger('port')
 
 class Port(Proxy_Base):
+    _expandable = False
+    
     """
     Returns a Port subclass more appropriately matching the type of the obj,
     for example BULKIO vs. a Frontend Interface.
@@ -82,6 +87,10 @@ class Port(Proxy_Base):
     def _finish_init_(self):
         self._isStreaming = False
     
+    @property
+    def _busy(self):
+        return self._streaming
+    
     @property
     def _getID(self):
         # Port objects don't have an ID in REDHAWK so Port "ID" 
@@ -144,14 +153,14 @@ class Port(Proxy_Base):
 Different Port subclasses types
 """
 """
-BULKIO - Messages are pushed from the RH model into the StreamHelper_* for
-the appropriate data type.  A Queue.Queue is used to maintain a bridge
-between the RH Model's thread and the main greenlet containing the Gateway.
-Because of this, the BULKIO port runs a synchronous "pull" from the
-stream helper which will return all messages received in the last interval.
+BULKIO - Packets are pushed from the RH model into the StreamHelper_* for
+the appropriate data type.  A preallocated Ring_Buffer is used to maintain a 
+bridge between the RH Model's thread and the main greenlet containing the 
+Gateway.  Because of this, the BULKIO port runs a synchronous "pull" from the
+stream helper which will return all samples received in the last interval.
 
-The interval is set by to _greenletPeriodSec which is not necessarily
-an accurate/precise timer, but during testing even 0.000001 only yielded
+The interval is set by _periodSec (run at a fixed rate by the gateway's
+Scheduler), but during testing even 0.000001 only yielded
 a single packet delivered per pull period with a stream pushing >2MB of
 samples in each packet.  Ultimately the inscessant "getMessages" call 
 on the StreamHandler caused its queue to begin cascading.  A slower rate
@@ -159,29 +168,24 @@ introduced more stability despite delivering more messages at a time to
 the client.
 """
 class Port_BULKIO(Port):
+    # Capture_Writer while recording (getMessage('add') precedes _finish_init_).
+    _recorder = None
+    # The periodic task only drains the helper (see _start).
+    _blockingTask = False
+    
     def _finish_init_(self):
         self._isStreaming = False
-        self._greenletPeriodSec = 0.25
+        self._isConnected = False
+        self._recorder = None
+        self._periodSec = 0.25
         
         if ('Uses' == self._obj._direction):
             datatype = self._obj._using.filename
         else:
             datatype = self._obj._interface.filename
         
-        if ('bio_dataShort' == datatype):
-            self._helper = StreamHelper_Short(self)
-        elif('bio_dataUshort' == datatype):
-            self._helper = StreamHelper_Ushort(self)
-        elif('bio_dataOctet' == datatype):
-            self._helper = StreamHelper_Octet(self)
-        elif('bio_dataLong' == datatype):
-            self._helper = StreamHelper_Long(self)
-        elif('bio_dataUlong' == datatype):
-            self._helper = StreamHelper_Ulong(self)
-        elif('bio_dataFloat' == datatype):
-            self._helper = StreamHelper_Float(self)
-        elif('bio_dataDouble' == datatype):
-            self._helper = StreamHelper_Double(self)
+        if (datatype in STREAM_HELPERS):
+            self._helper = streamHelperClass(datatype)(self)
         else:
             # FIXME: Need more handlers...
             raise Port_BULKIO("No stream handler for this type: " + datatype)
@@ -195,35 +199,111 @@ class Port_BULKIO(Port):
         self._connectionID = self.getID + "_stream"
     
     def _cleanUp(self):
+        if (None != self._recorder):
+            try:
+                self._stopRecording()
+            except:
+                pass
         Port._cleanUp(self)
+    
+    # The 'start' message may carry stream options for the helper in `more`:
+    #    `format` ==> 'json' (default) or 'binary' (see stream.py)
+    #    `mode`   ==> 'raw' (default), 'envelope' or 'spectrum' (see stream.py)
+    #    `width`  ==> Display width, in pixels, for 'envelope' (default 320)
+    #    `rate`   ==> Frames per second delivered to the client (default 4)
+    #    `bufferSize` ==> Capacity of the ring buffer, in samples (default 1M, at most 16M)
+    #    'spectrum' also takes `fftSize`, `window`, `overlap`, `averaging`, 
+    #    `alpha` and `frames` (see Spectrum_Averager).
+    #    `trace`  ==> If true, stream messages carry stage timestamps (see stream.py)
+    # Additional subscribers to a running port share the stream as started.
+    #
+    # A 'record' message starts recording the port's samples to capture 
+    # files on the gateway (see capture.py), independent of any streaming,
+    # with these options in `more`:
+    #    `segmentSize` ==> Samples per capture file (default 16M)
+    #    `segmentSec`  ==> Max seconds per capture file (default 60)
+    #    `segments`    ==> Number of the newest files kept (default 5)
+    # A 'record' with `enable` false stops it.  Either is acknowledged with
+    # an 'update' whose more['recording'] is the capture status (or false).
+    def _processThisMessage(self, message):
+        if ('start' == message['change']) and not self._streaming:
+            self._helper.configure(message['more'])
+            try:
+                rate = float(message['more'].get('rate', 4.0))
+                self._periodSec = 1.0 / min(60.0, max(0.1, rate))
+            except (TypeError, ValueError):
+                self._periodSec = 0.25
+        elif ('record' == message['change']):
+            if message['more'].get('enable', True):
+                self._startRecording(message['more'])
+            elif (None != self._recorder):
+                self._stopRecording()
+            return [self.getMessage('update')]
+        return Port._processThisMessage(self, message)
         
     def getMessage(self, change):
         msg = Port.getMessage(self, change)
         msg['more']['storageType'] = 'value'
+        if ('remove' != change):
+            msg['more']['recording'] = self._recorder.status if (None != self._recorder) else False
         return msg
         
     @property 
     def _streaming(self):
         return self._isStreaming
     
+    @property
+    def _busy(self):
+        return self._streaming or (None != self._recorder)
+    
+    # Connects (a blocking call) here so that the periodic task, run in the
+    # Scheduler's own greenlet, only drains the helper.
     def _start(self):
+        self._connect()
+        self._isStreaming = True
         self.doPeriodicTask()
         
     def _stop(self):
-        self._obj.ref.disconnectPort(self._connectionID)
         self.stopPeriodicTask()
         self._isStreaming = False
+        self._disconnect()
+    
+    # The helper is connected to the port while it is streaming or recording.
+    def _connect(self):
+        if not self._isConnected:
+            self._call(self._obj.ref.connectPort, self._helper._this(), self._connectionID)
+            self._isConnected = True
+    
+    def _disconnect(self):
+        if self._isConnected and not self._isStreaming and (None == self._recorder):
+            self._isConnected = False
+            self._call(self._obj.ref.disconnectPort, self._connectionID)
+    
+    def _startRecording(self, options):
+        if (None != self._recorder):
+            return
+        try:
+            recorder = Capture_Writer(self.getID, self._helper.DTYPE,
+                                      segmentSamples=int(options.get('segmentSize', CAPTURE_SEGMENT_SAMPLES)),
+                                      segmentSec=float(options.get('segmentSec', CAPTURE_SEGMENT_SEC)),
+                                      segments=int(options.get('segments', CAPTURE_SEGMENTS)))
+        except (TypeError, ValueError, IOError, OSError) as e:
+            log.error("Failed to start recording %s: %s", self.getID, e)
+            return
+        self._recorder = recorder
+        self._helper.setRecorder(recorder)
+        self._connect()
+    
+    def _stopRecording(self):
+        recorder, self._recorder = self._recorder, None
+        self._helper.setRecorder(None)
+        recorder.close()
+        self._disconnect()
     
     def _doPeriodicTask(self):
-        if (0 == self._streaming):
-            # Connect
-            self._obj.ref.connectPort(self._helper._this(), self._connectionID)
-            self._isStreaming = True
-        else:
-            # stream.
-            messages = self._helper.getMessages()
-            if (0 < len(messages)):
-                self.sendMessages(messages)
+        messages = self._helper.getMessages()
+        if (0 < len(messages)):
+            self.sendMessages(messages)
 
 """ 
 FRONTEND Port type handler 
@@ -246,13 +326,17 @@ class Port_FRONTEND(Port):
             return Port_FRONTEND(obj, parent, outbox)
     
     def _finish_init_(self):
-        self._greenletPeriodSec = 0.25
+        self._periodSec = 0.25
         
     @property
     def _streaming(self):
-        return (None != self._greenlet)
+        return (None != self._periodicTask)
     
+    # Connects (a blocking call) here so that the periodic task, run in the
+    # Scheduler's own greenlet, only drains the helper.
     def _start(self):
+        self._connect()
+        self._isStreaming = True
         self.doPeriodicTask()
     
     def _stop(self):
@@ -260,12 +344,12 @@ class Port_FRONTEND(Port):
     
     def _doPeriodicTask(self):
         # TODO: 1) Gather a dictionary of changes from the interface?
-        #       2) self._outbox.put([msg]) the changes
+        #       2) self.sendMessages([msg]) the changes
         #       3) Respawn another callback.
         try:
             msg = self.getMessage('stream')
             msg['more']['data'] = self._getDataMessages()
-            self._outbox.put([msg])
+            self.sendMessages([msg])
         except:
             # Exception likely because attached device is gone so stop
             # streaming.
@@ -280,7 +364,7 @@ class Port_FRONTEND(Port):
 
 class Port_FRONTEND_GPS(Port_FRONTEND):
     def _getDataMessages(self):
-        pos = self._obj.ref._get_gps_time_pos().position
+        pos = self._call(self._obj.ref._get_gps_time_pos).position
         messages = {'latitude': pos.lat, 
                     'longitude': pos.lon, 
                     'datavalid': pos.valid}
@@ -289,71 +373,230 @@ class Port_FRONTEND_GPS(Port_FRONTEND):
 
 """
 Helper classes for forwarding pushPacket requests off BULKIO ports.
-The pushPacket appends the parent's message `more` field with new keys:
-   `eos`       ==> true/false for End of Stream flag
+The pushPacket only copies the samples into the helper's Ring_Buffer (typed
+per the BULKIO interface) and notes the latest stream_id, SRI, and EOS.
+Each getMessages, on the gevent side, reads everything received since the
+last call and returns (at most) one message whose `more` has new keys:
+   `eos`       ==> true/false for End of Stream flag (since the last message)
    `stream_id` ==> The string ID of the stream per the model
    `sri`       ==> Contains `xdelta` and `mode` from the last SRI
+   `overruns`  ==> Running count of times the ring was overrun
+   `dropped`   ==> Running count of samples lost to overruns (or oversize packets)
+The helper also counts the `packets` and `bytes` pushed to it (for metrics).
+If the stream is traced, each message's `more` carries `trace` with the 
+`t_stamp` and `arrival` of the first packet since the last message and when
+it was drained (see stream.py).
    
-TODO: Add data type field for value arrays.
-TODO: Add ability to control reshaped width of each vector in the returned list (default 1024 now).
-TODO: Add server-side DFT option to switch from raw data to Fourier output on the helper.
+The `data` is N rows of (up to) 1024 samples.  If the stream `format` is 
+'binary' the `data` is the encoded sample buffer and `more` also carries 
+`format`, `encoding`, `dtype` and `shape` (stream.py).
+If the stream `mode` is 'envelope' the `data` is the min/max envelope of 
+the samples over `width` buckets and `more` carries `mode` and `width`.
+If the stream `mode` is 'spectrum' the `data` is the averaged spectrum
+and `more` carries `mode`, `fftSize`, `window`, `averaging`, `units` and 
+`frequency`.
 """
 class StreamHelper(object):
+    # NumPy type (name) of the samples for this BULKIO interface.
+    DTYPE = 'float64'
+    
     def __init__(self, parent):
-        self._queue = Queue(maxsize=50)
         self._parent = parent
+        self._ring = None
         self._sri = None
+        self._streamID = ''
+        self._eosCount = 0
+        self._eosSent = 0
+        self._format = 'json'
+        self._mode = 'raw'
+        self._width = 320
+        self._spectrum = None
+        self._recorder = None
+        self.packets = 0
+        self.bytes = 0
+        self._trace = False
+        self._traceStamp = None
+        self._traceArrival = None
+        self._lostLogged = 0
+    
+    # Greenlet-environment thread.  Applies the options of a 'start' message
+    # (the ring is (re)allocated here rather than per packet).
+    def configure(self, options):
+        fmt = options.get('format', 'json')
+        self._format = fmt if (fmt in STREAM_FORMATS) else 'json'
+        mode = options.get('mode', 'raw')
+        self._mode = mode if (mode in STREAM_MODES) else 'raw'
+        self._trace = bool(options.get('trace', False))
+        self._traceArrival = None
+        try:
+            self._width = max(1, int(options.get('width', 320)))
+        except (TypeError, ValueError):
+            self._width = 320
+        
+        self._spectrum = None
+        if ('spectrum' == self._mode):
+            try:
+                self._spectrum = Spectrum_Averager(options.get('fftSize', 1024),
+                                                   options.get('window', 'hann'),
+                                                   options.get('overlap', 0.5),
+                                                   options.get('averaging', 'exponential'),
+                                                   options.get('alpha', 0.25),
+                                                   options.get('frames', 8))
+            except (TypeError, ValueError):
+                self._spectrum = Spectrum_Averager()
         
-    def pushSRI(self, H):
-        pass
+        requested = options.get('bufferSize', RING_CAPACITY)
+        try:
+            capacity = int(requested)
+        except (TypeError, ValueError):
+            capacity = 0
+        if (0 >= capacity):
+            log.warning("Port %s ignored bufferSize %r", self._parent.getID, requested)
+            capacity = RING_CAPACITY
+        elif (RING_MAX_CAPACITY < capacity):
+            log.warning("Port %s bufferSize %d limited to %d", 
+                        self._parent.getID, capacity, RING_MAX_CAPACITY)
+            capacity = RING_MAX_CAPACITY
+        if (None == self._ring) or (capacity != self._ring.capacity):
+            self._ring = Ring_Buffer(capacity, self.DTYPE)
+            self._lostLogged = 0
+        else:
+            self._ring.read() # Discard anything stale.
     
     # Greenlet-environment thread
     def getMessages(self):
-        messages = [];
-        while not self._queue.empty():
-            messages += self._queue.get()
-        return messages
-    
-    # REDHAWK-environment thread.  Reshape data to N rows of 1024 samples.
-    def pushPacket(self, data, t_stamp, EOS, stream_id):
-        msg = self._parent.getMessage('stream')
-        data = np.reshape(data, (-1, 1024)).tolist()
-        msg['more']['data'] = data;
-        msg['more'].update({'eos': EOS, 
-                            'stream_id': stream_id})
+        ring = self._ring
+        if (None == ring):
+            return []
+        samples = ring.read()
+        eos = (self._eosCount != self._eosSent)
+        self._eosSent = self._eosCount
+        arrival, stamp = self._traceArrival, self._traceStamp
+        self._traceArrival = None
+        if (ring.lostSamples != self._lostLogged):
+            # Rate limited (see log.py); the totals are in the metrics.
+            log.warning("Port %s lost %d samples to ring overruns", 
+                        self._parent.getID, ring.lostSamples - self._lostLogged,
+                        extra={'source': self._parent.getID})
+            self._lostLogged = ring.lostSamples
+        
+        msg = None
+        if ('spectrum' == self._mode):
+            msg = self._getSpectrumMessage(samples)
+        elif (0 < samples.size):
+            msg = self._parent.getMessage('stream')
+            if ('envelope' == self._mode):
+                self._envelope(msg, samples)
+            elif ('binary' == self._format):
+                msg['more'].update(encodeSamples(samples))
+            else:
+                msg['more']['data'] = frameRows(samples)
         
+        if (None == msg) and eos:
+            msg = self._parent.getMessage('stream')
+        if (None == msg):
+            return []
+        
+        msg['more'].update({'eos': eos, 
+                            'stream_id': self._streamID,
+                            'overruns': ring.overruns,
+                            'dropped': ring.lostSamples})
         if (self._sri):
             msg['more'].update({'sri': {'xdelta': self._sri.xdelta, 
                                        'mode': self._sri.mode}})
-        try:
-            self._queue.put([msg])
-        except:
-            # Likely full, roll new packet in.
-            self._queue.get() 
-            self._queue.put([msg])
-            print("StreamHelper dropping a packet"); sys.stdout.flush()
+        if self._trace and (None != arrival):
+            msg['more']['trace'] = {'t_stamp': stamp, 'arrival': arrival, 'drain': time.time()}
+        return [msg]
+    
+    # Greenlet-environment thread.  The Capture_Writer (or None) for pushPacket.
+    def setRecorder(self, recorder):
+        if (None != recorder) and (None != self._sri):
+            recorder.setSRI(self._sri)
+        self._recorder = recorder
+    
+    # REDHAWK-environment thread.  Copy the samples into the ring (and recorder).
+    def pushPacket(self, data, t_stamp, EOS, stream_id):
+        ring = self._ring
+        recorder = self._recorder
+        self.packets += 1
+        if self._trace and (None == self._traceArrival):
+            # The stamp is set first since getMessages checks the arrival.
+            self._traceStamp = timestampToSeconds(t_stamp)
+            self._traceArrival = time.time()
+        if (None != ring) or (None != recorder):
+            samples = toSamples(data, self.DTYPE)
+            self.bytes += samples.nbytes
+            if (None != ring):
+                ring.write(samples)
+            if (None != recorder):
+                recorder.write(samples, t_stamp, stream_id)
+                if EOS:
+                    recorder.markEOS()
+        self._streamID = stream_id
+        if EOS:
+            self._eosCount += 1
     
     def pushSRI(self, sri):
         self._sri = sri;
+        recorder = self._recorder
+        if (None != recorder):
+            recorder.setSRI(sri)
+    
+    # True if the samples are complex (interleaved real, imaginary) per the SRI.
+    @property
+    def _interleaved(self):
+        return (None != self._sri) and (1 == self._sri.mode)
+    
+    # Greenlet-environment thread.  Averages the samples; a message if the spectrum updated.
+    def _getSpectrumMessage(self, samples):
+        spectrum = self._spectrum
+        spectrum.update(samples, self._interleaved)
+        power = spectrum.spectrum()
+        if (power is None):
+            return None
+        xdelta = self._sri.xdelta if (None != self._sri) else 1.0
         
-# TODO: Create more StreamHelpers and add 'data type' to carry short, float, etc.
-class StreamHelper_Short(BULKIO__POA.dataShort, StreamHelper):
-    pass
-
-class StreamHelper_Ushort(BULKIO__POA.dataUshort, StreamHelper):
-    pass
-
-class StreamHelper_Octet(BULKIO__POA.dataOctet, StreamHelper):
-    pass
-
-class StreamHelper_Long(BULKIO__POA.dataLong, StreamHelper):
-    pass
-
-class StreamHelper_Ulong(BULKIO__POA.dataUlong, StreamHelper):
-    pass
+        msg = self._parent.getMessage('stream')
+        msg['more'].update({'mode': 'spectrum',
+                            'fftSize': spectrum.size,
+                            'window': spectrum.window,
+                            'averaging': spectrum.averaging,
+                            'units': 'dB',
+                            'frequency': spectrum.frequencies(xdelta)})
+        if ('binary' == self._format):
+            msg['more'].update(encodeSamples(power.astype(np.float32), [1, power.size]))
+        else:
+            msg['more']['data'] = [power.tolist()]
+        return msg
+    
+    # Replaces the samples with their min/max envelope over _width buckets.
+    def _envelope(self, msg, samples):
+        mins, maxs = minMaxEnvelope(samples, self._width, self._interleaved)
+        msg['more'].update({'mode': 'envelope', 'width': self._width})
+        if ('binary' == self._format):
+            envelope = np.vstack((mins.reshape(1, -1), maxs.reshape(1, -1)))
+            msg['more'].update(encodeSamples(envelope, envelope.shape))
+        else:
+            msg['more']['data'] = [mins.tolist(), maxs.tolist()]
+        
+# TODO: Create more StreamHelpers.
+# BULKIO interface (servant base) and sample type per port datatype.
+STREAM_HELPERS = {'bio_dataShort':  ('dataShort', 'int16'),
+                  'bio_dataUshort': ('dataUshort', 'uint16'),
+                  'bio_dataOctet':  ('dataOctet', 'uint8'),
+                  'bio_dataLong':   ('dataLong', 'int32'),
+                  'bio_dataUlong':  ('dataUlong', 'uint32'),
+                  'bio_dataFloat':  ('dataFloat', 'float32'),
+                  'bio_dataDouble': ('dataDouble', 'float64')}
 
-class StreamHelper_Float(BULKIO__POA.dataFloat, StreamHelper):
-    pass
+_streamHelperClasses = {}
 
-class StreamHelper_Double(BULKIO__POA.dataDouble, StreamHelper):
-    pass
+# @return The StreamHelper subclass (e.g., StreamHelper_Short) serving the
+#    BULKIO interface of datatype, created (importing BULKIO) on first use.
+def streamHelperClass(datatype):
+    if (datatype not in _streamHelperClasses):
+        interface, dtype = STREAM_HELPERS[datatype]
+        _streamHelperClasses[datatype] = type('StreamHelper_' + interface[len('data'):],
+                                              (getattr(BULKIO__POA, interface), StreamHelper),
+                                              {'DTYPE': dtype})
+    return _streamHelperClasses[datatype]
@@ -18,14 +18,38 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 @summary: Classes for managing the two ZeroRPC client-server relationships.
 """
-from core import RH_Message
+from core import RH_Message, Proxy_Index, SNAPSHOT_STALE_SEC
 from domain import Domain
+from session import Session, Session_Router, parseCredits
+from scheduler import Scheduler, Async_Signal
+from corba_pool import CORBA_Pool, POOL_SIZE, CALL_TIMEOUT_SEC
+from capture import setCaptureDirectory, CAPTURE_DIR
+from playback import Capture_Library
+from metrics import Metrics_Registry, prometheusApp
+from stream import traceLatencies
+from log import getLogger, configureLogging
 from utilities import *
 
 from ossie.utils import redhawk
 
-import sys, gevent, zerorpc, json, signal, string, os
-from gevent.queue import Queue
+import sys, gevent, zerorpc, json, signal, string, os, argparse, time, logging
+from gevent.queue import Empty
+from gevent.pywsgi import WSGIServer
+
+# Defaults for batching messages in clientWorker
+BATCH_MAX_COUNT = 500
+BATCH_MAX_BYTES = 4 * 1024 * 1024
+BATCH_LINGER_SEC = 0.01
+SEND_RETRIES = 3
+
+# Histogram buckets of the messages per delivery to a session
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Bounds of the domain scan interval, which doubles while nothing changes
+DOMAIN_SCAN_MIN_SEC = 1
+DOMAIN_SCAN_MAX_SEC = 30
+
+log = getLogger('gateway')
 
 
 """
@@ -33,60 +57,239 @@ Method for receiving messages from the RH Gateway and sending them back
 over to the ZeroRPC Server instance at the RH Session Node.js side.
 Each item placed in the outbox is (should be) an array of RH_Message.
 
-This outbox is at this time shared across all Proxy_Base entities for
-asynchronous communication.  ZeroRPC may deadlock if all attempt to 
-access the queue at once from, effectively, the same greenlet.  This
-is mitigated by collecting all queued messages into a single payload
-delivered as often as possible.
+Each Session has its own outbox which the Session_Router fills on behalf
+of all Proxy_Base entities for asynchronous communication.  ZeroRPC may 
+deadlock if all attempt to access the queue at once from, effectively, the 
+same greenlet.  This is mitigated by collecting all queued messages into a 
+single payload.
+
+The worker blocks until the outbox has messages, then keeps collecting for
+up to lingerSec or until the batch reaches maxCount messages or roughly
+maxBytes.  A failed delivery is retried (with backoff) up to retries times
+before the batch is reported and dropped.  If given a Metrics_Registry, the
+messages delivered and dropped, and the batch sizes, are counted with the
+session's label.  Traced stream messages get their `send` time, and their
+stage latencies are observed per port (see stampTraces).
 """
-def clientWorker(outbox=None, address=None):
+def clientWorker(outbox=None, address=None, maxCount=BATCH_MAX_COUNT, 
+                 maxBytes=BATCH_MAX_BYTES, lingerSec=BATCH_LINGER_SEC, 
+                 retries=SEND_RETRIES, metrics=None, session=''):
     client = zerorpc.Client()
     if (None != client) and (None != outbox):
         client.connect(address)
         while True:
-            try:
-                # Concat all items in queue into same array to
-                # be more efficient in delivering several messages.
-                messages = []
-                while not outbox.empty():
-                    messages += outbox.get()
-                if (0 < len(messages)):
-                    client.passMessages(messages)
-            except:
-                pass
-            finally:
-                gevent.sleep(0)
+            # Concat items in queue into same array to
+            # be more efficient in delivering several messages.
+            messages = outbox.get()
+            size = estimateSize(messages)
+            deadline = time.time() + lingerSec
+            while (len(messages) < maxCount) and (size < maxBytes):
+                try:
+                    more = outbox.get_nowait()
+                except Empty:
+                    remaining = deadline - time.time()
+                    if (0 >= remaining):
+                        break
+                    try:
+                        more = outbox.get(timeout=remaining)
+                    except Empty:
+                        break
+                messages += more
+                size += estimateSize(more)
+            
+            messages = stampTraces(messages, metrics)
+            delivered = _deliver(client, messages, retries, address)
+            if (None != metrics):
+                metrics.inc('messages_out', len(messages), session=session,
+                            result='delivered' if delivered else 'dropped')
+                metrics.observe('batch_messages', len(messages), BATCH_BUCKETS, session=session)
+
+# Sends the messages, retrying with backoff.  @return True if delivered.
+# Failures are logged (rate limited) per address.
+def _deliver(client, messages, retries, address=''):
+    for attempt in range(retries + 1):
+        try:
+            if (False != client.passMessages(messages)):
+                return True
+            log.warning("RH Gateway client rejected %d messages.", len(messages), 
+                        extra={'source': address})
+            return False
+        except Exception as e:
+            if (attempt < retries):
+                gevent.sleep(0.1 * (2 ** attempt))
+            else:
+                log.error("RH Gateway failed to deliver %d messages: %s", len(messages), e,
+                          extra={'source': address})
+    return False
+
+# Sets the `send` time of each traced stream message and, with a 
+# Metrics_Registry, observes its stage latencies in stream_latency_seconds.  
+# A traced message may be shared by sessions so it is copied first.
+# @return The messages, the traced ones replaced by their copies.
+def stampTraces(messages, metrics=None):
+    now = None
+    for i, msg in enumerate(messages):
+        trace = msg['more'].get('trace', None)
+        if (None == trace):
+            continue
+        now = now or time.time()
+        msg = dict(msg)
+        msg['more'] = dict(msg['more'])
+        msg['more']['trace'] = trace = dict(trace, send=now)
+        messages[i] = msg
+        if (None != metrics):
+            for stage, seconds in traceLatencies(trace):
+                metrics.observe('stream_latency_seconds', seconds, port=msg['rhid'],
+                                domain=msg['more'].get('domainID', ''), stage=stage)
+    return messages
+
+# Rough size, in bytes, of a message array once serialized (for batching).
+def estimateSize(messages):
+    size = 0
+    for msg in messages:
+        size += 128
+        data = msg['more'].get('data', None)
+        if isinstance(data, basestring):
+            size += len(data)
+        elif isinstance(data, list):
+            for row in data:
+                size += 10 * len(row) if isinstance(row, list) else 10
+    return size
 
 
 """
 Class for acting as the ZeroRPC Server on the Python side.
+
+A single RH_Gateway maintains one proxy tree per domain and multiplexes any
+number of client sessions over it (see openSession).  The outbox is the
+Session_Router shared by every proxy, which fans out messages to only the
+sessions that need them.
 """
 class RH_Gateway(object):
-    def __init__(self, outbox=None):
+    def __init__(self, outbox=None, batchCount=BATCH_MAX_COUNT, batchBytes=BATCH_MAX_BYTES,
+                 batchLingerSec=BATCH_LINGER_SEC, lazy=False, staleSec=SNAPSHOT_STALE_SEC,
+                 corbaThreads=POOL_SIZE, corbaTimeoutSec=CALL_TIMEOUT_SEC, playbackDir=None):
+        if (None == outbox):
+            outbox = Session_Router()
         self.outbox = outbox
         
-        # List of domain being maintained for incoming messages
-        self._domains = []
+        # Batching options for each session's clientWorker
+        self._batching = {'maxCount': batchCount,
+                          'maxBytes': batchBytes,
+                          'lingerSec': batchLingerSec}
+        
+        # Domain proxies being maintained for incoming messages, by domain 
+        # name, and the index of every proxy in them (for routing those messages).
+        # Domains still being attached have their greenlet in _attaching.
+        self._domains = {}
+        self._attaching = {}
+        self._index = Proxy_Index()
         
-        # Kick-off async scanning for domain changes
+        # If lazy, each proxy only creates its children when 'expand'ed.
+        self._lazy = lazy
+        
+        # Max age of each proxy's cached message for 'update' and new sessions.
+        self._staleSec = staleSec
+        
+        # Native threads for blocking CORBA calls (keeps the hub responsive)
+        self._pool = CORBA_Pool(corbaThreads, corbaTimeoutSec)
+        
+        # Single timer wheel for every periodic and one-shot task of the 
+        # gateway and its proxies.
+        self._scheduler = Scheduler()
+        
+        # Counters and histograms of the gateway's activity (see getMetrics).
+        self.metrics = Metrics_Registry()
+        self._describeMetrics()
+        self.metrics.addCollector(self._collectMetrics)
+        
+        # If given a directory, its captures are served as virtual ports in
+        # a tree of their own (see playback.py).
+        self._library = None
+        if (None != playbackDir):
+            self._library = Capture_Library(playbackDir, '', self.outbox, self._index,
+                                            self._scheduler, self._lazy, self._staleSec, self._pool)
+        
+        # Kick-off async scanning for domain changes.  The signal may be sent
+        # from any thread (e.g., an ODM event) to request a scan right away.
         self.domainTask = None
-        self._domainListMessages = []
-        self._domainTaskWaitSec = 1
-        self.domainTask = gevent.spawn_later(self._domainTaskWaitSec, self._domainListCheck)
+        self._domainTaskWaitSec = DOMAIN_SCAN_MIN_SEC
+        self._scanning = False
+        self._rescan = False
+        self._scanSignal = Async_Signal(self.rescanDomains)
+        self.domainTask = self._scheduler.scheduleOnce(self._domainListCheck, 
+                                                       self._domainTaskWaitSec, 'domains')
         
-        print("RH Gateway started successfully."); sys.stdout.flush()
+        log.info("RH Gateway started successfully.")
     
     def __del__(self):
         try:
-            print("RH Gateway closing down..."); sys.stdout.flush()
-            self.domainTask.kill()     
-            for d in self._domains:
+            log.info("RH Gateway closing down...")
+            self.domainTask.cancel()     
+            self._scanSignal.stop()
+            for g in list(self._attaching.values()):
+                g.kill(block=False)
+            self._attaching = {}
+            for d in self._domains.values():
                 d.cleanUp()
-            self._domains = []
+            self._domains = {}
+            if (None != self._library):
+                self._library.cleanUp()
+                self._library = None
+            self._scheduler.close()
+            self._pool.close()
         except:
-            print("RH Gateway caught exception"); sys.stdout.flush()
+            log.exception("RH Gateway caught exception")
             raise
     
+    # Attaches a new client session to the gateway.  Messages for the session
+    # are delivered to the ZeroRPC server at address (the "_node2rh" socket).
+    # The session immediately receives an 'add' for the current tree.
+    #
+    # @param sessionID The ID used by the client in calls to passMessages
+    # @param address The ZeroRPC address of the session's message server
+    def openSession(self, sessionID, address):
+        if (None != self.outbox.getSession(sessionID)):
+            self.closeSession(sessionID)
+        
+        session = self.outbox.addSession(Session(sessionID, address))
+        session.worker = gevent.spawn(clientWorker, session.outbox, address, metrics=self.metrics,
+                                      session=sessionID, **self._batching)
+        for d in self._roots:
+            session.outbox.put(d.qualify(d.getUpdateFromHere('add')))
+        log.info("RH Gateway opened session: %s", sessionID)
+        return True
+    
+    # Detaches a client session.  Streams only that session subscribed to 
+    # are stopped, and what only it had expanded is collapsed.
+    #
+    # @param sessionID The ID the session was opened with.
+    def closeSession(self, sessionID):
+        for key in self.outbox.collapseAll(sessionID):
+            p = self._index.get(key)
+            if (None != p):
+                p.collapse()
+        for key in self.outbox.removeSession(sessionID):
+            p = self._index.get(key)
+            if (None != p):
+                p.processMessage(RH_Message('stop', rhid=key[1]))
+        log.info("RH Gateway closed session: %s", sessionID)
+        return True
+    
+    # Notes that a client session's browser reconnected (see rh_session.js).
+    # The session kept its subscriptions while the browser was away, but the
+    # stream frames sent meanwhile were dropped so each flow controlled 
+    # subscription is given its full credit window again.
+    #
+    # @param sessionID The ID the session was opened with.
+    # @return False if the session is not open (e.g., the gateway restarted).
+    def resumeSession(self, sessionID):
+        if not self.outbox.refill(sessionID):
+            log.warning("RH Gateway cannot resume unknown session: %s", sessionID)
+            return False
+        log.info("RH Gateway resumed session: %s", sessionID)
+        return True
+    
     # Message handler to accept commands, from the client browser via the 
     # ZeroRPC intermediary session configured in the Node.js Server.
     # ZeroRPC already translated the JSON string back into our RH_Message
@@ -98,95 +301,343 @@ class RH_Gateway(object):
     #    will always initially encourage the real system hierarchy on its
     #    first 'add' of each rhtype.
     # 
+    # Note: 'start' and 'stop' subscribe and unsubscribe the session from 
+    #    the rhid's stream.  Only the first 'start' and last 'stop' across all
+    #    sessions are forwarded to the proxy; a later 'start' is acknowledged
+    #    with the proxy's current 'stream' message.  If the 'start' has 
+    #    more['credits'], the session is sent at most that many stream 
+    #    messages until it returns them with 'credit' messages (also with 
+    #    more['credits']; those not a positive number are ignored).  See 
+    #    Session_Router.
+    #
+    # Note: 'expand' creates the rhid's children (and sends their 'add') if
+    #    the gateway is lazy; 'collapse' removes them again unless one of 
+    #    them is streaming.  Either is acknowledged with an 'update' whose
+    #    more['expanded'] is the resulting state.  A 'start' expands too.
+    #    Expansions are counted per session: until the last session
+    #    collapses the rhid, a 'collapse' only sends that session the
+    #    'remove' of the children (and later 'expand's only their 'add').
+    #    A session cannot collapse what it is still streaming from.
+    #
+    # Note: Messages are routed by rhid through the Proxy_Index.  If the 
+    #    client echoes back more['domainID'] (every message from the gateway
+    #    carries it) only that domain is considered; otherwise the message is
+    #    given to the matching proxy in every domain.
+    # 
     # @param messages RH_Message list to process from the ZeroRPC client
+    # @param sessionID The session sending the messages ('' for the default)
     #
     # @return retMessages The messages if any, None otherwise.
     #
     # TODO: Add error checking to make sure messages is a RH_Message list.
-    def passMessages(self, messages):        
-        print ("RH Gateway received messages: ")
-        print (messages); sys.stdout.flush();
+    def passMessages(self, messages, sessionID=''):        
+        log.debug("RH Gateway received messages: %s", messages)
         
+        self.metrics.inc('messages_in', len(messages), session=sessionID)
         retMessages = []
         for msg in messages:
             if (None == msg):
-                print("WARNING: Client included an empty entry in its messages; skipping it."); sys.stdout.flush()
+                log.warning("Client included an empty entry in its messages; skipping it.")
                 continue
             
-            # Attempt to forward the message to each domain.
-            # FIXME: This does not account for identical IDs in different domains.
-            for d in self._domains:
-                d.updateDescendentIDs() # Costly... find a better way.
-                retMessages += d.processMessage(msg)
+            domainID = msg.get('more', {}).get('domainID', None)
+            for p in self._index.lookup(msg['rhid'], domainID):
+                if ('expand' == msg['change']):
+                    wasExpanded = p.isExpanded
+                    first = self.outbox.expand(sessionID, p.getKey)
+                    acks = p.expand()
+                    if not first and wasExpanded:
+                        # The children exist; only this session needs their 'add'.
+                        acks += p.getDescendentUpdate('add')
+                    retMessages += p.qualify(acks)
+                    continue
+                elif ('collapse' == msg['change']):
+                    if self._isSubscribedUnder(sessionID, p):
+                        # This session still streams from below; it keeps the children.
+                        ack = p.getSnapshot('update')
+                        ack['more']['expanded'] = True
+                        retMessages += p.qualify([ack])
+                    elif self.outbox.collapse(sessionID, p.getKey) or not p.isExpanded:
+                        retMessages += p.qualify(p.collapse())
+                    else:
+                        # Others keep the children; remove them for this session only.
+                        ack = p.getSnapshot('update')
+                        ack['more']['expanded'] = False
+                        retMessages += p.qualify(p.getDescendentUpdate('remove') + [ack])
+                    continue
+                elif ('start' == msg['change']):
+                    p.expand()
+                    credits = msg['more'].get('credits', None)
+                    if (None != credits):
+                        credits = parseCredits(credits)
+                        if (None == credits):
+                            log.warning("Session %s started %s without flow control; bad credits: %r",
+                                        sessionID, msg['rhid'], msg['more']['credits'],
+                                        extra={'source': sessionID})
+                        else:
+                            credits = max(1, credits)
+                    if not self.outbox.subscribe(sessionID, p.getKey, credits):
+                        # Already running for others; acknowledge this one only.
+                        retMessages += p.qualify([p.getMessage('stream')])
+                        continue
+                elif ('credit' == msg['change']):
+                    credits = parseCredits(msg['more'].get('credits', 1))
+                    if (None != credits) and (0 < credits):
+                        self.outbox.replenish(sessionID, p.getKey, credits)
+                    continue
+                elif ('stop' == msg['change']):
+                    if not self.outbox.unsubscribe(sessionID, p.getKey):
+                        # Others are still subscribed; acknowledge this one only.
+                        retMessages += p.qualify([p.getMessage('update')])
+                        continue
                 
+                retMessages += p.processMessage(msg)
+                
+        self.metrics.inc('messages_out', len(retMessages), session=sessionID, result='reply')
         if (0 == len(retMessages)):
             return None;
         else:
             return retMessages;
     
+    # Scans for added and removed domains now rather than at the next
+    # (backed off) interval, e.g., when the naming service changed.
+    def rescanDomains(self):
+        if self._scanning:
+            self._rescan = True
+        else:
+            self.domainTask.cancel()
+            self.domainTask = self._scheduler.scheduleOnce(self._domainListCheck, 0, 'domains')
+        return True
+    
+    # @return List of the run, lateness, and overrun statistics of every 
+    #    task on the gateway's Scheduler (named by proxy rhid).
+    def getTaskStatistics(self):
+        return self._scheduler.statistics()
+    
+    # @return Dictionary of every metric of the gateway (see Metrics_Registry.collect):
+    #    messages in and out, outbox depths and skipped frames per session, 
+    #    per-port packets, bytes, overruns and drops, traced stream latency,
+    #    CORBA call latency, task lag, and the numbers of proxies and greenlets.
+    def getMetrics(self):
+        return self.metrics.collect()
+    
     # ####################################################################
     # !!! NOTE: Methods prefixed with '_' are not visible through ZeroRPC 
     # ####################################################################
     
-    # Scans the domain for changes, creates instances, and queues the next scan..
-    def _domainListCheck(self):
-        newList = self._getMessagesForDomainListing('add')
-        adds, removes = splitDictLists(newList, self._domainListMessages, RH_Message().keys())
-        
-        # Removals
-        ids = [r['rhid'] for r in removes]
-        indices = []
-        if (0 < len(ids)):
-            for i, d in enumerate(self._domains):
-                if (d.getID in ids):
-                    d.cleanUp()
-                    indices.append(i)
-            self._domains = [d for i, d in enumerate(self._domains) if i not in indices]
+    def _describeMetrics(self):
+        m = self.metrics
+        m.describe('messages_in', 'counter', "Messages received from clients")
+        m.describe('messages_out', 'counter', "Messages sent to clients (delivered, dropped, or as replies)")
+        m.describe('batch_messages', 'histogram', "Messages per delivery to a session")
+        m.describe('outbox_depth', 'gauge', "Message arrays waiting in a session's outbox")
+        m.describe('session_skipped', 'gauge', "Stream frames of current subscriptions not sent for lack of credits")
+        m.describe('port_packets', 'counter', "BULKIO packets pushed to a port's stream helper")
+        m.describe('port_bytes', 'counter', "Sample bytes pushed to a port's stream helper")
+        m.describe('port_overruns', 'counter', "Times a port's ring buffer was overrun")
+        m.describe('port_drops', 'counter', "Packets truncated for being larger than a port's ring")
+        m.describe('port_lost_samples', 'counter', "Samples a port's ring lost to overruns and drops")
+        m.describe('stream_latency_seconds', 'histogram', 
+                   "Seconds traced stream messages took from the previous stage to stage (or in total), by port")
+        m.describe('corba_call_seconds', 'histogram', "Seconds per blocking CORBA call, by function")
+        m.describe('corba_calls', 'counter', "Blocking CORBA calls made on the pool")
+        m.describe('corba_timeouts', 'counter', "Blocking CORBA calls that timed out")
+        m.describe('task_lag_seconds', 'histogram', "Seconds scheduled tasks started past their deadline")
+        m.describe('task_overruns', 'gauge', "Deadlines skipped by the current scheduled tasks")
+        m.describe('tasks', 'gauge', "Scheduled tasks")
+        m.describe('proxies', 'gauge', "Proxies in the tree")
+        m.describe('greenlets', 'gauge', "Live greenlets of session workers, the scheduler, and domain attaches")
+    
+    # @return True if the session is subscribed to any descendent of p.
+    def _isSubscribedUnder(self, sessionID, p):
+        session = self.outbox.getSession(sessionID)
+        if (None == session):
+            return False
+        for key in session.subscriptions:
+            s = self._index.get(key)
+            if (None != s) and s.isDescendentOf(p):
+                return True
+        return False
+    
+    # Collector (see Metrics_Registry.addCollector) of the values read on demand.
+    def _collectMetrics(self, m):
+        for name in ('outbox_depth', 'session_skipped', 'port_packets', 'port_bytes', 
+                     'port_overruns', 'port_drops', 'port_lost_samples'):
+            m.clear(name)
+        for s in list(self.outbox.sessions):
+            m.set('outbox_depth', s.outbox.qsize(), session=s.sessionID)
+            m.set('session_skipped', sum(s.skipped.values()), session=s.sessionID)
         
-        # Additions
-        for a in adds:
-            self._domains.append(Domain(redhawk.attach(a['rhname']), # Return redhawk domain instance
-                                        '',                          # No parent ID
-                                        self.outbox))                # Using the global outbox
+        for p in list(self._index._byKey.values()):
+            helper = getattr(p, '_helper', None)
+            if (None == helper):
+                continue
+            labels = {'port': p.getID, 'domain': p.getDomainID}
+            m.set('port_packets', helper.packets, 'counter', **labels)
+            m.set('port_bytes', helper.bytes, 'counter', **labels)
+            ring = helper._ring
+            if (None != ring):
+                m.set('port_overruns', ring.overruns, 'counter', **labels)
+                m.set('port_drops', ring.drops, 'counter', **labels)
+                m.set('port_lost_samples', ring.lostSamples, 'counter', **labels)
         
-        self._domainListMessages = newList;
-        self.domainTask = gevent.spawn_later(self._domainTaskWaitSec, self._domainListCheck)
+        for name, latency in list(self._pool.latency.items()):
+            m.setHistogram('corba_call_seconds', latency, call=name)
+        m.set('corba_calls', self._pool.calls, 'counter')
+        m.set('corba_timeouts', self._pool.timeouts, 'counter')
+        m.setHistogram('task_lag_seconds', self._scheduler.lag)
+        m.set('task_overruns', sum([t['overruns'] for t in self._scheduler.statistics()]))
+        m.set('tasks', len(self._scheduler))
+        m.set('proxies', len(self._index))
+        # Only the gateway's own greenlets: walking gc.get_objects() would stall the hub.
+        workers = [s.worker for s in list(self.outbox.sessions) if (None != s.worker)]
+        m.set('greenlets', len([g for g in workers if not g.dead]) + 
+              self._scheduler.greenlets + len(self._attaching))
     
+    # The root of every proxy tree: each domain and the capture library.
+    @property
+    def _roots(self):
+        roots = list(self._domains.values())
+        if (None != self._library):
+            roots.append(self._library)
+        return roots
     
-    # Gets a list of active REDHAWK Domains and returns each as a message.
-    def _getMessagesForDomainListing(self, change='add'):
-        msgs = []
+    # Scans the naming service for added and removed domains and queues the
+    # next scan.  Domain handles are attached once and kept by the proxies, so
+    # a scan with no changes costs one scan() and a liveness check per domain.
+    # The interval doubles (up to DOMAIN_SCAN_MAX_SEC) while nothing changes.
+    def _domainListCheck(self):
+        self._scanning = True
+        changed = False
+        try:
+            names = self._scanDomainNames()
+            if (None != names):
+                # Removals (no longer listed, or the listed domain was restarted)
+                for name in list(self._domains.keys()):
+                    if (name not in names) or not self._domainAlive(self._domains[name]):
+                        self._domains.pop(name).cleanUp()
+                        changed = True
+                
+                # Additions
+                for name in names.difference(self._domains.keys()):
+                    if (name not in self._attaching):
+                        self._attaching[name] = gevent.spawn(self._attachDomain, name)
+                        changed = True
+        except Exception as e:
+            log.error("RH Gateway failed to update the domains: %s", e)
+        finally:
+            self._scanning = False
         
+        if changed or self._rescan:
+            self._domainTaskWaitSec = DOMAIN_SCAN_MIN_SEC
+        else:
+            self._domainTaskWaitSec = min(DOMAIN_SCAN_MAX_SEC, 2 * self._domainTaskWaitSec)
+        delay = 0 if self._rescan else self._domainTaskWaitSec
+        self._rescan = False
+        self.domainTask = self._scheduler.scheduleOnce(self._domainListCheck, delay, 'domains')
+    
+    # Attaches to the domain and builds its proxy tree.  It runs on its own
+    # greenlet so that a slow (or hung) domain, whose every call may take the
+    # CORBA timeout, holds up neither the scans nor the other domains.
+    def _attachDomain(self, name):
         try:
-            names = redhawk.scan()
-            for name in names:
-                d = redhawk.attach(name)
-                id = d._get_identifier()
-                msgs.append(RH_Message(change = change, 
-                                       rhtype = 'domain', 
-                                       rhid   = id, 
-                                       rhname = name))
+            domain = Domain(self._pool.call(redhawk.attach, name), # Return redhawk domain instance
+                            '',                    # No parent ID
+                            self.outbox,           # Using the global outbox
+                            self._index,           # the global index
+                            self._scheduler,       # the global scheduler
+                            self._lazy,            # the tree's laziness
+                            self._staleSec,        # cache staleness
+                            self._pool)            # and CORBA threads
+            domain.setActivitySignal(self._scanSignal)
+            self._domains[name] = domain
         except Exception as e:
-            print("Caught exception while scanning REDHAWK CORE...never good.")
-            print("---> Forcing a reset of the RH_Gateway."); sys.stdout.flush()
-            self.close()
-            
+            log.error("RH Gateway failed to attach domain %s: %s", name, e)
         finally:
-            return msgs
+            self._attaching.pop(name, None)
     
-
+    # @return Set of the names of the running REDHAWK Domains, None if the scan failed.
+    def _scanDomainNames(self):
+        try:
+            return set(self._pool.call(redhawk.scan))
+        except Exception as e:
+            log.error("Caught exception while scanning REDHAWK CORE...never good: %s", e)
+            return None
     
+    # @return False if the domain's (cached) handle no longer refers to a live object.
+    def _domainAlive(self, domain):
+        try:
+            return not self._pool.call(domain._obj.ref._non_existent)
+        except Exception:
+            return False
+
+
 # ZeroRPC server wrapping the RH_Gateway
 # gevent used to help manage the ZeroRPC greenlet thread.
+#
+# By default the gateway serves the single session at the given address.  
+# With --shared, no session is opened at start; each client session is
+# attached by calling openSession with its own "_node2rh" address instead.
+# With --standby, the gateway is pre-warmed (imports done, domains attached
+# and their trees built right away) and waits, at its own address, for the
+# single session it will serve to be handed over with openSession('', ...).
 if __name__ == '__main__':
-    if (len(sys.argv) > 1):
-        # Create a queue and a gevent greenlet for the second ZeroRPC instance
-        # Spawn and connect the two instances by the queue.
+    parser = argparse.ArgumentParser(description='REDHAWK Gateway for HAWKEYE')
+    parser.add_argument('address', nargs='?', 
+                        help="Base socket address, e.g., 'ipc://./mysocket.sock'")
+    parser.add_argument('--shared', action='store_true',
+                        help="Multiplex sessions opened with openSession")
+    parser.add_argument('--standby', action='store_true',
+                        help="Attach the domains now and wait for openSession to be handed a session")
+    parser.add_argument('--lazy', action='store_true',
+                        help="Only create a proxy's children when the client expands it")
+    parser.add_argument('--max-staleness', type=float, default=SNAPSHOT_STALE_SEC,
+                        help="Max seconds to serve a cached proxy message for updates (0 disables)")
+    parser.add_argument('--corba-threads', type=int, default=POOL_SIZE,
+                        help="Max concurrent blocking CORBA calls")
+    parser.add_argument('--corba-timeout', type=float, default=CALL_TIMEOUT_SEC,
+                        help="Seconds before a blocking CORBA call is abandoned")
+    parser.add_argument('--capture-dir', default=CAPTURE_DIR,
+                        help="Directory for port recordings ('record' messages)")
+    parser.add_argument('--playback', action='store_true',
+                        help="Serve the recordings in the capture directory as virtual ports")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Serve the metrics in the Prometheus text format at :PORT/metrics")
+    parser.add_argument('--log-level', default='INFO', 
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="Least severe log messages written to stdout")
+    parser.add_argument('--batch-count', type=int, default=BATCH_MAX_COUNT,
+                        help="Max messages per delivery to a session")
+    parser.add_argument('--batch-bytes', type=int, default=BATCH_MAX_BYTES,
+                        help="Approximate max bytes per delivery to a session")
+    parser.add_argument('--batch-linger', type=float, default=BATCH_LINGER_SEC,
+                        help="Max seconds to wait for more messages before delivering")
+    args = parser.parse_args()
+    
+    if (None != args.address):
+        configureLogging(args.log_level)
+        setCaptureDirectory(args.capture_dir)
+        
+        # Create the gateway (and its session router) and, unless shared, 
+        # the default session connecting back to the RH Session.
         try: 
-            q = Queue();
-            ge_client = gevent.spawn(clientWorker, q, sys.argv[1] + "_node2rh")
-            zpc = zerorpc.Server(RH_Gateway(q))     
-            zpc.bind(sys.argv[1] + "_rh2node")
+            gateway = RH_Gateway(batchCount=args.batch_count, 
+                                 batchBytes=args.batch_bytes,
+                                 batchLingerSec=args.batch_linger,
+                                 lazy=args.lazy,
+                                 staleSec=args.max_staleness,
+                                 corbaThreads=args.corba_threads,
+                                 corbaTimeoutSec=args.corba_timeout,
+                                 playbackDir=args.capture_dir if args.playback else None)
+            if args.standby:
+                gateway.rescanDomains()
+                log.info("RH Gateway on standby at %s", args.address)
+            elif not args.shared:
+                gateway.openSession('', args.address + "_node2rh")
+            if (None != args.metrics_port):
+                WSGIServer(('', args.metrics_port), prometheusApp(gateway.metrics), log=None).start()
+            zpc = zerorpc.Server(gateway)     
+            zpc.bind(args.address + "_rh2node")
             
             gevent.signal(signal.SIGTERM, zpc.stop)
             gevent.signal(signal.SIGINT, zpc.stop)
@@ -194,17 +645,17 @@ if __name__ == '__main__':
             zpc.run()   # Blocks here until the ZPC stops.
             
             try:
-                print("RH Gateway shutting down ZRPC Client");
-                ge_client.kill();
-                gevent.joinall([ge_client])
-                os.remove(sys.argv[1].replace("ipc://","") + "_rh2node");
+                log.info("RH Gateway shutting down ZRPC Clients")
+                for s in list(gateway.outbox.sessions):
+                    gateway.closeSession(s.sessionID)
+                os.remove(args.address.replace("ipc://","") + "_rh2node");
             except Exception as e: 
-                print("RH Gateway error in closing down ZPC Client: "); 
-                print(e); sys.stdout.flush();
+                log.error("RH Gateway error in closing down ZPC Client: %s", e)
             
         finally:
             # Attempt to clear IPC artifact from system.
-            print("RH Gateway Exiting"); sys.stdout.flush()
+            log.info("RH Gateway Exiting")
+            logging.shutdown()
             sys.exit();
         
     else:
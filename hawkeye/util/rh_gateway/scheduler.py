@@ -0,0 +1,286 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Single timer wheel running every periodic and one-shot proxy task.
+"""
+
+import time, math
+import gevent
+from gevent.event import Event
+from gevent.queue import Queue
+from metrics import Histogram
+from log import getLogger
+
+# Resolution of the wheel, in seconds, and its number of slots (one
+# revolution is TICK_SEC * WHEEL_SLOTS seconds).
+TICK_SEC = 0.01
+WHEEL_SLOTS = 512
+
+# Greenlets running the blocking tasks (like the CORBA_Pool's POOL_SIZE).
+WORKERS = 8
+
+log = getLogger('scheduler')
+
+
+"""
+Handle for a task on the Scheduler.  Keep it to cancel() the task.
+
+    periodSec is the period of a fixed-rate task (None for a one-shot)
+    blocking is True if the task may block (e.g., on CORBA calls)
+    deadline is the time the task is next due (time.time() seconds)
+    runs is the number of times the task has run
+    overruns is the number of deadlines skipped because the previous run
+        was still in flight (or the wheel itself fell behind)
+    maxLateSec/totalLateSec are how late, versus deadline, runs started
+    maxRunSec is the longest the task took to run
+"""
+class Timer_Task(object):
+    def __init__(self, scheduler, fn, periodSec, deadline, name='', blocking=True):
+        self._scheduler = scheduler
+        self._fn = fn
+        self._tick = 0
+        self.name = name
+        self.periodSec = periodSec
+        self.blocking = blocking
+        self.deadline = deadline
+        self.active = True
+        self.runs = 0
+        self.overruns = 0
+        self.maxLateSec = 0.0
+        self.totalLateSec = 0.0
+        self.maxRunSec = 0.0
+        self._running = False
+
+    def cancel(self):
+        self._scheduler.cancel(self)
+
+    @property
+    def statistics(self):
+        return {'name': self.name,
+                'periodSec': self.periodSec,
+                'runs': self.runs,
+                'overruns': self.overruns,
+                'maxLateSec': self.maxLateSec,
+                'meanLateSec': self.totalLateSec / max(1, self.runs),
+                'maxRunSec': self.maxRunSec}
+
+
+"""
+Hashed timer wheel shared by every proxy of the gateway (see
+Proxy_Base.doPeriodicTask).  A single greenlet sleeps until the next
+occupied tick and starts every task due on it, in place of a greenlet per
+task sleeping (and being killed) between periods.  Tasks that do not block
+(e.g., draining a port's ring) run right in the wheel's greenlet.  Blocking
+tasks, which may wait on CORBA calls (see CORBA_Pool) for up to the call 
+timeout, are queued to a fixed set of `workers` greenlets so the wheel never
+waits on them and one slow device delays no other task.  A task whose 
+previous run is still queued or in flight when it is due skips that deadline.
+
+Periodic tasks are fixed-rate: each deadline is the previous one plus the
+period, never "now" plus the period, so they do not drift.  Their first
+deadline is aligned to a whole multiple of the period (since the wheel was
+created) so that every task sharing a period fires on the same tick.  A task
+that falls a period or more behind skips the missed deadlines rather than
+running back-to-back to catch up; each one skipped counts as an overrun.
+
+Cancelling only marks the task; it is dropped from its slot when the wheel
+next comes around to it.
+
+    lag is the Histogram of how late, versus deadline, every run started
+"""
+class Scheduler(object):
+    def __init__(self, tickSec=TICK_SEC, slots=WHEEL_SLOTS, workers=WORKERS):
+        self.tickSec = float(tickSec)
+        self.workers = max(1, int(workers))
+        self._wheel = [[] for i in range(max(1, int(slots)))]
+        self._epoch = time.time()
+        self._tick = 0
+        self._wakeTick = None
+        self._tasks = set()
+        self._wake = Event()
+        self._greenlet = None
+        self._queue = Queue()
+        self._workers = []
+        self.lag = Histogram()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    # Greenlets of the wheel and its workers (none until a task is added).
+    @property
+    def greenlets(self):
+        return len(self._workers) + (0 if (None == self._greenlet) else 1)
+
+    # Runs fn every periodSec seconds, starting at the next aligned deadline.
+    # If not blocking, fn runs in the wheel's greenlet and must not block.
+    # @return The Timer_Task
+    def schedulePeriodic(self, fn, periodSec, name='', blocking=True):
+        periodSec = max(self.tickSec, float(periodSec))
+        periods = math.floor((time.time() - self._epoch) / periodSec) + 1
+        return self._add(Timer_Task(self, fn, periodSec, self._epoch + periods * periodSec, 
+                                    name, blocking))
+
+    # Runs fn once, delaySec seconds from now (see schedulePeriodic).
+    # @return The Timer_Task
+    def scheduleOnce(self, fn, delaySec, name='', blocking=True):
+        return self._add(Timer_Task(self, fn, None, time.time() + max(0.0, float(delaySec)), 
+                                    name, blocking))
+
+    def cancel(self, task):
+        task.active = False
+        self._tasks.discard(task)
+
+    # Cancels every task and stops the wheel's and workers' greenlets (and any
+    # task running).
+    def close(self):
+        for task in list(self._tasks):
+            self.cancel(task)
+        self._wheel = [[] for i in range(len(self._wheel))]
+        if (None != self._greenlet):
+            self._greenlet.kill(block=False)
+            self._greenlet = None
+        gevent.killall(self._workers, block=False)
+        self._workers = []
+        self._queue = Queue()
+
+    # @return List of the statistics of every scheduled task.
+    def statistics(self):
+        return [t.statistics for t in self._tasks]
+
+    def _add(self, task):
+        self._tasks.add(task)
+        self._insert(task)
+        if (None == self._greenlet):
+            self._greenlet = gevent.spawn(self._run)
+        if task.blocking and (0 == len(self._workers)):
+            self._workers = [gevent.spawn(self._work) for i in range(self.workers)]
+        return task
+
+    def _insert(self, task):
+        tick = int(math.ceil((task.deadline - self._epoch) / self.tickSec))
+        task._tick = max(self._tick, tick)
+        self._wheel[task._tick % len(self._wheel)].append(task)
+        if (None == self._wakeTick) or (task._tick < self._wakeTick):
+            self._wake.set()
+
+    # @return The next tick with an active task due (at most one revolution out).
+    def _nextTick(self):
+        slots = len(self._wheel)
+        for tick in range(self._tick, self._tick + slots):
+            for task in self._wheel[tick % slots]:
+                if task.active and (task._tick <= tick):
+                    return tick
+        return self._tick + slots
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            if (0 == len(self._tasks)):
+                self._wakeTick = None
+                self._wake.wait()
+                continue
+
+            self._wakeTick = self._nextTick()
+            delay = self._epoch + self._wakeTick * self.tickSec - time.time()
+            if (0 < delay) and self._wake.wait(delay):
+                # An earlier task was added.
+                continue
+            self._advance(int((time.time() - self._epoch) / self.tickSec))
+
+    # Runs every task due up to and including nowTick.  Once around the wheel
+    # is enough to find them all, however far behind it is.
+    def _advance(self, nowTick):
+        slots = len(self._wheel)
+        first = max(self._tick, nowTick - slots + 1)
+        for tick in range(first, nowTick + 1):
+            self._tick = tick + 1
+            slot = self._wheel[tick % slots]
+            due = [t for t in slot if t._tick <= nowTick]
+            if (0 < len(due)):
+                self._wheel[tick % slots] = [t for t in slot if (t._tick > nowTick) and t.active]
+                for task in due:
+                    if task.active:
+                        self._fire(task)
+        self._tick = max(self._tick, nowTick + 1)
+
+    # Runs the task, or queues it to the workers if it blocks, (unless its last
+    # run is still queued or in flight) and queues its next deadline.
+    def _fire(self, task):
+        if task._running:
+            task.overruns += 1
+        else:
+            start = time.time()
+            late = max(0.0, start - task.deadline)
+            task.runs += 1
+            task.totalLateSec += late
+            task.maxLateSec = max(task.maxLateSec, late)
+            self.lag.observe(late)
+            task._running = True
+            if task.blocking:
+                self._queue.put((task, start))
+            else:
+                self._runTask(task, start)
+
+        if (None == task.periodSec) or not task.active:
+            # Dropped from the tasks once run (see _runTask), or cancelled by its run.
+            return
+
+        task.deadline += task.periodSec
+        now = time.time()
+        if (task.deadline <= now):
+            missed = int((now - task.deadline) / task.periodSec) + 1
+            task.overruns += missed
+            task.deadline += missed * task.periodSec
+        self._insert(task)
+
+    def _work(self):
+        while True:
+            task, start = self._queue.get()
+            self._runTask(task, start)
+
+    def _runTask(self, task, start):
+        try:
+            if task.active:
+                task._fn()
+        except Exception as e:
+            log.error("Scheduler task '%s' raised: %s", task.name, e)
+        finally:
+            task._running = False
+            task.maxRunSec = max(task.maxRunSec, time.time() - start)
+            if (None == task.periodSec):
+                self.cancel(task)
+
+
+"""
+Thread-safe request to run fn in the gevent hub's thread.  send() may be
+called from any thread (e.g., omniORB's, for an event channel callback) and
+fn runs soon after in the hub, where it must not block.  Sends made before 
+fn runs are coalesced into one call.  Create it in the hub's thread.
+"""
+class Async_Signal(object):
+    def __init__(self, fn):
+        loop = gevent.get_hub().loop
+        factory = getattr(loop, 'async_', None) or getattr(loop, 'async')
+        self._watcher = factory()
+        self._watcher.start(fn)
+
+    def send(self):
+        self._watcher.send()
+
+    def stop(self):
+        self._watcher.stop()
@@ -27,11 +27,14 @@ from ossie.utils import redhawk
 
 class Service(Proxy_Base):    
     def _finish_init_(self):
-        for p in self._obj.ports:
-            self._children.append(Port(p, self, self._outbox))
+        pass
+    
+    def _createChildren(self):
+        self._children += self._createEach(Port, self._call(getattr, self._obj, 'ports'))
     
+    @property
     def _getID(self):
-        return self._obj._get_identifier()
+        return self._call(self._obj._get_identifier)
     
     def getMessage(self, change='update'):
         return RH_Message(change, 
@@ -43,9 +46,9 @@ class Service(Proxy_Base):
     def _processThisMessage(self, message):
         # TODO: What other kinds of messages does this entity require?
         if ('update' == message['change']):
-            if (0 == len(self._children)):
-                # Should have children.  Reattempt _finish_init_()
-                self._finish_init_()
+            if (0 == len(self._children)) and self._expanded:
+                # Should have children.  Reattempt _createChildren()
+                self._createChildren()
             return self.getUpdateFromHere('update')
         # default response
         return []
@@ -0,0 +1,256 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Client sessions multiplexed over a single RH Gateway proxy tree.
+"""
+
+from gevent.queue import Queue
+import time
+
+
+# @return The number of credits in value (from a client message), or None if
+#    it is not a number.
+def parseCredits(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+"""
+A single client (browser) session attached to the gateway.  Each session
+has its own outbox which is drained by its own clientWorker greenlet towards
+the session's ZeroRPC server (the "_node2rh" address).
+
+    sessionID is the ID used by the Node.js side (the socket.io ID)
+    address is the ZeroRPC address of the session's message server
+    outbox is the Queue of RH_Message arrays for this session only
+    subscriptions is the set of proxy keys this session has 'start'ed
+    expansions is the set of proxy keys this session has 'expand'ed
+    worker is the greenlet running clientWorker for this session
+    credits is, per subscription, the stream frames the session may still 
+        be sent (None if the subscription is not flow controlled)
+    windows is, per subscription, the max credits the session may hold
+    skipped is, per subscription, the frames not sent for lack of credits
+"""
+class Session(object):
+    def __init__(self, sessionID='', address=''):
+        self.sessionID = sessionID
+        self.address = address
+        self.outbox = Queue()
+        self.subscriptions = set()
+        self.expansions = set()
+        self.worker = None
+        self.credits = {}
+        self.windows = {}
+        self.skipped = {}
+
+    def close(self):
+        if (None != self.worker):
+            self.worker.kill(block=False)
+            self.worker = None
+        self.subscriptions.clear()
+        self.expansions.clear()
+        self.credits.clear()
+        self.windows.clear()
+        self.skipped.clear()
+
+
+"""
+Stands in for the shared outbox Queue handed to every Proxy_Base.  Proxies
+continue to put() arrays of RH_Message into it, and the router fans those
+out to the sessions:
+
+    'stream' messages go only to the sessions subscribed to that proxy.
+    Every other change (add, remove, update...) goes to every session.
+    Traced 'stream' messages get their `enqueue` time (see stream.py).
+
+Subscriptions are reference counted by session so that the proxy is only
+started by the first subscriber and only stopped by the last one.  They are
+keyed by the proxy's (domain ID, rhid) key (see Proxy_Index).
+
+A subscription may be flow controlled with a credit window: each 'stream' 
+message sent to the session uses one credit, and the client returns credits
+(replenish) as it renders them.  Out of credits, frames are skipped (and 
+counted) for that session rather than queued, so neither the outbox nor the
+client's backlog can grow without bound.
+
+Expansions (of a lazy tree) are reference counted by session the same way,
+so a proxy's children are only freed when the last session collapses it.
+"""
+class Session_Router(object):
+    def __init__(self):
+        self._sessions = {}
+        self._subscribers = {}
+        self._expanders = {}
+
+    @property
+    def sessions(self):
+        return self._sessions.values()
+
+    def getSession(self, sessionID):
+        return self._sessions.get(sessionID, None)
+
+    def addSession(self, session):
+        self._sessions[session.sessionID] = session
+        return session
+
+    # Removes the session and returns the keys nobody is subscribed to anymore.
+    def removeSession(self, sessionID):
+        orphans = []
+        session = self._sessions.pop(sessionID, None)
+        if (None != session):
+            for key in list(session.subscriptions):
+                if self.unsubscribe(sessionID, key):
+                    orphans.append(key)
+            session.close()
+        return orphans
+
+    # Collapses everything the session expanded.
+    # @return The keys nobody has expanded anymore.
+    def collapseAll(self, sessionID):
+        session = self._sessions.get(sessionID, None)
+        if (None == session):
+            return []
+        return [key for key in list(session.expansions) if self.collapse(sessionID, key)]
+
+    # @return True if no (other) session had expanded the key.
+    def expand(self, sessionID, key):
+        expanders = self._expanders.setdefault(key, set())
+        first = (0 == len(expanders))
+        session = self._sessions.get(sessionID, None)
+        if (None != session):
+            expanders.add(sessionID)
+            session.expansions.add(key)
+        elif first:
+            del self._expanders[key]
+        return first
+
+    # @return True if no session has the key expanded anymore.
+    def collapse(self, sessionID, key):
+        session = self._sessions.get(sessionID, None)
+        if (None != session):
+            session.expansions.discard(key)
+        expanders = self._expanders.get(key, None)
+        if (None == expanders):
+            return True
+        expanders.discard(sessionID)
+        if (0 == len(expanders)):
+            del self._expanders[key]
+            return True
+        return False
+
+    # @param credits The credit window for the subscription, None for no flow control.
+    # @return True if this is the first subscriber to the key.
+    def subscribe(self, sessionID, key, credits=None):
+        session = self._sessions.get(sessionID, None)
+        if (None == session):
+            return False
+        subs = self._subscribers.setdefault(key, set())
+        first = (0 == len(subs))
+        subs.add(sessionID)
+        session.subscriptions.add(key)
+        session.credits[key] = credits
+        session.windows[key] = credits
+        session.skipped[key] = 0
+        return first
+    
+    # Returns credits to a flow controlled subscription (up to its window).
+    # Credits that are not positive are ignored.
+    def replenish(self, sessionID, key, credits):
+        session = self._sessions.get(sessionID, None)
+        if (None == session) or (None == session.credits.get(key, None)) or (0 >= credits):
+            return
+        session.credits[key] = min(session.windows[key], session.credits[key] + credits)
+
+    # Returns every flow controlled subscription of the session to its full
+    # window, e.g., once a resumed client has dropped the frames in flight.
+    # @return False if there is no such session.
+    def refill(self, sessionID):
+        session = self._sessions.get(sessionID, None)
+        if (None == session):
+            return False
+        for key, window in session.windows.items():
+            if (None != window):
+                session.credits[key] = window
+        return True
+
+    # @return True if that was the last subscriber to the key.
+    def unsubscribe(self, sessionID, key):
+        session = self._sessions.get(sessionID, None)
+        if (None != session):
+            session.subscriptions.discard(key)
+            session.credits.pop(key, None)
+            session.windows.pop(key, None)
+            session.skipped.pop(key, None)
+        subs = self._subscribers.get(key, None)
+        if (None == subs):
+            return True
+        subs.discard(sessionID)
+        if (0 == len(subs)):
+            del self._subscribers[key]
+            return True
+        return False
+
+    def subscribers(self, key):
+        return self._subscribers.get(key, set())
+
+    """
+    Queue-like entry point used by the proxies (see Proxy_Base.sendMessages).
+    Messages are grouped per session so each session outbox still receives
+    one array per put().
+    """
+    def put(self, msgarray):
+        batches = {}
+        for msg in msgarray:
+            if ('stream' == msg['change']):
+                trace = msg['more'].get('trace', None)
+                if (None != trace):
+                    trace['enqueue'] = time.time()
+                key = (msg['more'].get('domainID', ''), msg['rhid'])
+                targets = [s for s in self._subscribers.get(key, ()) if self._useCredit(s, key)]
+            else:
+                targets = self._sessions.keys()
+            for sessionID in targets:
+                batches.setdefault(sessionID, []).append(msg)
+
+        for sessionID, msgs in batches.items():
+            session = self._sessions.get(sessionID, None)
+            if (None != session):
+                session.outbox.put(msgs)
+
+    # @return True if the session may be sent a frame of key (using a credit).
+    def _useCredit(self, sessionID, key):
+        session = self._sessions[sessionID]
+        credits = session.credits.get(key, None)
+        if (None == credits):
+            return True
+        elif (0 < credits):
+            session.credits[key] = credits - 1
+            return True
+        session.skipped[key] += 1
+        return False
+
+    def empty(self):
+        for s in self._sessions.values():
+            if not s.outbox.empty():
+                return False
+        return True
+
+    def qsize(self):
+        return sum([s.outbox.qsize() for s in self._sessions.values()])
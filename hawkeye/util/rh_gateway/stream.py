@@ -0,0 +1,302 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Sample formatting for BULKIO stream messages.
+
+The `json` format (default) sends `data` as N rows of numbers.  The `binary`
+format sends the raw little-endian sample buffer instead along with a small
+header in `more`:
+   `format`   ==> 'binary'
+   `encoding` ==> 'base64' (socket.io 0.9 and the ZeroRPC/Node.js hop are
+                  text-only, so the buffer is base64 packed rather than raw)
+   `dtype`    ==> NumPy-style type string, e.g., '<f4', '<i2', '|u1'
+   `shape`    ==> [rows, columns] of the samples in `data`
+   `data`     ==> The encoded buffer
+
+Independent of the format, the stream `mode` selects what the samples are:
+   'raw'      ==> Every sample of the packet (default)
+   'envelope' ==> The min and max of each of `width` equal buckets of the 
+                  packet, i.e., one peak-preserving column per display pixel.
+                  `data` is 2 rows: the minimums then the maximums.  Complex
+                  (interleaved) samples keep their real/imaginary pairs.
+   'spectrum' ==> The averaged power spectrum, in dB, of windowed FFTs over
+                  the stream (see Spectrum_Averager).  `data` is 1 row and
+                  `frequency` gives the `start` and `delta` of its bins (Hz).
+
+If traced, a stream message's `more` also carries `trace`, the time (epoch
+seconds) the oldest samples in it reached each stage, see TRACE_STAGES:
+   `t_stamp`  ==> The BULKIO timestamp of the packet (if valid)
+   `arrival`  ==> pushPacket received the packet
+   `drain`    ==> The message was built from the port's ring
+   `enqueue`  ==> The message was put in the session outboxes
+   `send`     ==> The message was handed to ZeroRPC for the session
+"""
+
+import binascii
+from collections import deque
+from utilities import Lazy_Module
+
+# Imported by the first stream rather than with the gateway.
+np = Lazy_Module('numpy')
+
+STREAM_FORMATS = ('json', 'binary')
+STREAM_MODES = ('raw', 'envelope', 'spectrum')
+
+# Default row width of the sample frames.
+FRAME_WIDTH = 1024
+
+# Default and max capacity, in samples, of a port's Ring_Buffer.
+RING_CAPACITY = 1024 * 1024
+RING_MAX_CAPACITY = 16 * 1024 * 1024
+
+# Stages of a traced stream message, in order.
+TRACE_STAGES = ('t_stamp', 'arrival', 'drain', 'enqueue', 'send')
+
+
+# Returns the [rows, columns] to frame n samples by width (or 1 row if ragged).
+def frameShape(n, width=FRAME_WIDTH):
+    if (0 < n) and (0 == n % width):
+        return [n // width, width]
+    return [1, n]
+
+# Splits samples into rows of width (the last row may be shorter) for json.
+def frameRows(samples, width=FRAME_WIDTH):
+    return [samples[i:i + width].tolist() for i in range(0, samples.size, width)]
+
+# @return Epoch seconds of a BULKIO PrecisionUTCTime, None if it is not valid.
+def timestampToSeconds(t_stamp):
+    try:
+        if (1 != t_stamp.tcstatus):  # BULKIO.TCS_VALID
+            return None
+        return t_stamp.twsec + t_stamp.tfsec
+    except AttributeError:
+        return None
+
+# @return List of (stage, seconds) from each traced stage to the next, and
+#    the 'total' from the first to the last.
+def traceLatencies(trace):
+    stamps = [(s, trace[s]) for s in TRACE_STAGES if (None != trace.get(s, None))]
+    latencies = [(stamps[i + 1][0], stamps[i + 1][1] - stamps[i][1]) for i in range(len(stamps) - 1)]
+    if (1 < len(stamps)):
+        latencies.append(('total', stamps[-1][1] - stamps[0][1]))
+    return latencies
+
+# Converts BULKIO packet data (sequence, or string for octets) to an array.
+def toSamples(data, dtype):
+    if isinstance(data, (bytes, bytearray)):
+        return np.frombuffer(data, dtype=dtype)
+    return np.asarray(data, dtype=dtype)
+
+# @return Dictionary of `more` fields describing samples in the binary format.
+def encodeSamples(samples, shape=None):
+    samples = np.ascontiguousarray(samples)
+    samples = samples.astype(samples.dtype.newbyteorder('<'), copy=False)
+    if (None == shape):
+        shape = frameShape(samples.size)
+    return {'format': 'binary',
+            'encoding': 'base64',
+            'dtype': samples.dtype.str,
+            'shape': list(shape),
+            'data': binascii.b2a_base64(samples.tobytes()).rstrip(b'\n').decode('ascii')}
+
+"""
+Preallocated single-producer, single-consumer sample ring.  The producer 
+(the omniORB thread in pushPacket) copies each packet in once with write().
+The consumer (the gevent side) takes everything written since its last 
+read() as one contiguous array.  No locks are used: each side only assigns
+its own running total (_written or _read) after its copy is complete.
+
+    overruns     ==> Times the producer lapped the consumer
+    drops        ==> Packets truncated for being larger than the ring
+    lostSamples  ==> Exact samples never read (both of the above)
+
+read() copies the samples out of the ring, so the array is the consumer's
+to keep.  Samples the producer overwrote (or started to) during the copy 
+are dropped from it and counted as lost; the producer publishes how far 
+it is writing (_writing) before each copy for this.
+"""
+class Ring_Buffer(object):
+    def __init__(self, capacity=RING_CAPACITY, dtype='float64'):
+        self.capacity = max(1, int(capacity))
+        self.dtype = np.dtype(dtype)
+        self._data = np.empty(self.capacity, dtype=self.dtype)
+        self._written = 0
+        self._writing = 0
+        self._read = 0
+        self.overruns = 0
+        self.drops = 0
+        self.lostSamples = 0
+    
+    # Samples written but not yet read.
+    def __len__(self):
+        return min(self._written - self._read, self.capacity)
+    
+    # Producer side.
+    def write(self, samples):
+        n = samples.size
+        if (self.capacity < n):
+            self.drops += 1
+            self.lostSamples += n - self.capacity
+            samples = samples[n - self.capacity:]
+            n = self.capacity
+        # Published before the copy so a read() copying meanwhile sees the lap.
+        self._writing = self._written + n
+        start = self._written % self.capacity
+        first = min(n, self.capacity - start)
+        self._data[start:start + first] = samples[:first]
+        if (first < n):
+            self._data[:n - first] = samples[first:]
+        self._written += n
+    
+    # Consumer side.  @return Array of all samples written since the last read.
+    def read(self):
+        written = self._written
+        available = written - self._read
+        if (self.capacity < available):
+            self.overruns += 1
+            self.lostSamples += available - self.capacity
+            available = self.capacity
+        start = (written - available) % self.capacity
+        self._read = written
+        if (self.capacity < start + available):
+            samples = np.concatenate((self._data[start:], 
+                                      self._data[:start + available - self.capacity]))
+        else:
+            samples = self._data[start:start + available].copy()
+        
+        # The producer may have lapped (or be overwriting) the oldest samples 
+        # while they were copied.
+        lapped = min(available, self._writing - (written - available) - self.capacity)
+        if (0 < lapped):
+            self.overruns += 1
+            self.lostSamples += lapped
+            samples = samples[lapped:]
+        return samples
+
+
+# Splits samples into width buckets and returns the (min, max) of each.  If
+# interleaved, samples are (real, imaginary) pairs, each reduced separately.
+# Fewer samples than buckets are returned as-is (min == max).
+def minMaxEnvelope(samples, width, interleaved=False):
+    if interleaved:
+        samples = samples[:samples.size - (samples.size % 2)].reshape(-1, 2)
+    n = samples.shape[0]
+    if (n <= width):
+        return samples, samples
+    edges = (np.arange(width) * n) // width
+    return (np.minimum.reduceat(samples, edges, axis=0), 
+            np.maximum.reduceat(samples, edges, axis=0))
+
+
+"""
+Windowed, batched FFT power spectrum averaging.  Samples are accumulated 
+across calls to update() so frames (of `size` samples, stepping by 
+size * (1 - overlap)) span packet boundaries.  All complete frames of an
+update are transformed in one call to NumPy's FFT.
+
+    window    ==> 'hann' (default), 'hamming', 'blackman' or 'rect'
+    averaging ==> 'exponential' (weight `alpha` per new frame) or 'frames'
+                  (mean of the last `frames` frames)
+
+Real streams produce size/2+1 bins from 0 Hz.  Complex (interleaved) streams 
+produce size bins centered on 0 Hz.
+"""
+class Spectrum_Averager(object):
+    # NumPy function of each window.
+    WINDOWS = {'hann': 'hanning', 'hamming': 'hamming', 
+               'blackman': 'blackman', 'rect': 'ones'}
+    
+    def __init__(self, size=1024, window='hann', overlap=0.5, 
+                 averaging='exponential', alpha=0.25, frames=8):
+        self.size = max(2, int(size))
+        self.window = window if (window in self.WINDOWS) else 'hann'
+        self.averaging = averaging if (averaging in ('exponential', 'frames')) else 'exponential'
+        self.alpha = min(1.0, max(0.0, float(alpha)))
+        self.frames = max(1, int(frames))
+        overlap = min(0.95, max(0.0, float(overlap)))
+        self._step = max(1, int(self.size * (1.0 - overlap)))
+        self._window = getattr(np, self.WINDOWS[self.window])(self.size)
+        self._scale = 1.0 / (np.sum(self._window) ** 2)
+        self.reset()
+    
+    def reset(self):
+        self._pending = None
+        self._interleaved = False
+        self._average = None
+        self._history = deque(maxlen=self.frames)
+        self._fresh = 0
+    
+    # Adds samples to the average.  @return Number of new frames averaged.
+    def update(self, samples, interleaved=False):
+        if interleaved:
+            samples = samples[:samples.size - (samples.size % 2)].astype(np.float64)
+            samples = samples[0::2] + 1j * samples[1::2]
+        else:
+            samples = samples.astype(np.float64)
+        if (interleaved != self._interleaved):
+            self.reset()
+            self._interleaved = interleaved
+        if (self._pending is not None):
+            samples = np.concatenate((self._pending, samples))
+        
+        count = 0
+        if (self.size <= samples.size):
+            count = 1 + (samples.size - self.size) // self._step
+            stride = samples.strides[0]
+            frames = np.lib.stride_tricks.as_strided(samples, shape=(count, self.size), 
+                                                     strides=(stride * self._step, stride))
+            self._accumulate(self._power(frames))
+        self._pending = samples[count * self._step:].copy()
+        self._fresh += count
+        return count
+    
+    # @return The averaged spectrum in dB if there were new frames, else None.
+    def spectrum(self):
+        if (0 == self._fresh) or (self._average is None):
+            return None
+        self._fresh = 0
+        return 10.0 * np.log10(self._average + 1e-20)
+    
+    # @return Dictionary of the `start` and `delta` frequencies for xdelta.
+    def frequencies(self, xdelta):
+        delta = 1.0 / (xdelta * self.size) if (0 < xdelta) else 1.0 / self.size
+        start = -delta * (self.size // 2) if self._interleaved else 0.0
+        return {'start': start, 'delta': delta}
+    
+    # Power (magnitude squared, window-normalized) of each row of frames.
+    def _power(self, frames):
+        if self._interleaved:
+            bins = np.fft.fftshift(np.fft.fft(frames * self._window, axis=1), axes=1)
+        else:
+            bins = np.fft.rfft(frames * self._window, axis=1)
+        return (bins.real ** 2 + bins.imag ** 2) * self._scale
+    
+    def _accumulate(self, power):
+        if ('frames' == self.averaging):
+            for row in power[-self.frames:]:
+                self._history.append(row)
+            self._average = np.mean(self._history, axis=0)
+        else:
+            # Exponential average over each frame in turn, in one step.
+            weights = self.alpha * (1.0 - self.alpha) ** np.arange(power.shape[0] - 1, -1, -1)
+            update = np.dot(weights, power)
+            if (self._average is None):
+                self._average = update / max(np.sum(weights), 1e-20)
+            else:
+                decay = (1.0 - self.alpha) ** power.shape[0]
+                self._average = decay * self._average + update
@@ -0,0 +1,30 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Unit tests of the RH Gateway, run from util/rh_gateway with
+          python -m unittest discover tests (or pytest tests).
+
+The gateway's modules use implicit relative imports, so the gateway's 
+directory is put on the path for them.
+"""
+
+import os, sys
+
+GATEWAY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if (GATEWAY_DIR not in sys.path):
+    sys.path.insert(0, GATEWAY_DIR)
@@ -0,0 +1,66 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Tests of recording to (and reading back) rolling capture segments.
+"""
+
+import tests
+from capture import Capture_Writer, Capture_Reader, listCaptures, CAPTURE_MAX_SEGMENTS, \
+    CAPTURE_MAX_SEGMENT_SAMPLES
+
+import os, shutil, tempfile, unittest
+
+
+class Capture_Writer_Test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+
+    # Only the newest segments are kept, each truncated to what was written.
+    def test_segments_roll(self):
+        writer = Capture_Writer('port', 'float32', self.directory, segmentSamples=100, segments=2)
+        for _ in range(5):
+            writer.write(list(range(50)))
+        writer.close()
+        self.assertTrue(writer.join(5.0))
+        paths = listCaptures(self.directory)
+        self.assertEqual(2, len(paths))
+        self.assertEqual([100, 50], [len(Capture_Reader(p)) for p in paths])
+        self.assertEqual(250, writer.samples)
+        # No segment made ahead is left behind.
+        self.assertEqual(4, len(os.listdir(self.directory)))
+
+    def test_options_are_clamped(self):
+        writer = Capture_Writer('port', 'float32', self.directory,
+                                segmentSamples=10 * CAPTURE_MAX_SEGMENT_SAMPLES,
+                                segments=10 * CAPTURE_MAX_SEGMENTS)
+        writer.close()
+        writer.join(5.0)
+        self.assertEqual(CAPTURE_MAX_SEGMENT_SAMPLES, writer.segmentSamples)
+        self.assertEqual(CAPTURE_MAX_SEGMENTS, writer.segments)
+        writer = Capture_Writer('port', 'float32', self.directory, segmentSamples=-1, segments=0)
+        writer.close()
+        writer.join(5.0)
+        self.assertEqual(2, writer.segmentSamples)
+        self.assertEqual(1, writer.segments)
+
+
+if __name__ == '__main__':
+    unittest.main()
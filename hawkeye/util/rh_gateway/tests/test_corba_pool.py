@@ -0,0 +1,62 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Tests of the blocking call pool and the identifiers looked up on it.
+"""
+
+import tests
+from corba_pool import CORBA_Pool, Identifier_Cache
+
+import unittest
+
+
+class Stand_In_Object(object):
+    def __init__(self, identifier):
+        self.identifier = identifier
+        self.asked = 0
+
+    def _get_identifier(self):
+        self.asked += 1
+        if (None == self.identifier):
+            raise RuntimeError("no answer")
+        return self.identifier
+
+
+class Identifier_Cache_Test(unittest.TestCase):
+    def setUp(self):
+        self.pool = CORBA_Pool(2)
+        self.cache = Identifier_Cache(self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+
+    # An object whose call fails is left out rather than shifting the rest.
+    def test_failed_call_is_left_out(self):
+        objs = [Stand_In_Object('id0'), Stand_In_Object(None), 
+                Stand_In_Object('id2'), Stand_In_Object('id3')]
+        byID = self.cache.find(objs, set(['id0', 'id2', 'id3']))
+        self.assertEqual({'id0': objs[0], 'id2': objs[2], 'id3': objs[3]}, byID)
+
+        objs[1].identifier = 'id1'
+        byID = self.cache.find(objs, set(['id1', 'id2']))
+        self.assertEqual({'id1': objs[1], 'id2': objs[2]}, byID)
+        self.assertEqual([1, 2, 1, 1], [obj.asked for obj in objs])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Tests of rate limiting the gateway's log records.
+"""
+
+import tests
+from log import Rate_Limit_Filter
+
+import logging, unittest
+
+
+# @return A WARNING record logged by 'rh_gateway.port' at created.
+def warning(created, msg, args, source=None):
+    record = logging.makeLogRecord({'name': 'rh_gateway.port', 'levelno': logging.WARNING,
+                                    'levelname': 'WARNING', 'msg': msg, 'args': args})
+    record.created = created
+    if (None != source):
+        record.source = source
+    return record
+
+
+class Rate_Limit_Filter_Test(unittest.TestCase):
+    def setUp(self):
+        self.filter = Rate_Limit_Filter(1.0)
+
+    def test_repeats_are_suppressed(self):
+        self.assertTrue(self.filter.filter(warning(0.0, "Port %s failed", ('a',))))
+        self.assertFalse(self.filter.filter(warning(0.5, "Port %s failed", ('a',))))
+        record = warning(1.5, "Port %s failed", ('a',))
+        self.assertTrue(self.filter.filter(record))
+        self.assertEqual("Port a failed (1 more in the last 1.0 sec)", record.getMessage())
+
+    # Other arguments (or sources) are other records.
+    def test_sources_are_separate(self):
+        self.assertTrue(self.filter.filter(warning(0.0, "Port %s failed", ('a',))))
+        self.assertTrue(self.filter.filter(warning(0.1, "Port %s failed", ('b',))))
+        self.assertTrue(self.filter.filter(warning(0.2, "Port %s lost %d", ('a', 1), 'a')))
+        self.assertFalse(self.filter.filter(warning(0.3, "Port %s lost %d", ('a', 2), 'a')))
+        self.assertTrue(self.filter.filter(warning(0.4, "Port %s lost %d", ('b', 3), 'b')))
+
+    # Suppressed records are reported once the interval is over.
+    def test_expire_reports_suppressed(self):
+        self.filter.filter(warning(0.0, "Port %s failed", ('a',)))
+        for t in (0.2, 0.4, 0.6):
+            self.filter.filter(warning(t, "Port %s failed", ('a',)))
+        self.assertEqual([], self.filter.expire(0.9))
+        records = self.filter.expire(1.0)
+        self.assertEqual(["Port a failed (2 more in the last 1.0 sec)"],
+                         [r.getMessage() for r in records])
+        self.assertEqual([], self.filter.expire(5.0))
+        self.assertEqual({}, self.filter._last)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Tests creating proxies of stand-in REDHAWK objects.
+"""
+
+import tests
+from core import RH_Message, Proxy_Base, Proxy_Index
+from scheduler import Scheduler
+from corba_pool import CORBA_Pool
+from port import Port, Port_BULKIO
+from capture import Capture_Writer, listCaptures
+from playback import Port_Playback
+
+import shutil, tempfile, unittest
+
+try:
+    import bulkio.bulkioInterfaces
+    HAVE_BULKIO = True
+except ImportError:
+    HAVE_BULKIO = False
+
+try:
+    from comp_dev import Property
+    HAVE_REDHAWK = True
+except ImportError:
+    HAVE_REDHAWK = False
+
+
+"""
+Stand-in REDHAWK objects with only what the proxies use.
+"""
+class Stand_In_Property(object):
+    type = 'double'
+    mode = 'readwrite'
+
+    def __init__(self, identifier, value):
+        self.id = identifier
+        self.clean_name = identifier
+        self._value = value
+
+    def queryValue(self):
+        return self._value
+
+class Stand_In_Interface(object):
+    def __init__(self, nameSpace, filename):
+        self.nameSpace = nameSpace
+        self.filename = filename
+
+class Stand_In_Port(object):
+    def __init__(self, name, nameSpace='BULKIO', filename='bio_dataFloat'):
+        self._name = name
+        self._direction = 'Provides'
+        self._interface = Stand_In_Interface(nameSpace, filename)
+
+
+# Outbox keeping every message put in it.
+class Outbox(object):
+    def __init__(self):
+        self.messages = []
+
+    def put(self, msgarray):
+        self.messages += msgarray
+
+    def changes(self, change):
+        return [m for m in self.messages if (change == m['change'])]
+
+
+# Root proxy (a component) the proxies under test are created in.
+class Stand_In_Component(Proxy_Base):
+    _expandable = False
+
+    def _finish_init_(self):
+        pass
+
+    @property
+    def _getID(self):
+        return 'comp_1'
+
+    @property
+    def _getName(self):
+        return 'comp'
+
+    def getMessage(self, change='update'):
+        return RH_Message(change, 'component', self.getID, self.getName)
+
+
+# Proxy whose message carries whatever value it was last given.
+class Stand_In_Value(Stand_In_Component):
+    value = 1.5
+
+    def getMessage(self, change='update'):
+        msg = RH_Message(change, 'property', self.getID, self.getName)
+        msg['more']['value'] = self.value
+        return msg
+
+
+class Proxy_Test(unittest.TestCase):
+    def setUp(self):
+        self.outbox = Outbox()
+        self.scheduler = Scheduler()
+        self.pool = CORBA_Pool(2)
+        self.parent = Stand_In_Component(object(), '', self.outbox, Proxy_Index(),
+                                         self.scheduler, True, 0, self.pool)
+
+    def tearDown(self):
+        self.scheduler.close()
+        self.pool.close()
+
+    @unittest.skipUnless(HAVE_REDHAWK, "REDHAWK is not installed")
+    def test_property_sends_add(self):
+        prop = Property(Stand_In_Property('prop_0', 1.5), self.parent, self.outbox)
+        adds = [m for m in self.outbox.changes('add') if ('property' == m['rhtype'])]
+        self.assertEqual(1, len(adds))
+        self.assertEqual(prop.getID, adds[0]['rhid'])
+        self.assertEqual(1.5, adds[0]['more']['value'])
+        self.assertEqual('readwrite', adds[0]['more']['access'])
+
+    # Changing a snapshot does not change the cached message.
+    @unittest.skipUnless(HAVE_REDHAWK, "REDHAWK is not installed")
+    def test_snapshot_is_a_copy(self):
+        prop = Property(Stand_In_Property('prop_0', [1.0, 2.0]), self.parent, self.outbox)
+        prop._staleSec = 60.0
+        snapshot = prop.getSnapshot()
+        snapshot['more']['value'].append(3.0)
+        snapshot['more']['domainID'] = 'other'
+        self.assertEqual([1.0, 2.0], prop.getSnapshot()['more']['value'])
+        self.assertTrue('domainID' not in prop.getSnapshot()['more'])
+
+    # The version changes when a rebuilt message does, not on every rebuild.
+    def test_snapshot_version_follows_changes(self):
+        prop = Stand_In_Value(object(), '', self.outbox, Proxy_Index(),
+                              self.scheduler, True, 0, self.pool)
+        prop._staleSec = 0.0
+        version = prop.getSnapshot()['more']['version']
+        self.assertEqual(version, prop.getSnapshot()['more']['version'])
+        prop.value = 2.5
+        self.assertEqual(version + 1, prop.getSnapshot()['more']['version'])
+        prop.invalidate()
+        self.assertEqual(version + 1, prop.getSnapshot()['more']['version'])
+
+    @unittest.skipUnless(HAVE_BULKIO, "BULKIO is not installed")
+    def test_bulkio_port_sends_add(self):
+        port = Port.getPort(Stand_In_Port('dataFloat_in'), self.parent, self.outbox)
+        self.assertTrue(isinstance(port, Port_BULKIO))
+        adds = [m for m in self.outbox.changes('add') if ('port' == m['rhtype'])]
+        self.assertEqual([port.getID], [m['rhid'] for m in adds])
+        port.cleanUp()
+
+    # A Port_BULKIO reading its capture rather than a REDHAWK port.
+    def test_playback_port_sends_add(self):
+        directory = tempfile.mkdtemp()
+        try:
+            writer = Capture_Writer('comp_1.out', 'float32', directory)
+            writer.write(list(range(100)))
+            writer.close()
+            writer.join()
+            port = Port_Playback(listCaptures(directory)[0], self.parent, self.outbox)
+            adds = [m for m in self.outbox.changes('add') if ('port' == m['rhtype'])]
+            self.assertEqual([port.getID], [m['rhid'] for m in adds])
+            self.assertEqual(100, port.getMessage('update')['more']['playback']['samples'])
+            port.cleanUp()
+        finally:
+            shutil.rmtree(directory, True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Tests of the timer wheel and of blocking tasks on it.
+"""
+
+import tests
+from scheduler import Scheduler
+from corba_pool import CORBA_Pool, CORBA_Timeout
+
+import time, unittest
+import gevent
+
+
+class Scheduler_Test(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.fast = []
+
+    def tearDown(self):
+        self.scheduler.close()
+
+    def fastTask(self):
+        self.fast.append(time.time())
+
+    def test_periodic_runs_at_rate(self):
+        self.scheduler.schedulePeriodic(self.fastTask, 0.05, 'fast')
+        gevent.sleep(0.52)
+        self.assertTrue(9 <= len(self.fast) <= 11, len(self.fast))
+
+    def test_once_runs_once(self):
+        task = self.scheduler.scheduleOnce(self.fastTask, 0.05, 'once')
+        gevent.sleep(0.2)
+        self.assertEqual(1, len(self.fast))
+        self.assertEqual(0, len(self.scheduler))
+        self.assertFalse(task.active)
+
+    def test_slow_task_does_not_stall_others(self):
+        self.scheduler.schedulePeriodic(lambda: gevent.sleep(1.0), 0.1, 'slow')
+        self.scheduler.schedulePeriodic(self.fastTask, 0.1, 'fast')
+        gevent.sleep(1.05)
+        self.assertTrue(9 <= len(self.fast), len(self.fast))
+
+    def test_task_in_flight_is_skipped(self):
+        slow = self.scheduler.schedulePeriodic(lambda: gevent.sleep(0.35), 0.1, 'slow')
+        gevent.sleep(1.05)
+        self.assertTrue(slow.runs <= 3, slow.runs)
+        self.assertTrue(5 <= slow.overruns, slow.overruns)
+
+    # Tasks that do not block run in the wheel's greenlet; the rest on a fixed
+    # set of workers, so no greenlet is created per run.
+    def test_runs_reuse_greenlets(self):
+        wheel, workers = set(), set()
+        self.scheduler.schedulePeriodic(lambda: wheel.add(gevent.getcurrent()), 0.02, 'drain', False)
+        self.scheduler.schedulePeriodic(lambda: workers.add(gevent.getcurrent()), 0.02, 'poll')
+        gevent.sleep(0.3)
+        self.assertEqual(set([self.scheduler._greenlet]), wheel)
+        self.assertTrue(set(workers) <= set(self.scheduler._workers))
+        self.assertEqual(1 + self.scheduler.workers, self.scheduler.greenlets)
+
+    def test_timed_out_call_does_not_delay_others(self):
+        pool = CORBA_Pool(2, timeoutSec=0.3)
+        calls = []
+        def hung():
+            start = time.time()
+            try:
+                pool.call(time.sleep, 1.0)
+            except CORBA_Timeout:
+                calls.append((start, time.time()))
+        try:
+            self.scheduler.schedulePeriodic(self.fastTask, 0.05, 'fast')
+            gevent.sleep(0.12)
+            self.scheduler.scheduleOnce(hung, 0, 'hung')
+            gevent.sleep(0.5)
+        finally:
+            pool.close()
+        self.assertEqual(1, len(calls))
+        start, end = calls[0]
+        during = [t for t in self.fast if (start < t < end)]
+        self.assertTrue(4 <= len(during), (len(during), end - start))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Tests of routing messages and reference counting by session.
+"""
+
+import tests
+from session import Session, Session_Router, parseCredits
+
+import unittest
+
+KEY = ('domain', 'comp_1')
+
+
+class Session_Router_Test(unittest.TestCase):
+    def setUp(self):
+        self.router = Session_Router()
+        for sessionID in ('a', 'b'):
+            self.router.addSession(Session(sessionID))
+
+    def tearDown(self):
+        for sessionID in ('a', 'b'):
+            self.router.removeSession(sessionID)
+
+    # Only the first subscriber starts and the last stops.
+    def test_subscriptions_are_counted(self):
+        self.assertTrue(self.router.subscribe('a', KEY))
+        self.assertFalse(self.router.subscribe('b', KEY))
+        self.assertFalse(self.router.unsubscribe('a', KEY))
+        self.assertTrue(self.router.unsubscribe('b', KEY))
+
+    # Only the last session to collapse frees the children.
+    def test_expansions_are_counted(self):
+        self.assertTrue(self.router.expand('a', KEY))
+        self.assertFalse(self.router.expand('b', KEY))
+        self.assertFalse(self.router.expand('a', KEY))
+        self.assertFalse(self.router.collapse('a', KEY))
+        self.assertTrue(self.router.collapse('b', KEY))
+        # Collapsing what nobody expanded frees it (as without sessions).
+        self.assertTrue(self.router.collapse('a', KEY))
+
+    def test_closed_session_collapses(self):
+        self.router.expand('a', KEY)
+        self.router.expand('b', KEY)
+        self.assertEqual([], self.router.collapseAll('a'))
+        self.assertEqual([KEY], self.router.collapseAll('b'))
+
+    def test_unknown_session_is_not_counted(self):
+        self.assertTrue(self.router.expand('c', KEY))
+        self.assertTrue(self.router.expand('a', KEY))
+        self.assertFalse(self.router.collapse('c', KEY))
+
+    def test_credits_are_validated(self):
+        self.assertEqual(3, parseCredits('3'))
+        for bad in (None, 'lots', [], float('inf')):
+            self.assertEqual(None, parseCredits(bad))
+        self.router.subscribe('a', KEY, 4)
+        self.router.getSession('a').credits[KEY] = 1
+        self.router.replenish('a', KEY, -10)
+        self.assertEqual(1, self.router.getSession('a').credits[KEY])
+        self.router.replenish('a', KEY, 10)
+        self.assertEqual(4, self.router.getSession('a').credits[KEY])
+
+    # Stream messages go to subscribers only; the rest to every session.
+    def test_put_routes_streams(self):
+        self.router.subscribe('a', KEY)
+        self.router.put([{'change': 'stream', 'rhid': KEY[1], 'more': {'domainID': KEY[0]}},
+                         {'change': 'update', 'rhid': KEY[1], 'more': {'domainID': KEY[0]}}])
+        a = self.router.getSession('a').outbox.get_nowait()
+        b = self.router.getSession('b').outbox.get_nowait()
+        self.assertEqual(['stream', 'update'], [m['change'] for m in a])
+        self.assertEqual(['update'], [m['change'] for m in b])
+
+
+if __name__ == '__main__':
+    unittest.main()
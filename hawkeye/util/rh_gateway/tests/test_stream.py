@@ -0,0 +1,77 @@
+"""
+Copyright: 2014 Geon Technologies, LLC
+
+This file is part of HAWKEYE.
+
+HAWKEYE is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+@summary: Tests of the port's sample ring and stream options.
+"""
+
+import tests
+from stream import Ring_Buffer, RING_CAPACITY, RING_MAX_CAPACITY
+from port import StreamHelper
+
+import unittest
+import numpy as np
+
+
+class Stand_In_Parent(object):
+    getID = 'comp_1.out'
+
+
+class Ring_Buffer_Test(unittest.TestCase):
+    # What was read is not changed by later writes.
+    def test_read_is_a_copy(self):
+        ring = Ring_Buffer(8)
+        ring.write(np.arange(4.0))
+        samples = ring.read()
+        ring.write(np.arange(10.0, 18.0))
+        self.assertEqual([0.0, 1.0, 2.0, 3.0], samples.tolist())
+
+    def test_overrun_keeps_newest(self):
+        ring = Ring_Buffer(4)
+        ring.write(np.arange(3.0))
+        ring.write(np.arange(3.0, 6.0))
+        self.assertEqual([2.0, 3.0, 4.0, 5.0], ring.read().tolist())
+        self.assertEqual(1, ring.overruns)
+        self.assertEqual(2, ring.lostSamples)
+
+
+    # A write still copying over the oldest samples while they are read.
+    def test_write_in_progress_is_a_lap(self):
+        ring = Ring_Buffer(4)
+        ring.write(np.arange(4.0))
+        ring._writing = ring._written + 2
+        self.assertEqual([2.0, 3.0], ring.read().tolist())
+        self.assertEqual(1, ring.overruns)
+        self.assertEqual(2, ring.lostSamples)
+
+
+class Stream_Helper_Test(unittest.TestCase):
+    def setUp(self):
+        self.helper = StreamHelper(Stand_In_Parent())
+
+    def test_buffer_size_is_limited(self):
+        self.helper.configure({'bufferSize': 10 * RING_MAX_CAPACITY})
+        self.assertEqual(RING_MAX_CAPACITY, self.helper._ring.capacity)
+
+    def test_bad_buffer_size_uses_default(self):
+        for bufferSize in (0, -5, 'lots', None):
+            self.helper.configure({'bufferSize': bufferSize})
+            self.assertEqual(RING_CAPACITY, self.helper._ring.capacity)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,27 +18,25 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 @author: Thomas Goodwin
 @summary: Simple set of utilities for searching and splitting splitting dictionaries
+          and comparing property values.
 """
 
+import numbers, importlib
+
 # Compares dictlista to dictlistb using the provided keys.
 # The dictionaries in each list must all support the provided keys.
 # @return indices Indexes where a dictionary in dictlista was not 
 #                 found in dictlistb.
 def indicesUniqueOnKeys(dictlista, dictlistb, keys):
-    indices = []
-    for dax, da in enumerate(dictlista):
-        found = False
-        for db in dictlistb:
-            match = True
-            for key in keys:
-                if da[key] != db[key]:
-                    match = False;
-                    break
-            if match:
-                found = True
-        if not found:
-            indices.append(dax)
-    return indices
+    keys = list(keys)
+    try:
+        found = set([tuple([db[key] for key in keys]) for db in dictlistb])
+        return [dax for dax, da in enumerate(dictlista) 
+                if tuple([da[key] for key in keys]) not in found]
+    except TypeError:
+        # Unhashable values (e.g., a dict); compare each pair instead.
+        return [dax for dax, da in enumerate(dictlista) 
+                if not any([all([da[key] == db[key] for key in keys]) for db in dictlistb])]
 
 # Takes 2 lists of dictionaries and splits them into added and removed
 # lists using the provided keys.  All keys must be supported by the 
@@ -49,3 +47,48 @@ def splitDictLists(newList, oldList, keys):
     removeIdxs = indicesUniqueOnKeys(oldList, newList, keys)
     return ([newList[i] for i in addIdxs], 
             [oldList[i] for i in removeIdxs])
+
+# Compares two property values (simple, sequence, struct, or struct sequence).
+# Numbers (not bools) only count as changed if they differ by more than the
+# deadband (when the deadband is positive).
+# @return True if new differs from old.
+def valueChanged(old, new, deadband=0.0):
+    if isinstance(old, (list, tuple)) and isinstance(new, (list, tuple)):
+        if (len(old) != len(new)):
+            return True
+        for o, n in zip(old, new):
+            if valueChanged(o, n, deadband):
+                return True
+        return False
+    elif isinstance(old, dict) and isinstance(new, dict):
+        if (set(old.keys()) != set(new.keys())):
+            return True
+        for key in old:
+            if valueChanged(old[key], new[key], deadband):
+                return True
+        return False
+    elif ((0 < deadband) and 
+          isinstance(old, numbers.Real) and isinstance(new, numbers.Real) and
+          not isinstance(old, bool) and not isinstance(new, bool)):
+        return (deadband < abs(new - old))
+    return (old != new)
+
+"""
+Stand-in for a module that is only imported when one of its attributes is
+first used, e.g., numpy by the first BULKIO port rather than by importing the
+gateway.  Use it for modules needed by some types only:
+    np = Lazy_Module('numpy')
+Attributes must not be used at import time (class bodies, default arguments)
+or the module is imported then after all.
+"""
+class Lazy_Module(object):
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if (None == module):
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return getattr(module, attr)
@@ -28,6 +28,25 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
  *       RH Session ZeroRPC Client and Server
  *       RH Gateway ZeroRPC Client and Server
  *       REDHAWK Python Model 
+ *
+ *    A session outlives its socket by config.resumeGraceSec so that a browser
+ *    that reconnects (e.g., after a network drop) resumes it rather than 
+ *    starting over:
+ *       1) On connecting, the client is sent a 'session' event with the 
+ *          session's resume `token` (and `resumed` false).
+ *       2) Each batch of messages with changes (anything but 'stream') is 
+ *          followed by a 'version' event numbering it; the client answers 
+ *          with an 'ack' of that version once processed.  Changes are kept
+ *          (see RESUME_LOG_MAX) until acknowledged.
+ *       3) When the socket disconnects the session is detached: the gateway,
+ *          proxy tree and stream subscriptions are kept, changes continue to
+ *          be logged and stream messages are dropped.
+ *       4) A socket connecting with the query token=<token>&version=<last 
+ *          version processed> within the grace period is given the session 
+ *          back ('session' with `resumed` true) and only the changes since 
+ *          that version.  Otherwise (expired, unknown token, or changes no 
+ *          longer logged) it is sent `resumed` false and a new session's 
+ *          whole tree, and should discard what it was showing.
  */
 // TODO: Investigate if it would be better to directly connect the RH Gateway
 //       to the client using ZeroRPC rather than using socket.io for one leg 
@@ -39,32 +58,79 @@ var sio = require('socket.io'),
     path = require('path'),
     zerorpc = require('zerorpc'),
     spawn = require('child_process').spawn,
+    crypto = require('crypto'),
     RH_Message = require('../site/js/rh_message');
 
 // Local list of active or idle sessions
 var sessions = [];
 
+// Session options (see configure()).
+//    sharedGateway: If true, all sessions are multiplexed over a single 
+//                   RH Gateway process rather than one process per socket.
+//    lazyTree: If true, the gateway only builds a node's children when the
+//              client expands it.
+//    logLevel: Least severe gateway log messages written to its stdout
+//              (DEBUG, INFO, WARNING, ERROR or CRITICAL).
+//    standbyGateways: Number of pre-warmed (--standby) RH Gateway processes
+//              kept ready to be handed the next sessions (if not shared).
+//    resumeGraceSec: Seconds a disconnected session is kept for its client 
+//              to resume (0 shuts it down right away).
+var config = { sharedGateway : false,
+               lazyTree : false,
+               logLevel : 'INFO',
+               standbyGateways : 0,
+               resumeGraceSec : 30 };
+
+// Most change batches a session keeps unacknowledged.  A client further 
+// behind than this cannot resume.
+var RESUME_LOG_MAX = 1000;
+
+// The single RH Gateway process and its ZeroRPC client when sharing.
+var sharedGateway = null;
+
+// Standby RH Gateway processes and their ZeroRPC clients, oldest first, and
+// the count of those spawned (for their unique socket addresses).
+var standbyGateways = [];
+var standbySpawned = 0;
+
+// A standby that exits is replaced after standbyRetryMs, which doubles (up to
+// STANDBY_RETRY_MAX_MS) while they keep exiting and resets once one is taken.
+var STANDBY_RETRY_MIN_MS = 1000;
+var STANDBY_RETRY_MAX_MS = 60000;
+var standbyRetryMs = STANDBY_RETRY_MIN_MS;
+var standbyRetry = null;
+
 /* ******************************************
  * Public interface methods
  * ******************************************/
 
 module.exports = {
+    configure : configure,
     getSessionForSocket : getSessionForSocket,
+    resumeSessionForSocket : resumeSessionForSocket,
     removeSessionForSocket : removeSessionForSocket,
     removeAllSessions : removeAllSessions,
     RH_Session : RH_Session
 };
 
+// Override any of the config options for sessions created after this call.
+function configure (options) {
+    for (key in config) {
+        if (options.hasOwnProperty(key)) {
+            config[key] = options[key];
+        }
+    }
+    fillStandbyGateways();
+};
+
 // Get or return new session based on socket
 // throwIfNotFound is optional and defaults to false.
 function getSessionForSocket (socket, throwIfNotFound) {
     throwIfNotFound = (typeof throwIfNotFound === "undefined") ? false : throwIfNotFound;
     
-    var len = sessions.length;
-    for (var i = 0; i < len; i++) {
-        if (sessions[i].sessionID() === socket.id) {
-            return sessions[i];
-        }
+    var session = findSessionForSocket(socket);
+    if (null != session) {
+        return session;
     }
     if (throwIfNotFound === true) throw 'No session found for socket.';
         
@@ -74,21 +140,45 @@ function getSessionForSocket (socket, throwIfNotFound) {
     return session;
 };
     
+// Returns the session attached to the socket or null.
+function findSessionForSocket (socket) {
+    var len = sessions.length;
+    for (var i = 0; i < len; i++) {
+        if (sessions[i].socketID() === socket.id) {
+            return sessions[i];
+        }
+    }
+    return null;
+};
+
+// Gives the socket the session its handshake query names (token and 
+// version), if it can still be resumed.  The session may not be detached 
+// yet: socket.io can notice the old socket is gone after the client has 
+// reconnected.
+// Returns the session or null (the socket then needs a new session).
+function resumeSessionForSocket (socket) {
+    var query = socket.handshake.query || {};
+    if (!query.token) {
+        return null;
+    }
+    var len = sessions.length;
+    for (var i = 0; i < len; i++) {
+        if (sessions[i].token() === query.token) {
+            if (sessions[i].resume(socket, parseInt(query.version, 10) || 0)) {
+                return sessions[i];
+            }
+            // Too far behind; it is replaced by a new session.
+            removeSession(sessions[i]);
+            break;
+        }
+    }
+    return null;
+};
+
 // Finds the session for the socket, shuts it down, and removes it.
 function removeSessionForSocket (socket, callback) {
     try {
-        session = getSessionForSocket(socket, true);
-        session.shutdown(); 
-        
-        var remove_idx = -1;
-        var len = sessions.length;
-        for (var i = 0; i < len; i++) {
-            if (session === sessions[i]) {
-                remove_idx = i;
-                break;
-            }
-        }        
-        if (0 <= remove_idx) sessions.splice(remove_idx, 1);
+        removeSession(getSessionForSocket(socket, true));
     }
     catch (error) {
         console.error("Failed to remove session; see error. ");
@@ -99,6 +189,32 @@ function removeSessionForSocket (socket, callback) {
     }
     
 };
+
+// Finds the session for the disconnected socket and detaches it for the
+// grace period, or removes it if resuming is disabled.  There is none if 
+// it was already resumed by another socket.
+function detachSessionForSocket (socket) {
+    var session = findSessionForSocket(socket);
+    if (null == session) {
+        return;
+    }
+    if (0 < config.resumeGraceSec) {
+        session.detach(config.resumeGraceSec, function () {
+            console.info("Removing RH_Session not resumed in time: " + session.sessionID());
+            removeSession(session);
+        });
+    }
+    else {
+        removeSession(session);
+    }
+};
+
+// Shuts the session down and removes it from the list.
+function removeSession (session) {
+    session.shutdown();
+    var remove_idx = sessions.indexOf(session);
+    if (0 <= remove_idx) sessions.splice(remove_idx, 1);
+};
     
 // Shutdown and remove all sessions
 function removeAllSessions (callback) {
@@ -112,9 +228,110 @@ function removeAllSessions (callback) {
         }
     }
     sessions.length = 0; // Clear the array.
+    
+    if (null != sharedGateway) {
+        sharedGateway.client.close();
+        sharedGateway.process.kill();
+        sharedGateway = null;
+    }
+    
+    if (null != standbyRetry) {
+        clearTimeout(standbyRetry);
+        standbyRetry = null;
+    }
+    var standbys = standbyGateways.splice(0, standbyGateways.length);
+    for (var i = 0; i < standbys.length; i++) {
+        standbys[i].client.close();
+        standbys[i].process.kill();
+    }
     if (callback) callback();
 };
 
+// Command line for an RH Gateway at the base socket address addr.
+function gatewayArgs (p, addr, shared, standby) {
+    var args = [p + '/rh_gateway/rh_gateway.py'];
+    if (shared) {
+        args.push('--shared');
+    }
+    if (standby) {
+        args.push('--standby');
+    }
+    if (config.lazyTree) {
+        args.push('--lazy');
+    }
+    args.push('--log-level', config.logLevel);
+    args.push(addr);
+    return args;
+};
+
+// Returns the shared RH Gateway, spawning it on first use.  The gateway
+// is started with --shared so it waits for openSession calls.
+function getSharedGateway () {
+    if (null == sharedGateway) {
+        var p = path.relative(process.cwd(), __dirname);
+        var addr = 'ipc://' + p + '/zpcsockets/shared_gateway.sock';
+        var gateway = spawn('python', gatewayArgs(p, addr, true));
+        
+        var client = new zerorpc.Client();
+        client.connect(addr + '_rh2node');
+        
+        gateway.on('exit', function (code, signal) {
+            console.log("Shared RH Gateway exited w/ code: " + code);
+            sharedGateway = null;
+        });
+        sharedGateway = { process: gateway, client: client };
+    }
+    return sharedGateway;
+};
+
+// Spawns standby RH Gateways until there are config.standbyGateways of them.
+// Each has already imported and attached to the domains by the time a 
+// session is handed to it (see takeStandbyGateway).
+function fillStandbyGateways () {
+    if (config.sharedGateway) {
+        return;
+    }
+    var p = path.relative(process.cwd(), __dirname);
+    while (standbyGateways.length < config.standbyGateways) {
+        var addr = 'ipc://' + p + '/zpcsockets/standby_' + process.pid + '_' + 
+                   String(standbySpawned++) + '.sock';
+        var gateway = spawn('python', gatewayArgs(p, addr, false, true));
+        var client = new zerorpc.Client();
+        client.connect(addr + '_rh2node');
+        
+        var standby = { process: gateway, client: client };
+        gateway.on('exit', (function (standby) {
+            return function (code, signal) {
+                var idx = standbyGateways.indexOf(standby);
+                if (0 <= idx) {
+                    console.log("Standby RH Gateway exited w/ code: " + code);
+                    standbyGateways.splice(idx, 1);
+                    standby.client.close();
+                    if (null == standbyRetry) {
+                        standbyRetry = setTimeout(function () {
+                            standbyRetry = null;
+                            fillStandbyGateways();
+                        }, standbyRetryMs);
+                        standbyRetryMs = Math.min(2 * standbyRetryMs, STANDBY_RETRY_MAX_MS);
+                    }
+                }
+            };
+        })(standby));
+        standbyGateways.push(standby);
+    }
+};
+
+// Returns the oldest (warmest) standby RH Gateway, or null if there are 
+// none, and spawns its replacement.
+function takeStandbyGateway () {
+    var standby = (0 < standbyGateways.length) ? standbyGateways.shift() : null;
+    if (null != standby) {
+        standbyRetryMs = STANDBY_RETRY_MIN_MS;
+    }
+    setImmediate(fillStandbyGateways);
+    return standby;
+};
+
 // RH_Session class is public along with a few methods below.
 // It represents the three sockets exchanging data between
 // REHDAWK and the Client's browser.
@@ -124,46 +341,115 @@ function RH_Session (socketIn) {
     // ZeroRPC client and server will have a .sock UNIX Socket
     //    Node.js server side: _node2rh
     //    REDHAWK server side: _rh2node
-    var socket = socketIn;
+    // The session keeps the ID of the socket it was created for; a resumed
+    // session is served to a socket with another ID.
+    var socket = null;
+    var sessionID = String(socketIn.id);
     var p = path.relative(process.cwd(), __dirname);
-    var addr = 'ipc://' + p + '/zpcsockets/' + String(socket.id) + '.sock';
-    var gateway = spawn('python', [p + '/rh_gateway/rh_gateway.py', addr]);
+    var addr = 'ipc://' + p + '/zpcsockets/' + sessionID + '.sock';
+    var shared = config.sharedGateway;
+    var standby = (shared) ? null : takeStandbyGateway();
+    var gateway = null;
+    var client = null;
     
-    var client = new zerorpc.Client();
-    client.connect(addr + '_rh2node');
+    // Resume token, version of the last change batch, unacknowledged change
+    // batches ({version, messages}, oldest first), the newest version no 
+    // longer logged, and the timer shutting a detached session down.
+    var token = crypto.randomBytes(16).toString('hex');
+    var version = 0;
+    var changeLog = [];
+    var trimmed = 0;
+    var graceTimer = null;
+    
+    if (shared) {
+        // Only the _node2rh server below is specific to this session.
+        gateway = getSharedGateway().process;
+        client = getSharedGateway().client;
+    }
+    else if (null != standby) {
+        // Pre-warmed; it is handed this session's _node2rh address below.
+        gateway = standby.process;
+        client = standby.client;
+    }
+    else {
+        gateway = spawn('python', gatewayArgs(p, addr, false));
+        client = new zerorpc.Client();
+        client.connect(addr + '_rh2node');
+    }
     
     // Logging text
-    this.name = "RH Session ID " + socket.id;
+    this.name = "RH Session ID " + sessionID;
+    
+    // Sends the messages to the client, if attached.  A batch with changes
+    // is numbered by the next version, sent after it, and its changes are 
+    // logged until the client acknowledges that version.
+    var deliver = function(messages) {
+        var changes = messages.filter(function (msg) { return ('stream' != msg.change); });
+        var numbered = null;
+        if (changes.length) {
+            numbered = ++version;
+            changeLog.push({ version: numbered, messages: changes });
+            if (RESUME_LOG_MAX < changeLog.length) {
+                trimmed = changeLog.shift().version;
+            }
+        }
+        if (null != socket) {
+            socket.send(JSON.stringify(messages));
+            if (null != numbered) {
+                socket.emit('version', numbered);
+            }
+        }
+    };
     
+    // Forgets the changes the client has processed.
+    var acknowledge = function(acked) {
+        while (changeLog.length && (changeLog[0].version <= acked)) {
+            trimmed = changeLog.shift().version;
+        }
+    };
     
     // Socket.io Instance for managing browser interface to the RH_Session
     // See "Server" @ https://github.com/LearnBoost/socket.io/wiki/Exposed-events
     // TODO: Add ability for the server to pass different callbacks to these.
-    socket
-        .on('message', function(msg, ackCallback) {
-            client.invoke("passMessages", JSON.parse(msg), function(error, response, more) {
-                if (error) {
-                    console.error("RH_Session failed to pass message to RH_Gateway:");
-                    console.error(error);
-                }
-                else if (null != response) {
-                    socket.send(JSON.stringify(response));
-                }
+    var SOCKET_EVENTS = ['message', 'ack', 'anything', 'disconnect', 'error'];
+    var attach = function(socketIn) {
+        if (null != socket) {
+            // Replaced before its disconnect; ignore anything else from it.
+            for (var i = 0; i < SOCKET_EVENTS.length; i++) {
+                socket.removeAllListeners(SOCKET_EVENTS[i]);
+            }
+        }
+        socket = socketIn;
+        socket
+            .on('message', function(msg, ackCallback) {
+                client.invoke("passMessages", JSON.parse(msg), (shared) ? sessionID : '', function(error, response, more) {
+                    if (error) {
+                        console.error("RH_Session failed to pass message to RH_Gateway:");
+                        console.error(error);
+                    }
+                    else if (null != response) {
+                        deliver(response);
+                    }
+                });
+            })
+            .on('ack', function(acked) {
+                acknowledge(parseInt(acked, 10) || 0);
+            })
+            .on('anything', function(data) {
+                // TODO: This is any other event other than message or disconnect.
+                //console.info("Client sent 'anything' to RH_Session: " + data);
+            })
+            .on('disconnect', function() {
+                console.info("Detaching RH_Session for disconnected socket: " + socketIn.id);
+                detachSessionForSocket(socketIn);
+            })
+            .on('error', function() {
+                console.error("Socket " + socketIn.id + " had an error.  Closing RH_Session.");
+                removeSessionForSocket(socketIn);
             });
-        })
-        .on('anything', function(data) {
-            // TODO: This is any other event other than message or disconnect.
-            //console.info("Client sent 'anything' to RH_Session: " + data);
-        })
-        .on('disconnect', function() {
-            console.info("Removing RH_Session for disconnected socket: " + socket.id);
-            removeSessionForSocket(socket);
-        })
-        .on('error', function() {
-            console.error("Socket " + socket.id + " had an error.  Closing RH_Session.");
-            removeSessionForSocket(socket);
-        });
-
+    };
+    attach(socketIn);
+    socket.emit('session', { token: token, resumed: false });
     
     // ZeroRPC Instance for handling RH_Gateway event callbacks
     // TODO: Define more callbacks??  Do more processing in Node?
@@ -176,8 +462,7 @@ function RH_Session (socketIn) {
         passMessages: function(data, reply) {
             try {
                 //console.log("RH_Gateway passed " + data.length + " messages to the client.");
-                data = JSON.stringify(data);
-                socket.send(data);
+                deliver(data);
                 reply(true);
             }
             catch (error) {
@@ -190,24 +475,102 @@ function RH_Session (socketIn) {
     });
     server.bind(addr + '_node2rh');
     
-    // When gateway goes down, close the server.
-    gateway.on('exit', function (code, signal) {
-        console.log("Closed Node<-REDHAWK Client w/ code: " + code);
-    });
+    if (shared) {
+        // Attach this session to the shared gateway's proxy tree.
+        client.invoke("openSession", sessionID, addr + '_node2rh', function(error, response, more) {
+            if (error) {
+                console.error("RH_Session failed to open a session on the shared RH_Gateway:");
+                console.error(error);
+            }
+        });
+    }
+    else {
+        if (null != standby) {
+            // The standby gateway serves this session only (as the default '' session).
+            client.invoke("openSession", '', addr + '_node2rh', function(error, response, more) {
+                if (error) {
+                    console.error("RH_Session failed to open a session on a standby RH_Gateway:");
+                    console.error(error);
+                }
+            });
+        }
+        // When gateway goes down, close the server.
+        gateway.on('exit', function (code, signal) {
+            console.log("Closed Node<-REDHAWK Client w/ code: " + code);
+        });
+    }
     
-    // Expose the socket ID as the session ID.
+    // Expose the ID of the socket the session was created for as the session ID.
     this.sessionID = function() {
-        return socket.id;
+        return sessionID;
+    };
+    
+    // ID of the socket currently attached (null while detached).
+    this.socketID = function() {
+        return (null != socket) ? socket.id : null;
+    };
+    
+    this.token = function() {
+        return token;
+    };
+    
+    // Detaches the disconnected socket; onExpired is called if the session
+    // is not resumed within graceSec.
+    this.detach = function(graceSec, onExpired) {
+        socket = null;
+        clearTimeout(graceTimer);
+        graceTimer = setTimeout(onExpired, graceSec * 1000);
+    };
+    
+    // Attaches socketIn to the session, in place of the socket it had (if 
+    // not yet detached), and sends it the changes since the version it last
+    // processed.  Its subscriptions' flow control credits are refilled (the
+    // frames in flight were dropped).
+    // Returns false, leaving the session as it was, if those changes are no
+    // longer all logged.
+    this.resume = function(socketIn, acked) {
+        if ((acked < trimmed) || (version < acked)) {
+            return false;
+        }
+        clearTimeout(graceTimer);
+        graceTimer = null;
+        acknowledge(acked);
+        attach(socketIn);
+        socket.emit('session', { token: token, resumed: true });
+        changeLog.forEach(function (batch) {
+            socket.send(JSON.stringify(batch.messages));
+            socket.emit('version', batch.version);
+        });
+        client.invoke("resumeSession", (shared) ? sessionID : '', function(error, response, more) {
+            if (error) {
+                console.error("RH_Session failed to resume its session on the RH_Gateway:");
+                console.error(error);
+            }
+        });
+        console.log("RH Session resumed from version " + acked + " of " + version + ": " + sessionID);
+        return true;
     };
     
     // Shutdown the ZeroRPC connections and terminate it.
     this.shutdown = function(callback) {
         try {
+            clearTimeout(graceTimer);
+            graceTimer = null;
+            
             console.log("Closing Node->REDHAWK Server");
             server.close();
             
-            console.log("Closing Node<-REDHAWK Client");
-            gateway.kill();
+            if (shared) {
+                console.log("Closing session on shared RH Gateway");
+                client.invoke("closeSession", sessionID, function(error, response, more) {});
+            }
+            else {
+                console.log("Closing Node<-REDHAWK Client");
+                if (null != standby) {
+                    client.close();
+                }
+                gateway.kill();
+            }
         }
         catch (error) {
             console.error("Error on shutdown of session"); console.error(error);